@@ -0,0 +1,85 @@
+"""
+Admisión y planificación de los trabajos de video.
+
+Antes, `generate_video` encolaba sin límite: una ceremonia con muchas familias podía
+acumular decenas de renders detrás de un único trabajador sin que nadie supiera cuánto
+iba a esperar. Ahora, antes de crear un trabajo, la aplicación comprueba:
+
+- profundidad de la cola: con la cola pública llena se rechaza con 503 y Retry-After;
+- duplicados: pedir otra vez un video que ya está en cola no crea otro trabajo;
+- límites por IP y por persona en una ventana deslizante (429 y Retry-After);
+- carril: los trabajos del administrador tienen más prioridad que los públicos y
+  no cuentan para la profundidad ni para los límites;
+- espacio en disco: sin espacio libre o con los videos por encima de su cuota (ver
+  storage.py) no se encola ningún video, tampoco del administrador (503).
+
+Los contadores se leen de la propia tabla `video_job`, que comparten todos los procesos
+de gunicorn. Este módulo reúne la parte que no toca la base de datos: carriles, clave
+anónima del cliente, estimación de la espera y su texto para la página pública.
+"""
+import hashlib
+import hmac
+import math
+
+LANE_PUBLIC = 'public'
+LANE_ADMIN = 'admin'
+# Prioridad de cada carril: los trabajadores reclaman primero la mayor
+LANE_PRIORITY = {LANE_PUBLIC: 0, LANE_ADMIN: 10}
+
+REASON_QUEUE_FULL = 'queue_full'
+REASON_RATE_CLIENT = 'rate_client'
+REASON_RATE_PERSONA = 'rate_persona'
+REASON_STORAGE_FULL = 'storage_full'
+
+
+class AdmissionRejected(Exception):
+    """Solicitud de video rechazada por la cola llena, el disco lleno o un límite de frecuencia."""
+
+    def __init__(self, reason, retry_after, message):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.message = message
+
+    @property
+    def status_code(self):
+        # 503: el servicio está saturado para todos; 429: este cliente o persona pidió demasiado
+        return 503 if self.reason in (REASON_QUEUE_FULL, REASON_STORAGE_FULL) else 429
+
+
+def client_key(address, secret):
+    """Identificador anónimo y estable de un cliente: no se guarda su IP."""
+    digest = hmac.new(secret.encode('utf-8'), (address or '').encode('utf-8'), hashlib.sha256)
+    return digest.hexdigest()[:32]
+
+
+def window_retry_after(oldest, window_seconds, now):
+    """Segundos hasta que la solicitud más antigua de la ventana deje de contar."""
+    return max(1.0, (oldest - now).total_seconds() + window_seconds)
+
+
+def estimate_wait(ahead, running_remaining, average_seconds, concurrency, own_remaining=1.0):
+    """
+    Segundos estimados hasta que un trabajo termine.
+
+    `ahead` son los trabajos en cola por delante, `running_remaining` la fracción que
+    falta de los que están en curso (sumada) y `own_remaining` la del propio trabajo
+    (1 en cola). Con `concurrency` trabajadores, lo de delante se reparte entre ellos.
+    """
+    concurrency = max(1, concurrency)
+    return (max(0.0, ahead + running_remaining) / concurrency + own_remaining) * average_seconds
+
+
+def describe_wait(seconds):
+    """Texto aproximado de una espera, para mostrar en la página pública."""
+    if seconds is None:
+        return ''
+    minutos = int(round(seconds / 60))
+    if minutos < 1:
+        return 'menos de un minuto'
+    if minutos == 1:
+        return 'un minuto aproximadamente'
+    if minutos < 60:
+        return f'unos {minutos} minutos'
+    horas, resto = divmod(minutos, 60)
+    return f'aproximadamente {horas} h {resto:02d} min'
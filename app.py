@@ -1,78 +1,270 @@
+import time
+_inicio_arranque = time.perf_counter() # Referencia para medir el arranque (STARTUP_TIMING=1)
 import os
+import json
 import threading
-from queue import Queue
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import logging
-import subprocess # Importar subprocess para ejecutar comandos FFmpeg
 import shutil # Para eliminar directorios temporales
-from io import BytesIO # Importar BytesIO para manejar el PDF en memoria
+import tempfile # Archivos temporales para las exportaciones
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, send_file,
+                   send_from_directory, abort, Response, stream_with_context, jsonify, make_response)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert, select, update
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
-import qrcode
-from moviepy import ImageSequenceClip # Usar ImageSequenceClip en lugar de ImageClip y concatenate_videoclips
-from PIL import Image # Importar la librería Pillow para manipulación de imágenes
+import click
+
+import image_pipeline # Preprocesamiento paralelo de imágenes para el video (Pillow se importa al usarlo)
+import video_engine # Motores de codificación del video (FFmpeg nativo o MoviePy)
+import search # Índices de búsqueda por nombre (FTS5 / pg_trgm)
+import bulk_import # Lectura y validación de importaciones masivas
 
 # --- DEPENDENCIAS EXTERNAS IMPORTANTES ---
 #
 # Para que la generación de video funcione, este proyecto depende de software externo
 # que debe estar instalado en el sistema donde se ejecuta la aplicación:
 #
-# 1. FFmpeg: Es OBLIGATORIO. MoviePy lo usa internamente para crear los videos.
+# 1. FFmpeg: Es OBLIGATORIO. El motor de video por defecto lo invoca directamente
+#    y MoviePy (motor alternativo) lo usa internamente para crear los videos.
 #    - Instrucciones de instalación: https://www.geeksforgeforgeeks.org/how-to-install-ffmpeg-on-windows/
 #    - Asegúrate de que el ejecutable de `ffmpeg` esté disponible en el PATH del sistema
 #      para que MoviePy pueda encontrarlo automáticamente.
 #
-# 2. ImageMagick: Es MUY RECOMENDADO. MoviePy lo necesita para procesar imágenes
+# 2. ImageMagick: Es MUY RECOMENDADO si se usa el motor MoviePy. MoviePy lo necesita para procesar imágenes
 #    de forma robusta y renderizar texto. La falta de ImageMagick es una causa
 #    muy común de errores inesperados con imágenes.
 #    - Instrucciones de instalación: https://imagemagick.org/script/download.php
 #
 # ----------------------------------------------------------------------------------
 
-# --- PARA GENERACIÓN DE PDF ---
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Image as ReportLabImage, Paragraph, Spacer
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-# --- FIN PARA GENERACIÓN DE PDF ---
+# --- PARA GENERACIÓN DE PDF Y CSV ---
+import exports # Exportación del registro por bloques (ReportLab se importa al exportar)
+import qr_service # Códigos QR bajo demanda con caché en memoria y en disco
+import metrics # Tiempos por etapa del pipeline de video y formato Prometheus para /metrics
+import segment_cache # Segmentos de video por foto para volver a generar solo lo que cambió
+import database # Motor de base de datos (PostgreSQL/SQLite) y migraciones del esquema
+import page_cache # ETag y caché en memoria de la página pública de cada persona
+import music_library # Pistas de música de fondo y stems AAC preparados una sola vez
+import admission # Límites de la cola de videos, carriles de prioridad y espera estimada
+import transitions # Estilos del video: fundidos, zoom lento y tarjeta de título en un grafo de FFmpeg
+import storage # Escrituras atómicas, barrido de archivos huérfanos y cuotas de disco
+import pools # Pools de procesos compartidos (fotos del video y QR de las importaciones)
+# --- FIN PARA GENERACIÓN DE PDF Y CSV ---
 
 # --- CONFIGURACIÓN DE LOGGING ---
-logging.basicConfig(level=logging.DEBUG,
+# LOG_LEVEL=DEBUG para depurar; en producción basta INFO (incluye las líneas 'span' de tiempos)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+# STARTUP_TIMING=1 escribe en el log la duración de cada fase del arranque y de la primera petición
+arranque = metrics.StartupTimer(_inicio_arranque,
+                                enabled=os.environ.get('STARTUP_TIMING', 'false').lower() in ('1', 'true', 'yes'))
+arranque.mark('imports')
+
 # --- CONFIGURACIÓN DE LA APLICACIÓN FLASK ---
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'una-clave-secreta-muy-dificil-de-adivinar'
+# Firma las sesiones y anonimiza las IP de la admisión de videos (ver admission.client_key).
+# En producción la define el entorno (render.yaml la genera); el valor fijo es solo para desarrollo.
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'una-clave-secreta-muy-dificil-de-adivinar'
 
-# Configuración de la base de datos SQLite
+# Configuración de la base de datos: DATABASE_URL (PostgreSQL en producción) o SQLite en 'instance'
 basedir = os.path.abspath(os.path.dirname(__file__))
-instance_path = os.path.join(basedir, 'instance')
-os.makedirs(instance_path, exist_ok=True)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(instance_path, 'database.db')
+instance_path = os.path.join(basedir, 'instance')  # Se crea en prepare_database()
+app.config['SQLALCHEMY_DATABASE_URI'] = database.database_url(os.environ.get('DATABASE_URL'),
+                                                              os.path.join(instance_path, 'database.db'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool de PostgreSQL por proceso: cada proceso de gunicorn (con sus hilos) y cada codificador
+# abre hasta DB_POOL_SIZE + DB_MAX_OVERFLOW conexiones; ajustar al límite del servidor.
+# En SQLite, SQLITE_BUSY_TIMEOUT_MS es lo que una escritura espera al bloqueo antes de fallar.
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=app.config['DB_POOL_SIZE'],
+    max_overflow=app.config['DB_MAX_OVERFLOW'],
+    pool_recycle=app.config['DB_POOL_RECYCLE'],
+    pool_timeout=app.config['DB_POOL_TIMEOUT'],
+    busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT_MS'],
+)
+# Actualizar el esquema al importar la aplicación. Con DB_AUTO_MIGRATE=false se hace
+# solo con `flask --app app db-upgrade` (p. ej. en el paso de despliegue).
+app.config['DB_AUTO_MIGRATE'] = os.environ.get('DB_AUTO_MIGRATE', 'true').lower() in ('1', 'true', 'yes')
+
+# Exportaciones del registro: hasta EXPORT_SYNC_MAX_ROWS el PDF se genera en la petición;
+# por encima, en segundo plano en EXPORT_FOLDER (fuera de 'static', solo para el administrador)
+app.config['EXPORT_FOLDER'] = os.path.join(instance_path, 'exports')
+app.config['EXPORT_SYNC_MAX_ROWS'] = int(os.environ.get('EXPORT_SYNC_MAX_ROWS', 2000))
+app.config['EXPORT_RETENTION_SECONDS'] = 24 * 3600  # Las borra el barrido de almacenamiento (sweep_storage)
+
+# Importación masiva: registros por transacción y procesos para generar los QR
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+app.config['IMPORT_QR_WORKERS'] = int(os.environ.get('IMPORT_QR_WORKERS', os.cpu_count() or 1))
+
+# Códigos QR: se generan bajo demanda y se guardan por hash de contenido, formato y tamaño
+app.config['QR_BASE_URL'] = os.environ.get('QR_BASE_URL', 'https://memorialscan.onrender.com').rstrip('/')
+app.config['QR_CACHE_FOLDER'] = os.path.join(instance_path, 'qr_cache')
+app.config['QR_MEMORY_CACHE_ITEMS'] = int(os.environ.get('QR_MEMORY_CACHE_ITEMS', 512))
+app.config['QR_CACHE_MAX_AGE'] = 24 * 3600
+app.config['QR_DEFAULT_SIZE'] = 256
+app.config['QR_PDF_SIZE'] = 128  # Tamaño usado al imprimir y en el PDF (se dibuja a 50x50 pt)
+
+# Página pública de cada persona: se revalida con ETag/Last-Modified (304 sin cuerpo) y el
+# HTML se guarda en memoria por versión. VIEW_PAGE_MAX_AGE es lo que el navegador puede
+# reutilizarla sin preguntar (0 = revalidar siempre).
+app.config['VIEW_PAGE_MAX_AGE'] = int(os.environ.get('VIEW_PAGE_MAX_AGE', 60))
+app.config['VIEW_PAGE_CACHE_ITEMS'] = int(os.environ.get('VIEW_PAGE_CACHE_ITEMS', 1024))
+
+# Registros por página en el panel de administración
+app.config['ADMIN_PAGE_SIZE'] = int(os.environ.get('ADMIN_PAGE_SIZE', 50))
 
 # Configuración de carpetas para subidas de archivos
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'static', 'uploads')
-app.config['QR_CODE_FOLDER'] = os.path.join(basedir, 'static', 'qrcodes')
 app.config['VIDEO_FOLDER'] = os.path.join(basedir, 'static', 'videos')
 app.config['MUSIC_FOLDER'] = os.path.join(basedir, 'static', 'music')
-
-# Asegurarse de que las carpetas de trabajo existan
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['QR_CODE_FOLDER'], exist_ok=True)
-os.makedirs(app.config['VIDEO_FOLDER'], exist_ok=True)
-os.makedirs(app.config['MUSIC_FOLDER'], exist_ok=True) # Asegurar que la carpeta de música exista
-
-# Cola para manejar las solicitudes de generación de video de forma asíncrona
-video_generation_queue = Queue()
-
-db = SQLAlchemy(app)
+# Música de fondo: cada pista se convierte una vez por duración de video a un stem AAC
+# normalizado (MUSIC_LOUDNESS_LUFS) con fundido de salida, que el render copia sin recodificar.
+app.config['MUSIC_CACHE_FOLDER'] = os.path.join(instance_path, 'music_cache')
+app.config['MUSIC_DEFAULT_TRACK'] = os.environ.get('MUSIC_DEFAULT_TRACK', 'background_music.mp3')
+app.config['MUSIC_LOUDNESS_LUFS'] = float(os.environ.get('MUSIC_LOUDNESS_LUFS', -18))
+app.config['MUSIC_FADE_SECONDS'] = float(os.environ.get('MUSIC_FADE_SECONDS', 3))
+app.config['MUSIC_BITRATE'] = os.environ.get('MUSIC_BITRATE', '128k')
+
+# Los videos generados nunca cambian de contenido (el nombre lleva la marca de tiempo)
+app.config['VIDEO_CACHE_MAX_AGE'] = 365 * 24 * 3600
+# Generar además rendiciones HLS (360p/540p/720p) para reproducción adaptativa
+app.config['VIDEO_HLS_ENABLED'] = os.environ.get('VIDEO_HLS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# Motor de codificación del video: 'ffmpeg' (nativo, una sola pasada) o 'moviepy' (alternativo)
+app.config['VIDEO_BACKEND'] = os.environ.get('VIDEO_BACKEND', 'ffmpeg')
+app.config['FFMPEG_BINARY'] = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+app.config['VIDEO_WIDTH'] = 1280
+app.config['VIDEO_HEIGHT'] = 720
+# Cómo ajustar fotos con otra relación de aspecto: 'letterbox' (bandas negras) o 'crop' (recorte)
+app.config['VIDEO_FIT_MODE'] = os.environ.get('VIDEO_FIT_MODE', 'letterbox')
+app.config['IMAGE_PREPROCESS_WORKERS'] = int(os.environ.get('IMAGE_PREPROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+# Procesos para generar miniaturas y masters al subir imágenes (1 = dentro de la petición)
+app.config['IMAGE_INGEST_WORKERS'] = int(os.environ.get('IMAGE_INGEST_WORKERS', 1))
+# Render incremental (motor ffmpeg): cada foto se codifica una vez como segmento y el video
+# se obtiene concatenándolos sin recodificar. Volver a generar solo codifica las fotos nuevas.
+app.config['VIDEO_SEGMENT_CACHE'] = os.environ.get('VIDEO_SEGMENT_CACHE', 'true').lower() in ('1', 'true', 'yes')
+app.config['VIDEO_SEGMENT_CACHE_FOLDER'] = os.path.join(instance_path, 'segment_cache')
+app.config['VIDEO_SEGMENT_WORKERS'] = int(os.environ.get('VIDEO_SEGMENT_WORKERS', min(2, os.cpu_count() or 1)))
+# Estilo del video de las personas que no eligieron uno ('clasico', 'suave' o 'movimiento').
+# Los estilos con efectos se codifican enteros en cada render (no usan la caché de segmentos).
+app.config['VIDEO_STYLE_DEFAULT'] = os.environ.get('VIDEO_STYLE_DEFAULT', transitions.STYLE_CLASSIC)
+# Fuente TrueType de la tarjeta de título (por defecto, la primera de transitions.TITLE_FONTS que exista)
+app.config['VIDEO_TITLE_FONT'] = os.environ.get('VIDEO_TITLE_FONT')
+
+# Almacenamiento (ver storage.py). Cuotas por área en MB (0 = sin límite): las cachés se recortan
+# empezando por lo usado hace más tiempo; si 'videos' o 'uploads' pasan la suya, o quedan menos de
+# STORAGE_MIN_FREE_MB libres en el disco, no se aceptan subidas ni videos nuevos.
+app.config['STORAGE_QUOTAS_MB'] = {
+    'videos': int(os.environ.get('STORAGE_QUOTA_VIDEOS_MB', 0)),
+    'uploads': int(os.environ.get('STORAGE_QUOTA_UPLOADS_MB', 0)),
+    'segment_cache': int(os.environ.get('STORAGE_QUOTA_SEGMENT_CACHE_MB', 2048)),
+    'music_cache': int(os.environ.get('STORAGE_QUOTA_MUSIC_CACHE_MB', 256)),
+    'qr_cache': int(os.environ.get('STORAGE_QUOTA_QR_CACHE_MB', 512)),
+    'exports': int(os.environ.get('STORAGE_QUOTA_EXPORTS_MB', 1024)),
+}
+app.config['STORAGE_MIN_FREE_MB'] = int(os.environ.get('STORAGE_MIN_FREE_MB', 500))
+# El barrido no toca nada modificado hace menos de STORAGE_GRACE_SECONDS (escrituras en curso)
+app.config['STORAGE_GRACE_SECONDS'] = int(os.environ.get('STORAGE_GRACE_SECONDS', 3600))
+# Cada cuánto barre `worker.py` (0 = solo a mano, con `flask storage-sweep`)
+app.config['STORAGE_SWEEP_INTERVAL_SECONDS'] = int(os.environ.get('STORAGE_SWEEP_INTERVAL_SECONDS', 6 * 3600))
+app.config['STORAGE_USAGE_REFRESH_SECONDS'] = int(os.environ.get('STORAGE_USAGE_REFRESH_SECONDS', 300))
+# QR antiguos guardados en static antes de la caché de QR (Persona.qr_code_path)
+app.config['LEGACY_QR_FOLDER'] = os.path.join(basedir, 'static', 'qrcodes')
+
+# Carpetas de trabajo que se crean al arrancar (ver create_app)
+WORK_FOLDERS = ('UPLOAD_FOLDER', 'QR_CACHE_FOLDER', 'VIDEO_FOLDER', 'MUSIC_FOLDER', 'EXPORT_FOLDER',
+                'MUSIC_CACHE_FOLDER')
+
+# Papel del proceso: 'web' solo atiende peticiones (los videos los procesa `python worker.py`);
+# 'all' además procesa la cola de videos en un hilo (un único proceso, p. ej. en desarrollo).
+# Importar este módulo no arranca nada: el trabajo en segundo plano empieza en create_app().
+ROLE_WEB = 'web'
+ROLE_WORKER = 'worker'
+ROLE_ALL = 'all'
+app.config['APP_ROLE'] = os.environ.get('APP_ROLE', ROLE_WEB)
+
+# Caché de QR de este proceso (la de disco se comparte con gunicorn y el trabajador)
+qr_cache = qr_service.QrCache(app.config['QR_CACHE_FOLDER'], app.config['QR_MEMORY_CACHE_ITEMS'])
+# Páginas públicas ya renderizadas de este proceso, por ETag
+view_page_cache = page_cache.PageCache(app.config['VIEW_PAGE_CACHE_ITEMS'])
+# Biblioteca de música (el listado de pistas se refresca cada minuto)
+music = music_library.MusicLibrary(
+    app.config['MUSIC_FOLDER'], app.config['MUSIC_CACHE_FOLDER'],
+    default_track=app.config['MUSIC_DEFAULT_TRACK'],
+    loudness=app.config['MUSIC_LOUDNESS_LUFS'],
+    fade_seconds=app.config['MUSIC_FADE_SECONDS'],
+    bitrate=app.config['MUSIC_BITRATE'],
+    ffmpeg_bin=app.config['FFMPEG_BINARY'],
+)
+
+# Configuración de la cola persistente de trabajos de video.
+# Los trabajos viven en la base de datos (tabla video_job) y los procesa `worker.py`,
+# de modo que sobreviven a reinicios y funcionan con varios procesos de gunicorn.
+app.config['VIDEO_JOB_MAX_ATTEMPTS'] = int(os.environ.get('VIDEO_JOB_MAX_ATTEMPTS', 3))
+app.config['VIDEO_JOB_RETRY_BASE_SECONDS'] = int(os.environ.get('VIDEO_JOB_RETRY_BASE_SECONDS', 30))
+app.config['VIDEO_JOB_HEARTBEAT_SECONDS'] = int(os.environ.get('VIDEO_JOB_HEARTBEAT_SECONDS', 15))
+app.config['VIDEO_JOB_STALE_SECONDS'] = int(os.environ.get('VIDEO_JOB_STALE_SECONDS', 120))
+app.config['VIDEO_WORKER_POLL_SECONDS'] = float(os.environ.get('VIDEO_WORKER_POLL_SECONDS', 2))
+app.config['VIDEO_WORKER_PROCESSES'] = int(os.environ.get('VIDEO_WORKER_PROCESSES', os.cpu_count() or 1))
+# Historial: `worker.py` elimina los tiempos por etapa y los trabajos terminados de hace más
+# de VIDEO_HISTORY_RETENTION_DAYS días (0 = no se elimina nada). Los contadores de /metrics
+# no dependen de esas filas (ver VideoMetric).
+app.config['VIDEO_HISTORY_RETENTION_DAYS'] = int(os.environ.get('VIDEO_HISTORY_RETENTION_DAYS', 30))
+# Progreso en vivo: el trabajador guarda etapa y porcentaje en video_job (como mucho cada
+# JOB_PROGRESS_MIN_INTERVAL s) y las páginas lo reciben por Server-Sent Events.
+# Cada conexión SSE dura JOB_STATUS_STREAM_SECONDS (menos que el timeout de gunicorn) y el
+# navegador se reconecta solo; con 0 se desactiva SSE y la página consulta /status cada pocos segundos.
+# Cada conexión ocupa un hilo de gunicorn mientras dura: cada proceso abre como mucho
+# JOB_STATUS_MAX_STREAMS a la vez (menos que sus --threads) y las demás páginas reciben un
+# 503 y consultan /status.
+app.config['JOB_PROGRESS_MIN_INTERVAL'] = float(os.environ.get('JOB_PROGRESS_MIN_INTERVAL', 1))
+app.config['JOB_STATUS_POLL_SECONDS'] = float(os.environ.get('JOB_STATUS_POLL_SECONDS', 1))
+app.config['JOB_STATUS_STREAM_SECONDS'] = int(os.environ.get('JOB_STATUS_STREAM_SECONDS', 25))
+app.config['JOB_STATUS_MAX_STREAMS'] = int(os.environ.get('JOB_STATUS_MAX_STREAMS', 4))
+# Admisión de solicitudes de video (ver admission.py). Las del administrador no cuentan
+# para los límites. Con 0 se desactiva el límite correspondiente.
+# - VIDEO_QUEUE_MAX_DEPTH: trabajos públicos en cola a partir de los cuales se rechaza con 503
+# - VIDEO_RATE_CLIENT_MAX / VIDEO_RATE_PERSONA_MAX: solicitudes por IP y por persona en
+#   VIDEO_RATE_WINDOW_SECONDS (429)
+app.config['VIDEO_QUEUE_MAX_DEPTH'] = int(os.environ.get('VIDEO_QUEUE_MAX_DEPTH', 30))
+app.config['VIDEO_RATE_WINDOW_SECONDS'] = int(os.environ.get('VIDEO_RATE_WINDOW_SECONDS', 3600))
+app.config['VIDEO_RATE_CLIENT_MAX'] = int(os.environ.get('VIDEO_RATE_CLIENT_MAX', 5))
+app.config['VIDEO_RATE_PERSONA_MAX'] = int(os.environ.get('VIDEO_RATE_PERSONA_MAX', 3))
+# Espera estimada: media de los últimos VIDEO_ESTIMATE_SAMPLES renders (o el valor por defecto
+# si aún no hay ninguno), recalculada como mucho cada VIDEO_ESTIMATE_REFRESH_SECONDS
+app.config['VIDEO_ESTIMATE_SAMPLES'] = int(os.environ.get('VIDEO_ESTIMATE_SAMPLES', 20))
+app.config['VIDEO_ESTIMATE_DEFAULT_SECONDS'] = float(os.environ.get('VIDEO_ESTIMATE_DEFAULT_SECONDS', 120))
+app.config['VIDEO_ESTIMATE_REFRESH_SECONDS'] = float(os.environ.get('VIDEO_ESTIMATE_REFRESH_SECONDS', 30))
+# Detrás de un proxy (Render) la IP del cliente llega en X-Forwarded-For: número de proxies de confianza
+app.config['TRUSTED_PROXY_HOPS'] = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if app.config['TRUSTED_PROXY_HOPS'] > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_HOPS'])
+# Si se define, /metrics exige la cabecera "Authorization: Bearer <METRICS_TOKEN>"
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+db = SQLAlchemy(app)  # Crea el motor sin conectar; los PRAGMA de SQLite se registran en prepare_database()
 
 # --- MODELO DE BASE DE DATOS ---
+def _utcnow():
+    """Fecha y hora actual en UTC, sin zona horaria (como se guarda en la base de datos)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class Persona(db.Model):
+    __table_args__ = (
+        # Filtros de estado del panel + paginación por id (el orden de columnas
+        # permite usar el índice con cualquiera de los prefijos de ESTADO_FILTROS)
+        db.Index('ix_persona_estado', 'video_processing', 'video_generated', 'images_uploaded', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(150), nullable=False)
     fecha_nacimiento = db.Column(db.Date, nullable=False)
@@ -82,170 +274,1020 @@ class Persona(db.Model):
     video_generated = db.Column(db.Boolean, default=False)
     video_path = db.Column(db.String(200), nullable=True)
     video_processing = db.Column(db.Boolean, default=False)
+    hls_path = db.Column(db.String(200), nullable=True) # Lista maestra HLS relativa a 'static'
+    music_track = db.Column(db.String(255), nullable=True) # Pista elegida de static/music (None = por defecto)
+    video_style = db.Column(db.String(20), nullable=True) # Estilo de transitions.STYLES (None = VIDEO_STYLE_DEFAULT)
+    # Sus fotos ya están en la tabla Imagen (o se intentó y ninguna era válida): no hay que volver a registrarlas
+    images_indexed = db.Column(db.Boolean, default=False)
+    # Última modificación de la fila: Last-Modified y ETag de la página pública
+    updated_at = db.Column(db.DateTime, nullable=True, default=_utcnow, onupdate=_utcnow)
+    imagenes = db.relationship('Imagen', order_by='Imagen.posicion', lazy=True,
+                               cascade='all, delete-orphan', backref='persona')
 
     def __repr__(self):
         return f'<Persona {self.nombre}>'
 
-# --- LÓGICA DEL TRABAJADOR DE VIDEO (SEGUNDO PLANO) ---
-def video_worker():
+class Imagen(db.Model):
+    """Imagen subida de una persona con sus derivados (miniaturas y master para el video)."""
+    id = db.Column(db.Integer, primary_key=True)
+    persona_id = db.Column(db.Integer, db.ForeignKey('persona.id'), nullable=False, index=True)
+    posicion = db.Column(db.Integer, nullable=False, default=0)
+    filename = db.Column(db.String(255), nullable=False)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    # Rutas relativas a la carpeta 'static', como qr_code_path y video_path
+    original_path = db.Column(db.String(300), nullable=False)
+    thumb_webp_path = db.Column(db.String(300), nullable=True)
+    thumb_jpeg_path = db.Column(db.String(300), nullable=True)
+    thumb_width = db.Column(db.Integer, nullable=True)
+    thumb_height = db.Column(db.Integer, nullable=True)
+    master_path = db.Column(db.String(300), nullable=True)
+
+    def __repr__(self):
+        return f'<Imagen {self.persona_id}/{self.filename}>'
+
+# Estados posibles de un trabajo de video
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Etapas de un trabajo en curso y el tramo del porcentaje total que ocupa cada una
+STAGE_PREPROCESS = 'preprocess'
+STAGE_ENCODE = 'encode'
+STAGE_MUX = 'mux'
+# Tramos medidos solo para las métricas (además de las etapas anteriores)
+SPAN_QUEUE_WAIT = 'queue_wait'   # Desde que el trabajo está disponible hasta que un trabajador lo toma
+SPAN_DISCOVER = 'discover'       # Localizar las imágenes de la persona
+SPAN_RESIZE = 'resize'           # Cada imagen preparada (una medición por imagen)
+SPAN_HASH = 'hash'               # Calcular las claves de los segmentos en caché
+SPAN_CONCAT = 'concat'           # Unir los segmentos y mezclar el audio (copia, sin recodificar)
+SPAN_MUSIC = 'music'             # Obtener el stem de audio (solo convierte la primera vez)
+SPAN_RENDER = 'render'           # Todo el render, de principio a fin
+SPAN_COMMIT = 'commit'           # Guardar el resultado en la base de datos
+JOB_STAGE_ETIQUETAS = {
+    JOB_QUEUED: 'En cola',
+    STAGE_PREPROCESS: 'Preparando las imágenes',
+    STAGE_ENCODE: 'Codificando el video',
+    STAGE_MUX: 'Empaquetando el video',
+}
+
+class VideoJob(db.Model):
+    """Trabajo de generación de video persistido en la base de datos."""
+    __tablename__ = 'video_job'
+    __table_args__ = (
+        # Orden en que los trabajadores reclaman la cola (ver claim_next_video_job)
+        db.Index('ix_video_job_cola', 'status', 'priority', 'available_at', 'id'),
+        # Límite de solicitudes por cliente en la ventana de VIDEO_RATE_WINDOW_SECONDS
+        db.Index('ix_video_job_cliente', 'client_key', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    persona_id = db.Column(db.Integer, db.ForeignKey('persona.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default=JOB_QUEUED, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    available_at = db.Column(db.DateTime, nullable=False, default=_utcnow, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=_utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    worker_id = db.Column(db.String(100), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    stage = db.Column(db.String(20), nullable=True)       # Etapa actual (STAGE_*) mientras está en curso
+    progress = db.Column(db.Integer, nullable=True)       # Porcentaje total estimado (0-100)
+    output_bytes = db.Column(db.Integer, nullable=True)   # Tamaño del MP4 generado
+    priority = db.Column(db.Integer, nullable=True, default=0)  # Mayor = antes (admission.LANE_PRIORITY)
+    client_key = db.Column(db.String(32), nullable=True)  # Cliente anónimo que lo pidió (admission.client_key)
+
+    def __repr__(self):
+        return f'<VideoJob {self.id} persona={self.persona_id} {self.status}>'
+
+class VideoJobSpan(db.Model):
+    """Duración de una etapa de un intento de trabajo de video (fuente de los histogramas de /metrics)."""
+    __tablename__ = 'video_job_span'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('video_job.id'), nullable=False, index=True)
+    attempt = db.Column(db.Integer, nullable=False)
+    stage = db.Column(db.String(20), nullable=False, index=True)
+    seconds = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=_utcnow, index=True)  # Recorte del historial
+
+class VideoMetric(db.Model):
     """
-    Función que se ejecuta en un hilo separado.
-    Espera tareas en la cola y genera los videos uno por uno.
+    Muestra acumulada de un contador o histograma de /metrics (ver metrics.counter_sample).
+    Cada proceso la incrementa en la transacción que registra lo medido, así que el valor
+    solo crece: no depende de las filas de video_job ni de video_job_span, que se borran.
     """
-    while True:
-        app.logger.info("Trabajador de video esperando una nueva tarea...")
-        person_id = video_generation_queue.get() 
+    __tablename__ = 'video_metric'
+    name = db.Column(db.String(80), primary_key=True)
+    labels = db.Column(db.String(120), primary_key=True, default='')
+    sample = db.Column(db.String(30), primary_key=True, default='')
+    value = db.Column(db.Float, nullable=False, default=0)
 
-        if person_id is None:
-            app.logger.info("Señal de terminación recibida. Saliendo del trabajador de video.")
-            break
-
-        app.logger.info(f"Tarea recibida. Iniciando generación de video para la persona con ID: {person_id}")
-        
-        with app.app_context():
-            persona = db.session.get(Persona, person_id)
-            if not persona:
-                app.logger.error(f"Error Crítico: Persona con ID {person_id} no encontrada en la base de datos.")
-                video_generation_queue.task_done()
+def add_missing_columns():
+    """
+    Añade a las tablas existentes las columnas nuevas de los modelos.
+    create_all solo crea tablas que no existen; las columnas añadidas después
+    (siempre opcionales) se agregan aquí con ALTER TABLE.
+    """
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
                 continue
-            
-            # Definir variables fuera del try para poder limpiarlas en el finally
-            video_sin_audio_filepath_abs = None
-            video_final_filepath_abs = None
-            temp_resized_folder = None # Inicializar para el bloque finally
+            existentes = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existentes:
+                    continue
+                tipo = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {tipo}'))
+                app.logger.info(f"Columna añadida: {table.name}.{column.name} ({tipo})")
+
+def add_missing_indexes():
+    """Crea los índices declarados en los modelos que aún no existan en tablas ya creadas."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def _persona_booleanos_sin_nulos(conn):
+    """
+    Las filas creadas antes de añadir un indicador (o con INSERT masivos sin valor) tienen
+    NULL en vez de False y no aparecían en los filtros de estado del panel.
+    """
+    for columna in ('images_uploaded', 'video_generated', 'video_processing'):
+        conn.execute(update(Persona.__table__)
+                     .where(Persona.__table__.c[columna].is_(None))
+                     .values({columna: False}))
+
+def _persona_indicadores_coherentes(conn):
+    """Un video generado sin archivo registrado no se puede mostrar: se marca como no generado."""
+    tabla = Persona.__table__
+    conn.execute(update(tabla)
+                 .where(tabla.c.video_generated.is_(True), tabla.c.video_path.is_(None))
+                 .values(video_generated=False))
+
+def _persona_updated_at_inicial(conn):
+    """Fecha de modificación para las filas anteriores a la columna updated_at."""
+    tabla = Persona.__table__
+    conn.execute(update(tabla).where(tabla.c.updated_at.is_(None)).values(updated_at=_utcnow()))
+
+def _video_job_prioridad_inicial(conn):
+    """Los trabajos anteriores a los carriles de prioridad van en el carril público."""
+    tabla = VideoJob.__table__
+    conn.execute(update(tabla).where(tabla.c.priority.is_(None))
+                 .values(priority=admission.LANE_PRIORITY[admission.LANE_PUBLIC]))
+
+def _persona_images_indexed_inicial(conn):
+    """Las personas que ya tienen filas en Imagen no necesitan el registro de sus fotos antiguas."""
+    tabla = Persona.__table__
+    con_imagenes = select(Imagen.__table__.c.persona_id).distinct()
+    conn.execute(update(tabla).where(tabla.c.id.in_(con_imagenes)).values(images_indexed=True))
+    conn.execute(update(tabla).where(tabla.c.images_indexed.is_(None)).values(images_indexed=False))
+
+def _video_metric_inicial(conn):
+    """Contadores e histogramas acumulados a partir de los trabajos y tiempos ya guardados."""
+    muestras = list(_video_metric_samples_from_rows(conn))
+    if muestras:
+        conn.execute(database.increment_statement(VideoMetric.__table__, conn.dialect.name),
+                     metrics.merge_samples(muestras))
+
+# Migraciones versionadas: (versión, nombre, función(conn)). Se aplican una sola vez y en orden.
+# Las tablas, columnas opcionales e índices nuevos de los modelos no necesitan entrada aquí
+# (los crea `migrate_schema`); sí los cambios de datos o de columnas existentes.
+# Añadir siempre al final con una versión mayor y no modificar las ya publicadas.
+SCHEMA_MIGRATIONS = [
+    (1, 'persona_booleanos_sin_nulos', _persona_booleanos_sin_nulos),
+    (2, 'persona_indicadores_coherentes', _persona_indicadores_coherentes),
+    (3, 'persona_updated_at_inicial', _persona_updated_at_inicial),
+    (4, 'video_job_prioridad_inicial', _video_job_prioridad_inicial),
+    (5, 'video_metric_inicial', _video_metric_inicial),
+    (6, 'persona_images_indexed_inicial', _persona_images_indexed_inicial),
+]
+
+def migrate_schema():
+    """
+    Lleva la base de datos al esquema actual: crea las tablas, columnas e índices que falten
+    y aplica las migraciones versionadas pendientes. Es idempotente. Devuelve las aplicadas.
+    """
+    huella = database.metadata_fingerprint(db.metadata)
+    if database.schema_is_current(db.engine, huella, [version for version, _, _ in SCHEMA_MIGRATIONS]):
+        return []  # Arranque habitual: nada que inspeccionar
+    db.create_all()
+    add_missing_columns()
+    add_missing_indexes()
+    aplicadas = database.run_migrations(db.engine, SCHEMA_MIGRATIONS)
+    database.store_fingerprint(db.engine, huella)
+    return aplicadas
+
+# Backend de búsqueda por nombre activo ('fts5', 'trigram' o 'like'). Se decide (y se crea el
+# índice si falta) en la primera búsqueda: la página pública nunca lo necesita.
+_search_backend = None
+_search_backend_lock = threading.Lock()
+
+def search_backend():
+    global _search_backend
+    with _search_backend_lock:
+        if _search_backend is None:
+            _search_backend = search.setup_search_index(db.engine)
+        return _search_backend
+
+# --- COLA PERSISTENTE DE TRABAJOS DE VIDEO ---
+def enqueue_video_job(person_id, lane=admission.LANE_PUBLIC, client_key=None):
+    """Añade un trabajo de video a la cola en el carril `lane`. El commit queda a cargo del llamador."""
+    job = VideoJob(persona_id=person_id, max_attempts=app.config['VIDEO_JOB_MAX_ATTEMPTS'],
+                   priority=admission.LANE_PRIORITY[lane], client_key=client_key)
+    db.session.add(job)
+    return job
+
+def request_client_key():
+    """Clave anónima del cliente de la petición actual (para el límite por IP)."""
+    return admission.client_key(request.remote_addr, app.config['SECRET_KEY'])
+
+def check_video_admission(person_id, client_key):
+    """
+    Lanza admission.AdmissionRejected si una solicitud pública no debe entrar en la cola:
+    cola pública llena o demasiadas solicitudes recientes del cliente o para la persona.
+    """
+    publica = admission.LANE_PRIORITY[admission.LANE_PUBLIC]
+    max_cola = app.config['VIDEO_QUEUE_MAX_DEPTH']
+    if max_cola > 0:
+        en_cola = (db.session.query(db.func.count(VideoJob.id))
+                   .filter(VideoJob.status == JOB_QUEUED, VideoJob.priority == publica)
+                   .scalar())
+        if en_cola >= max_cola:
+            # Se libera un hueco cada vez que un trabajador termina un render
+            en_curso = db.session.query(db.func.count(VideoJob.id)).filter(VideoJob.status == JOB_RUNNING).scalar()
+            espera = video_render_average() / max(1, en_curso)
+            raise admission.AdmissionRejected(
+                admission.REASON_QUEUE_FULL, espera,
+                'Ahora mismo se están preparando muchos videos. '
+                f'Vuelve a intentarlo en {admission.describe_wait(espera)}.')
+
+    ahora = _utcnow()
+    ventana = app.config['VIDEO_RATE_WINDOW_SECONDS']
+    limites = (
+        (app.config['VIDEO_RATE_CLIENT_MAX'], VideoJob.client_key == client_key, admission.REASON_RATE_CLIENT,
+         'Has solicitado varios videos en poco tiempo.'),
+        (app.config['VIDEO_RATE_PERSONA_MAX'], VideoJob.persona_id == person_id, admission.REASON_RATE_PERSONA,
+         'El video de esta persona se ha solicitado demasiadas veces.'),
+    )
+    for maximo, filtro, motivo, mensaje in limites:
+        if maximo <= 0 or (motivo == admission.REASON_RATE_CLIENT and client_key is None):
+            continue
+        total, mas_antigua = (db.session.query(db.func.count(VideoJob.id), db.func.min(VideoJob.created_at))
+                              .filter(filtro, VideoJob.priority == publica,
+                                      VideoJob.created_at >= ahora - timedelta(seconds=ventana))
+                              .one())
+        if total >= maximo:
+            espera = admission.window_retry_after(mas_antigua, ventana, ahora)
+            raise admission.AdmissionRejected(
+                motivo, espera, f'{mensaje} Vuelve a intentarlo en {admission.describe_wait(espera)}.')
+
+def admit_video_job(persona, lane, client_key=None):
+    """
+    Encola el video de `persona` en el carril `lane` si se admite la solicitud.
+    Devuelve el trabajo creado, o None si la persona ya tenía uno en cola (solicitud repetida).
+    Lanza admission.AdmissionRejected sin espacio en disco y, en las solicitudes públicas,
+    también por los límites de la cola; entonces el llamador debe hacer rollback.
+    El commit queda a cargo del llamador.
+
+    Las solicitudes públicas comprueban los límites y encolan en una transacción serializada
+    con las demás (database.lock_transaction), así que dos procesos no pueden pasar a la vez
+    el último hueco de la cola: el límite es exacto.
+    """
+    aviso = storage_write_refusal('videos')
+    if aviso:
+        raise admission.AdmissionRejected(admission.REASON_STORAGE_FULL,
+                                          app.config['STORAGE_USAGE_REFRESH_SECONDS'], aviso)
+    if lane == admission.LANE_PUBLIC:
+        database.lock_transaction(db.session, db.engine.dialect.name, database.VIDEO_ADMISSION_LOCK_KEY)
+    # UPDATE condicionado: de dos envíos simultáneos del formulario, solo uno encola.
+    # Va antes de las comprobaciones: en SQLite esta escritura es la que bloquea a los demás.
+    marcada = db.session.execute(
+        update(Persona)
+        .where(Persona.id == persona.id, Persona.video_processing.isnot(True))
+        .values(video_processing=True)
+    )
+    if marcada.rowcount != 1:
+        return None
+    if lane == admission.LANE_PUBLIC:
+        check_video_admission(persona.id, client_key)
+    return enqueue_video_job(persona.id, lane=lane, client_key=client_key)
+
+def claim_next_video_job(worker_id):
+    """
+    Reclama de forma atómica el siguiente trabajo disponible: primero el carril de mayor
+    prioridad y, dentro de cada carril, por orden de llegada. El UPDATE condicionado a status='queued' garantiza que, aunque varios procesos
+    vean el mismo candidato, solo uno de ellos se lo quede.
+    """
+    now = _utcnow()
+    candidatos = (db.session.query(VideoJob.id)
+                  .filter(VideoJob.status == JOB_QUEUED, VideoJob.available_at <= now)
+                  .order_by(VideoJob.priority.desc(), VideoJob.available_at, VideoJob.id)
+                  .limit(5)
+                  .all())
+    db.session.rollback()  # Cerrar la transacción de lectura antes de competir por el trabajo
+    for (job_id,) in candidatos:
+        result = db.session.execute(
+            update(VideoJob)
+            .where(VideoJob.id == job_id, VideoJob.status == JOB_QUEUED)
+            .values(status=JOB_RUNNING, worker_id=worker_id, started_at=now,
+                    heartbeat_at=now, attempts=VideoJob.attempts + 1, stage=None, progress=0)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(VideoJob, job_id)
+    return None
+
+def touch_video_job(job_id, worker_id):
+    """Actualiza el latido de un trabajo en curso usando una conexión propia."""
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(VideoJob.__table__)
+            .where(VideoJob.__table__.c.id == job_id,
+                   VideoJob.__table__.c.worker_id == worker_id,
+                   VideoJob.__table__.c.status == JOB_RUNNING)
+            .values(heartbeat_at=_utcnow())
+        )
 
-            try:
-                # --- LÓGICA PRINCIPAL DE CREACIÓN DE VIDEO ---
+def publish_job_progress(job_id, worker_id, stage, progress):
+    """
+    Guarda la etapa y el porcentaje de un trabajo en curso usando una conexión propia.
+    Cuenta también como latido. La base de datos es el canal compartido que leen
+    todos los procesos de gunicorn.
+    """
+    tabla = VideoJob.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(tabla)
+            .where(tabla.c.id == job_id, tabla.c.worker_id == worker_id, tabla.c.status == JOB_RUNNING)
+            .values(stage=stage, progress=progress, heartbeat_at=_utcnow())
+        )
+
+# Contadores e histogramas acumulados de /metrics
+METRIC_JOBS_COMPLETED = 'memorial_video_jobs_completed_total'
+METRIC_JOB_FAILURES = 'memorial_video_job_failures_total'
+METRIC_QUEUE_WAIT = 'memorial_video_queue_wait_seconds'
+METRIC_STAGE_SECONDS = 'memorial_video_stage_seconds'
+METRIC_OUTPUT_BYTES = 'memorial_video_output_bytes'
+
+def _span_samples(stage, seconds):
+    """Muestras de histograma de la duración de una etapa (la espera en cola tiene su propio histograma)."""
+    if stage == SPAN_QUEUE_WAIT:
+        return metrics.histogram_samples(METRIC_QUEUE_WAIT, seconds, metrics.WAIT_BUCKETS)
+    return metrics.histogram_samples(METRIC_STAGE_SECONDS, seconds, metrics.DURATION_BUCKETS, {'stage': stage})
+
+def _video_metric_samples_from_rows(conn):
+    """Muestras equivalentes a las filas actuales de video_job y video_job_span (para la migración inicial)."""
+    trabajos = VideoJob.__table__
+    for status, attempts, output_bytes in conn.execute(
+            select(trabajos.c.status, trabajos.c.attempts, trabajos.c.output_bytes)):
+        # Todos los intentos fallaron salvo el que terminó bien o el que está en curso
+        fallidos = (attempts or 0) - (status in (JOB_DONE, JOB_RUNNING))
+        if fallidos > 0:
+            yield metrics.counter_sample(METRIC_JOB_FAILURES, fallidos)
+        if status == JOB_DONE:
+            yield metrics.counter_sample(METRIC_JOBS_COMPLETED)
+        if output_bytes is not None:
+            yield from metrics.histogram_samples(METRIC_OUTPUT_BYTES, output_bytes, metrics.SIZE_BUCKETS)
+    tiempos = VideoJobSpan.__table__
+    for stage, seconds in conn.execute(select(tiempos.c.stage, tiempos.c.seconds)):
+        yield from _span_samples(stage, seconds)
+
+def record_video_metrics(muestras):
+    """
+    Suma `muestras` (de metrics.counter_sample / histogram_samples) a video_metric con un
+    UPSERT atómico por serie, seguro con varios procesos. No hace commit: va en la misma
+    transacción que el cambio que se mide.
+    """
+    if muestras:
+        db.session.execute(database.increment_statement(VideoMetric.__table__, db.engine.dialect.name),
+                           metrics.merge_samples(muestras))
+
+def save_job_spans(job_id, attempt, spans):
+    """Guarda las duraciones por etapa de un intento (no interrumpe el trabajo si falla)."""
+    if not spans:
+        return
+    try:
+        db.session.execute(insert(VideoJobSpan), [
+            {'job_id': job_id, 'attempt': attempt, 'stage': stage, 'seconds': seconds, 'created_at': _utcnow()}
+            for stage, seconds in spans
+        ])
+        record_video_metrics([muestra for stage, seconds in spans for muestra in _span_samples(stage, seconds)])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"No se pudieron guardar los tiempos del trabajo {job_id}: {e}")
+
+def _update_owned_job(job_id, worker_id, valores):
+    """
+    UPDATE condicionado a que el trabajo siga en curso y sea de `worker_id`, como en el
+    reclamo. Un trabajador lento cuyo trabajo se reencoló (y quizá ya lo tomó otro) no
+    puede sobrescribir su estado. Devuelve True si la fila cambió; no hace commit.
+    """
+    result = db.session.execute(
+        update(VideoJob)
+        .where(VideoJob.id == job_id, VideoJob.worker_id == worker_id, VideoJob.status == JOB_RUNNING)
+        .values(valores)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def complete_video_job(job, worker_id, output_bytes=None):
+    """
+    Marca como terminado un trabajo de `worker_id` y confirma en la misma transacción los
+    cambios pendientes de la sesión (el resultado guardado en la persona). Si el trabajo ya
+    no es suyo, lo descarta todo y devuelve False.
+    """
+    if not _update_owned_job(job.id, worker_id, {'status': JOB_DONE, 'progress': 100, 'finished_at': _utcnow(),
+                                                 'last_error': None, 'output_bytes': output_bytes}):
+        db.session.rollback()
+        app.logger.warning(f"El trabajo {job.id} ya no pertenece a {worker_id} (se reencoló): se descarta su resultado.")
+        return False
+    muestras = [metrics.counter_sample(METRIC_JOBS_COMPLETED)]
+    if output_bytes is not None:
+        muestras += metrics.histogram_samples(METRIC_OUTPUT_BYTES, output_bytes, metrics.SIZE_BUCKETS)
+    record_video_metrics(muestras)
+    db.session.commit()
+    return True
+
+def fail_video_job(job, error, worker_id, retry=True):
+    """
+    Registra el fallo de un trabajo en curso de `worker_id`. Si quedan intentos lo reprograma
+    con espera exponencial; si no, lo marca como fallido y libera a la persona.
+    Devuelve False (sin cambiar nada) si el trabajo ya no es de `worker_id`.
+    """
+    now = _utcnow()
+    valores = {'last_error': str(error)[:2000], 'worker_id': None}
+    reintentar = retry and job.attempts < job.max_attempts
+    if reintentar:
+        espera = app.config['VIDEO_JOB_RETRY_BASE_SECONDS'] * (2 ** max(job.attempts - 1, 0))
+        valores.update(status=JOB_QUEUED, available_at=now + timedelta(seconds=espera))
+    else:
+        valores.update(status=JOB_FAILED, finished_at=now)
+    if not _update_owned_job(job.id, worker_id, valores):
+        db.session.rollback()
+        app.logger.warning(f"El trabajo {job.id} ya no pertenece a {worker_id}: no se registra su fallo.")
+        return False
+    record_video_metrics([metrics.counter_sample(METRIC_JOB_FAILURES)])
+    if reintentar:
+        app.logger.warning(f"Trabajo {job.id} reprogramado en {espera}s (intento {job.attempts}/{job.max_attempts}).")
+    else:
+        db.session.execute(update(Persona).where(Persona.id == job.persona_id).values(video_processing=False))
+        app.logger.error(f"Trabajo {job.id} fallido definitivamente tras {job.attempts} intentos.")
+    db.session.commit()
+    return True
+
+def requeue_stale_video_jobs():
+    """
+    Devuelve a la cola los trabajos cuyo trabajador dejó de enviar latidos y
+    encola de nuevo a las personas que quedaron marcadas como 'procesando' sin trabajo activo
+    (por ejemplo, tras un reinicio con la antigua cola en memoria).
+    """
+    limite = _utcnow() - timedelta(seconds=app.config['VIDEO_JOB_STALE_SECONDS'])
+    stale_jobs = VideoJob.query.filter(VideoJob.status == JOB_RUNNING,
+                                       VideoJob.heartbeat_at < limite).all()
+    for job in stale_jobs:
+        app.logger.warning(f"Trabajo {job.id} sin latido desde {job.heartbeat_at}. Reencolando.")
+        # Condicionado al trabajador que tenía: si envía un latido a tiempo no se toca
+        fail_video_job(job, 'Trabajador sin latido (posible caída del proceso)', job.worker_id)
+
+    activos = db.session.query(VideoJob.persona_id).filter(VideoJob.status.in_([JOB_QUEUED, JOB_RUNNING]))
+    huerfanas = Persona.query.filter(Persona.video_processing.is_(True), ~Persona.id.in_(activos)).all()
+    for persona in huerfanas:
+        app.logger.warning(f"Persona {persona.id} marcada como procesando sin trabajo activo. Reencolando.")
+        enqueue_video_job(persona.id)
+    db.session.commit()
+    return len(stale_jobs) + len(huerfanas)
+
+def prune_video_history():
+    """
+    Elimina los tiempos por etapa y los trabajos terminados (hechos o fallidos) de hace más
+    de VIDEO_HISTORY_RETENTION_DAYS días. Los contadores de /metrics no bajan: viven en
+    video_metric. Devuelve (tiempos, trabajos) eliminados.
+    """
+    dias = app.config['VIDEO_HISTORY_RETENTION_DAYS']
+    if dias <= 0:
+        return 0, 0
+    limite = _utcnow() - timedelta(days=dias)
+    viejos = (db.session.query(VideoJob.id)
+              .filter(VideoJob.status.in_([JOB_DONE, JOB_FAILED]), VideoJob.finished_at < limite))
+    tiempos = (VideoJobSpan.query
+               .filter(db.or_(VideoJobSpan.created_at < limite, VideoJobSpan.job_id.in_(viejos)))
+               .delete(synchronize_session=False))
+    trabajos = (VideoJob.query
+                .filter(VideoJob.status.in_([JOB_DONE, JOB_FAILED]), VideoJob.finished_at < limite)
+                .delete(synchronize_session=False))
+    db.session.commit()
+    if tiempos or trabajos:
+        app.logger.info(f"🧹 Historial de video recortado: {tiempos} tiempos y {trabajos} trabajos de hace más de {dias} días.")
+    return tiempos, trabajos
+
+# Duración media reciente de un render: (momento del cálculo, segundos)
+_render_average = None
+_render_average_lock = threading.Lock()
+
+def video_render_average():
+    """
+    Duración media de los últimos VIDEO_ESTIMATE_SAMPLES renders (tramo 'render' de
+    video_job_span). Se recalcula como mucho cada VIDEO_ESTIMATE_REFRESH_SECONDS: las
+    páginas en cola la consultan con cada actualización del progreso.
+    """
+    global _render_average
+    with _render_average_lock:
+        if _render_average and time.monotonic() - _render_average[0] < app.config['VIDEO_ESTIMATE_REFRESH_SECONDS']:
+            return _render_average[1]
+    recientes = [segundos for (segundos,) in
+                 db.session.query(VideoJobSpan.seconds)
+                 .filter(VideoJobSpan.stage == SPAN_RENDER)
+                 .order_by(VideoJobSpan.id.desc())
+                 .limit(app.config['VIDEO_ESTIMATE_SAMPLES'])]
+    promedio = sum(recientes) / len(recientes) if recientes else app.config['VIDEO_ESTIMATE_DEFAULT_SECONDS']
+    with _render_average_lock:
+        _render_average = (time.monotonic(), promedio)
+    return promedio
+
+def video_wait_estimate(job_id, status, priority, available_at, progress):
+    """
+    (segundos estimados hasta que el video esté listo, posición en la cola o None si ya
+    está en curso). Los trabajos en curso ocupan a los trabajadores: su número es la
+    concurrencia y lo que les falta se suma a lo que hay por delante.
+    """
+    promedio = video_render_average()
+    if status == JOB_RUNNING:
+        return admission.estimate_wait(0, 0, promedio, 1, own_remaining=1 - (progress or 0) / 100), None
+
+    ahora = _utcnow()
+    prioridad = priority or 0
+    delante = (db.session.query(db.func.count(VideoJob.id))
+               .filter(VideoJob.status == JOB_QUEUED, VideoJob.available_at <= ahora,
+                       db.or_(VideoJob.priority > prioridad,
+                              db.and_(VideoJob.priority == prioridad,
+                                      db.or_(VideoJob.available_at < available_at,
+                                             db.and_(VideoJob.available_at == available_at,
+                                                     VideoJob.id < job_id)))))
+               .scalar())
+    en_curso = [p for (p,) in db.session.query(VideoJob.progress).filter(VideoJob.status == JOB_RUNNING)]
+    restante = sum(1 - (p or 0) / 100 for p in en_curso)
+    espera = admission.estimate_wait(delante, restante, promedio, len(en_curso))
+    if available_at > ahora:
+        espera += (available_at - ahora).total_seconds()  # Reintento programado para más tarde
+    return espera, delante + 1
+
+def video_job_status(person_id):
+    """
+    Estado del video de una persona en una sola consulta (persona + su último trabajo),
+    más la espera estimada si el trabajo está en cola o en curso.
+    Devuelve un dict serializable o None si la persona no existe. 'estado' es
+    'queued', 'running', 'done', 'failed' o 'idle' (sin video ni trabajo pendiente).
+    """
+    fila = (db.session.query(Persona.video_generated, Persona.video_processing,
+                             VideoJob.id, VideoJob.status, VideoJob.stage, VideoJob.progress,
+                             VideoJob.attempts, VideoJob.max_attempts,
+                             VideoJob.priority, VideoJob.available_at)
+            .outerjoin(VideoJob, VideoJob.persona_id == Persona.id)
+            .filter(Persona.id == person_id)
+            .order_by(VideoJob.id.desc())
+            .first())
+    if fila is None:
+        return None
+
+    # Un trabajo activo manda sobre video_generated: puede ser una regeneración
+    if fila.status == JOB_RUNNING:
+        estado, etapa, progreso = JOB_RUNNING, fila.stage, fila.progress or 0
+    elif fila.status == JOB_QUEUED:
+        estado, etapa, progreso = JOB_QUEUED, JOB_QUEUED, 0
+    elif fila.video_generated:
+        estado, etapa, progreso = JOB_DONE, None, 100
+    elif fila.status == JOB_FAILED and not fila.video_processing:
+        estado, etapa, progreso = JOB_FAILED, None, 0
+    else:
+        estado, etapa, progreso = JOB_QUEUED if fila.video_processing else 'idle', None, 0
+
+    espera, posicion = None, None
+    if fila.status == estado and estado in (JOB_QUEUED, JOB_RUNNING):
+        espera, posicion = video_wait_estimate(fila.id, fila.status, fila.priority, fila.available_at, progreso)
+        espera = int(round(espera / 10.0) * 10)  # Sin cambios de segundo en segundo en la página
+
+    return {
+        'estado': estado,
+        'etapa': etapa,
+        'etiqueta': JOB_STAGE_ETIQUETAS.get(etapa, ''),
+        'progreso': progreso,
+        'intento': fila.attempts or 0,
+        'max_intentos': fila.max_attempts or 0,
+        'posicion': posicion,
+        'espera_segundos': espera,
+        'espera': admission.describe_wait(espera),
+    }
+
+# --- LÓGICA DEL TRABAJADOR DE VIDEO (SEGUNDO PLANO) ---
+def job_stage_rangos(hls_enabled):
+    """Tramo del porcentaje total que ocupa cada etapa (sin HLS, el empaquetado es casi inmediato)."""
+    fin_codificacion = 85 if hls_enabled else 98
+    return {
+        STAGE_PREPROCESS: (0, 15),
+        STAGE_ENCODE: (15, fin_codificacion),
+        STAGE_MUX: (fin_codificacion, 100),
+    }
+
+def prepare_music(track_path, duration, spans):
+    """
+    Audio para un video de `duration` segundos: devuelve (ruta, copiar) con el stem AAC en
+    caché (se copia sin recodificar) o, si no se pudo preparar, la pista original para
+    codificarla en el render como antes. (None, False) sin música.
+    """
+    if not track_path:
+        return None, False
+    try:
+        with spans.span(SPAN_MUSIC):
+            return music.stem_for(track_path, duration), True
+    except Exception as e:
+        app.logger.warning(f"No se pudo preparar el stem de {track_path}; se codificará la pista en el render: {e}")
+        return track_path, False
+
+def render_from_segments(image_paths, output_path, resolution, duration_per_image, track_path, progress, spans):
+    """
+    Genera el video a partir de la caché de segmentos: codifica (en paralelo) solo las
+    fotos sin segmento y une todos los segmentos copiando el video. Devuelve cuántas
+    fotos tiene el video final.
+    """
+    cache = segment_cache.SegmentCache(app.config['VIDEO_SEGMENT_CACHE_FOLDER'])
+    params = segment_cache.render_params(resolution, app.config['VIDEO_FIT_MODE'],
+                                         duration_per_image, video_engine.FFMPEG_FPS)
+    with spans.span(SPAN_HASH):
+        claves = [segment_cache.segment_key(storage.file_digest(path), params) for path in image_paths]
+
+    # Fotos sin segmento (una sola vez aunque se repitan en el memorial)
+    pendientes = {}
+    for path, clave in zip(image_paths, claves):
+        if clave not in pendientes and cache.get(clave) is None:
+            pendientes[clave] = path
+    app.logger.info(f"♻️ Segmentos en caché: {len(image_paths) - len(pendientes)} de {len(image_paths)}. "
+                    f"Se codificarán {len(pendientes)}.")
+
+    progress(STAGE_PREPROCESS, 0)
+    tiempos_imagenes = []
+    with spans.span(STAGE_PREPROCESS):
+        frames = image_pipeline.prepare_frames(
+            list(pendientes.values()), resolution,
+            mode=app.config['VIDEO_FIT_MODE'],
+            workers=app.config['IMAGE_PREPROCESS_WORKERS'],
+            on_progress=lambda hechos, total: progress(STAGE_PREPROCESS, hechos / total),
+            timings=tiempos_imagenes,
+            keep_failed=True,
+        )
+    for segundos in tiempos_imagenes:
+        spans.add(SPAN_RESIZE, segundos)
+    progress(STAGE_PREPROCESS, 1)
+
+    fallidas = {clave for clave, frame in zip(pendientes, frames) if frame is None}
+    a_codificar = [(clave, frame) for clave, frame in zip(pendientes, frames) if frame is not None]
+    del frames
+
+    def codificar(item):
+        clave, frame = item
+        with cache.writing(clave) as temporal:
+            video_engine.encode_segment(frame, temporal, duration=duration_per_image, resolution=resolution,
+                                        ffmpeg_bin=app.config['FFMPEG_BINARY'])
+
+    # El 90 % de la etapa de codificación son los segmentos nuevos; el resto, la concatenación
+    progress(STAGE_ENCODE, 0)
+    with spans.span(STAGE_ENCODE):
+        if a_codificar:
+            with ThreadPoolExecutor(max_workers=app.config['VIDEO_SEGMENT_WORKERS']) as pool:
+                for hechos, _ in enumerate(pool.map(codificar, a_codificar), start=1):
+                    progress(STAGE_ENCODE, 0.9 * hechos / len(a_codificar))
+
+    segmentos = [cache.path(clave) for clave in claves if clave not in fallidas]
+    if not segmentos:
+        raise ValueError("No se pudo preparar ninguna imagen para procesar. Asegúrate de que las imágenes sean válidas.")
+
+    audio_path, copy_audio = prepare_music(track_path, duration_per_image * len(segmentos), spans)
+    with spans.span(SPAN_CONCAT):
+        video_engine.concat_segments(segmentos, output_path, duration_per_image=duration_per_image,
+                                     audio_path=audio_path, copy_audio=copy_audio,
+                                     ffmpeg_bin=app.config['FFMPEG_BINARY'],
+                                     on_progress=lambda fraccion: progress(STAGE_ENCODE, 0.9 + 0.1 * fraccion))
+    return len(segmentos)
+
+def render_memorial_video(persona, progress=None, spans=None):
+    """
+    Genera el video memorial de una persona a partir de sus imágenes subidas.
+    Actualiza `video_path` y `video_generated` en la persona (sin hacer commit)
+    y lanza una excepción si algo falla, para que la cola pueda reintentar.
+    `progress(etapa, fracción)` recibe el avance de cada etapa (STAGE_*) y
+    `spans` (un `metrics.SpanRecorder`) la duración de cada una.
+    """
+    progress = progress or (lambda etapa, fraccion: None)
+    spans = spans or metrics.SpanRecorder(persona=persona.id)
+    # Definir variables fuera del try para poder limpiarlas en el except
+    video_final_filepath_abs = None
+    video_temporal = None
+    hls_dir_abs = None
+
+    try:
+        # --- LÓGICA PRINCIPAL DE CREACIÓN DE VIDEO ---
+        with spans.span(SPAN_DISCOVER):
+            if persona.imagenes:
+                # Usar los masters generados al subir: ya tienen la resolución del video
+                image_paths = [os.path.join(app.root_path, 'static', imagen.master_path or imagen.original_path)
+                               for imagen in persona.imagenes]
+            else:
+                # Personas anteriores al registro de imágenes: leer la carpeta de subidas
                 image_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(persona.id))
-                
+            
                 if not os.path.exists(image_folder):
                     raise FileNotFoundError(f"La carpeta de imágenes no existe: {image_folder}")
 
                 image_files = sorted([f for f in os.listdir(image_folder) if os.path.isfile(os.path.join(image_folder, f))])
                 image_paths = [os.path.join(image_folder, img) for img in image_files]
-                
-                if not image_paths:
-                    raise ValueError("No se encontraron imágenes para procesar.")
+        
+        if not image_paths:
+            raise ValueError("No se encontraron imágenes para procesar.")
+
+        duracion_por_imagen = 10 # segundos por imagen
+        target_resolution = (app.config['VIDEO_WIDTH'], app.config['VIDEO_HEIGHT'])
+
+        video_final_filename = f'memorial_{persona.id}_{int(datetime.now().timestamp())}.mp4'
+        video_final_filepath_abs = os.path.join(app.config['VIDEO_FOLDER'], video_final_filename)
+        # Se codifica en un temporal y se publica con un renombrado: nunca queda un MP4 a medias
+        video_temporal = storage.temp_path(video_final_filepath_abs)
+
+        # Pista elegida para la persona (o la pista por defecto si no eligió o ya no existe)
+        musica_fondo_path = music.resolve(persona.music_track)
+        if musica_fondo_path is None:
+            app.logger.warning(f"No hay pistas de música en {app.config['MUSIC_FOLDER']}. El video se generará sin audio.")
+
+        # Estilo elegido para la persona: los efectos se montan en un único grafo de filtros de FFmpeg
+        estilo = persona.video_style or app.config['VIDEO_STYLE_DEFAULT']
+        efectos = transitions.effect_spec(estilo, duracion_por_imagen)
+        if not transitions.has_effects(efectos):
+            efectos = None
+        elif app.config['VIDEO_BACKEND'] != 'ffmpeg':
+            app.logger.warning(f"El estilo '{estilo}' necesita el motor ffmpeg; el motor "
+                               f"'{app.config['VIDEO_BACKEND']}' generará el video con cortes directos.")
+            efectos = None
+
+        if efectos is None and app.config['VIDEO_SEGMENT_CACHE'] and app.config['VIDEO_BACKEND'] == 'ffmpeg':
+            # --- Render incremental: solo se codifican las fotos que no tengan segmento en caché ---
+            num_imagenes = render_from_segments(image_paths, video_temporal, target_resolution,
+                                                duracion_por_imagen, musica_fondo_path, progress, spans)
+            duracion_total = duracion_por_imagen * num_imagenes
+        else:
+            # --- Preparar los cuadros en memoria (en paralelo y sin deformar las fotos) ---
+            app.logger.info(f"⚙️ Preparando {len(image_paths)} imágenes a {target_resolution[0]}x{target_resolution[1]} ({app.config['VIDEO_FIT_MODE']})...")
+            progress(STAGE_PREPROCESS, 0)
+            tiempos_imagenes = []
+            with spans.span(STAGE_PREPROCESS):
+                frames = image_pipeline.prepare_frames(
+                    image_paths, target_resolution,
+                    mode=app.config['VIDEO_FIT_MODE'],
+                    workers=app.config['IMAGE_PREPROCESS_WORKERS'],
+                    on_progress=lambda hechos, total: progress(STAGE_PREPROCESS, hechos / total),
+                    timings=tiempos_imagenes,
+                )
+            for segundos in tiempos_imagenes:
+                spans.add(SPAN_RESIZE, segundos)
+
+            if not frames:
+                raise ValueError("No se pudo preparar ninguna imagen para procesar. Asegúrate de que las imágenes sean válidas.")
+
+            if efectos:
+                # --- Transiciones y movimiento: el video entero en una pasada de FFmpeg ---
+                titulo = None
+                if efectos['title_seconds']:
+                    titulo = transitions.render_title_card(
+                        persona.nombre,
+                        transitions.format_life_dates(persona.fecha_nacimiento, persona.fecha_muerte),
+                        target_resolution, font_path=app.config['VIDEO_TITLE_FONT'])
+                duracion_total = transitions.total_duration(
+                    efectos, transitions.clip_durations(efectos, len(frames), duracion_por_imagen))
+                audio_path, copy_audio = prepare_music(musica_fondo_path, duracion_total, spans)
+                app.logger.info(f"✨ Estilo '{estilo}': {len(frames)} fotos con efectos ({duracion_total:.0f}s).")
+                progress(STAGE_ENCODE, 0)
+                with spans.span(STAGE_ENCODE):
+                    video_engine.encode_slideshow_effects(
+                        frames,
+                        video_temporal,
+                        efectos,
+                        duration_per_image=duracion_por_imagen,
+                        resolution=target_resolution,
+                        title_frame=titulo,
+                        audio_path=audio_path,
+                        copy_audio=copy_audio,
+                        ffmpeg_bin=app.config['FFMPEG_BINARY'],
+                        on_progress=lambda fraccion: progress(STAGE_ENCODE, fraccion),
+                    )
+            else:
+                # --- Codificar el video (y mezclar el audio) con el motor configurado ---
+                duracion_total = duracion_por_imagen * len(frames)
+                audio_path, copy_audio = prepare_music(musica_fondo_path, duracion_total, spans)
+                progress(STAGE_ENCODE, 0)
+                with spans.span(STAGE_ENCODE):
+                    video_engine.encode_slideshow(
+                        app.config['VIDEO_BACKEND'],
+                        frames,
+                        video_temporal,
+                        duration_per_image=duracion_por_imagen,
+                        resolution=target_resolution,
+                        audio_path=audio_path,
+                        copy_audio=copy_audio,
+                        ffmpeg_bin=app.config['FFMPEG_BINARY'],
+                        on_progress=lambda fraccion: progress(STAGE_ENCODE, fraccion),
+                    )
+        os.replace(video_temporal, video_final_filepath_abs)
+        app.logger.info(f"🎉 ¡Video creado con el motor '{app.config['VIDEO_BACKEND']}': {video_final_filepath_abs}!")
+
+        # --- Rendiciones HLS opcionales para conexiones lentas ---
+        progress(STAGE_MUX, 0)
+        hls_path = None
+        if app.config['VIDEO_HLS_ENABLED']:
+            hls_name = os.path.splitext(video_final_filename)[0]
+            hls_dir_abs = os.path.join(app.config['VIDEO_FOLDER'], 'hls', hls_name)
+            # Las rendiciones se escriben en una carpeta temporal que se renombra al terminar
+            with spans.span(STAGE_MUX), storage.atomic_dir(hls_dir_abs) as hls_temporal:
+                video_engine.package_hls(video_final_filepath_abs, hls_temporal,
+                                         with_audio=musica_fondo_path is not None,
+                                         ffmpeg_bin=app.config['FFMPEG_BINARY'],
+                                         duration=duracion_total,
+                                         # Los videos con efectos tienen cadencia variable: se conserva
+                                         fps=None if efectos else video_engine.FFMPEG_FPS,
+                                         on_progress=lambda fraccion: progress(STAGE_MUX, fraccion))
+            hls_path = f'videos/hls/{hls_name}/{video_engine.HLS_MASTER_PLAYLIST}'
+        progress(STAGE_MUX, 1)
+
+        # Actualizar el registro en la base de datos
+        # CRÍTICO: ALMACENAR LA RUTA RELATIVA CON BARRAS DIAGONALES PARA LAS URLs.
+        persona.video_path = f'videos/{video_final_filename}' 
+        persona.hls_path = hls_path
+        persona.video_generated = True
+
+    except Exception:
+        # Limpiar el temporal, el video ya publicado (si falló después) y las rendiciones
+        for ruta in (video_temporal, video_final_filepath_abs):
+            if ruta and os.path.exists(ruta):
+                os.remove(ruta)
+        if hls_dir_abs and os.path.exists(hls_dir_abs):
+            shutil.rmtree(hls_dir_abs, ignore_errors=True)
+        raise
+
+
+class _Heartbeat:
+    """Hilo que envía latidos periódicos mientras se procesa un trabajo."""
+
+    def __init__(self, job_id, worker_id):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        intervalo = app.config['VIDEO_JOB_HEARTBEAT_SECONDS']
+        with app.app_context():
+            while not self._stop.wait(intervalo):
+                try:
+                    touch_video_job(self.job_id, self.worker_id)
+                except Exception as e:
+                    app.logger.warning(f"No se pudo enviar el latido del trabajo {self.job_id}: {e}")
 
-                duracion_por_imagen = 10 # segundos por imagen
-                fps = 24 # frames por segundo
+    def __enter__(self):
+        self._thread.start()
+        return self
 
-                # --- Redimensionar imágenes a un tamaño uniforme ---
-                target_width = 1280
-                target_height = 720
-                target_resolution = (target_width, target_height)
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
 
-                resized_image_paths = []
-                # Crear una carpeta temporal para las imágenes redimensionadas dentro de la carpeta de la persona
-                temp_resized_folder = os.path.join(image_folder, 'resized_temp') 
-                os.makedirs(temp_resized_folder, exist_ok=True)
 
-                app.logger.info(f"⚙️ Redimensionando imágenes a {target_width}x{target_height}...")
-                for i, img_path in enumerate(image_paths):
-                    try:
-                        img = Image.open(img_path)
-                        # Redimensionar la imagen. Esto puede cambiar la relación de aspecto.
-                        # Image.LANCZOS es un filtro de alta calidad para redimensionar.
-                        img_resized = img.resize(target_resolution, Image.LANCZOS)
-                        
-                        resized_img_filename = f"resized_{i}_{os.path.basename(img_path)}"
-                        resized_img_path = os.path.join(temp_resized_folder, resized_img_filename)
-                        img_resized.save(resized_img_path)
-                        resized_image_paths.append(resized_img_path)
-                    except Exception as e:
-                        app.logger.error(f"Error al redimensionar la imagen {img_path}: {e}", exc_info=True)
-                        # Si una imagen falla, la saltamos. Asegúrate de que aún haya suficientes imágenes.
-                        continue
-
-                if not resized_image_paths:
-                    raise ValueError("No se redimensionaron imágenes exitosamente para procesar. Asegúrate de que las imágenes sean válidas.")
-                
-                # Nombres de archivos temporales y finales
-                video_sin_audio_filename = f'temp_video_no_audio_{persona.id}.mp4'
-                video_final_filename = f'memorial_{persona.id}_{int(datetime.now().timestamp())}.mp4'
-                
-                # Usar os.path.join solo para la ruta absoluta de guardado en el sistema de archivos
-                video_sin_audio_filepath_abs = os.path.join(app.config['VIDEO_FOLDER'], video_sin_audio_filename)
-                video_final_filepath_abs = os.path.join(app.config['VIDEO_FOLDER'], video_final_filename)
-
-                # --- Crear video a partir de imágenes redimensionadas ---
-                app.logger.info("⚙️ Creando clip de video a partir de imágenes redimensionadas...")
-                # ImageSequenceClip toma una lista de rutas de imágenes y una lista de duraciones para cada imagen
-                clip_imagenes = ImageSequenceClip(resized_image_paths, durations=[duracion_por_imagen] * len(resized_image_paths))
-                clip_imagenes.write_videofile(video_sin_audio_filepath_abs, fps=fps, audio=False, logger=None)
-                app.logger.info(f"Video sin audio creado: {video_sin_audio_filepath_abs}")
-                clip_imagenes.close() # Liberar recursos del clip
-
-                # --- Añadir audio con FFmpeg ---
-                musica_fondo_path = os.path.join(app.config['MUSIC_FOLDER'], 'background_music.mp3') # Suponemos un nombre de archivo de música fijo
-                usar_musica = os.path.exists(musica_fondo_path)
-
-                if usar_musica:
-                    app.logger.info("🔊 Añadiendo audio con FFmpeg...")
-                    comando_combinar = [
-                        'ffmpeg',
-                        '-i', video_sin_audio_filepath_abs,
-                        '-i', musica_fondo_path,
-                        '-c:v', 'copy',          # Copiar video sin recodificar
-                        '-c:a', 'aac',           # Codificar audio a AAC
-                        '-strict', 'experimental', # Necesario para AAC en algunas versiones de FFmpeg
-                        '-map', '0:v:0',        # Tomar stream de video del primer archivo (video sin audio)
-                        '-map', '1:a:0',        # Tomar stream de audio del segundo archivo (música)
-                        '-shortest',             # Ajustar a la duración más corta (video o audio)
-                        video_final_filepath_abs
-                    ]
-                    
-                    subprocess.run(comando_combinar, check=True)
-                    app.logger.info(f"🎉 ¡Video con audio creado: {video_final_filepath_abs}!")
-                else:
-                    app.logger.warning(f"No se encontró el archivo de música: {musica_fondo_path}. Se copiará el video sin audio.")
-                    # Si no hay música, simplemente copia el video sin audio al nombre final
-                    os.rename(video_sin_audio_filepath_abs, video_final_filepath_abs)
-                    app.logger.info(f"✅ Video copiado sin audio: {video_final_filepath_abs}")
-
-                # Actualizar el registro en la base de datos
-                # CRÍTICO: ALMACENAR LA RUTA RELATIVA CON BARRAS DIAGONALES PARA LAS URLs.
-                persona.video_path = f'videos/{video_final_filename}' 
-                persona.video_generated = True
-
-                # --- TEMPORAL: Imprimir para depuración ---
-                app.logger.debug(f"DEBUG: Guardando persona.video_path como: {persona.video_path}")
-                # --- FIN TEMPORAL ---
-
-            except subprocess.CalledProcessError as e:
-                app.logger.error(f"FALLO la generación de video para la persona {person_id} debido a un error de FFmpeg: {e}", exc_info=True)
-                # Limpiar el archivo final si se creó parcialmente
-                if video_final_filepath_abs and os.path.exists(video_final_filepath_abs):
-                    os.remove(video_final_filepath_abs)
+class _JobProgress:
+    """
+    Convierte el avance de cada etapa en un porcentaje total y lo publica en video_job,
+    a lo sumo una vez cada JOB_PROGRESS_MIN_INTERVAL segundos por etapa.
+    Se puede llamar desde otros hilos (p. ej. el lector de progreso de FFmpeg).
+    """
+
+    def __init__(self, job_id, worker_id, rangos):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.rangos = rangos
+        self._lock = threading.Lock()
+        self._ultimo = (None, -1)
+        self._ultimo_envio = 0.0
+
+    def __call__(self, stage, fraccion):
+        inicio, fin = self.rangos[stage]
+        porcentaje = int(inicio + (fin - inicio) * max(0.0, min(fraccion, 1.0)))
+        ahora = time.monotonic()
+        with self._lock:
+            etapa_anterior, porcentaje_anterior = self._ultimo
+            if stage == etapa_anterior:
+                if porcentaje <= porcentaje_anterior:
+                    return
+                if fraccion < 1 and ahora - self._ultimo_envio < app.config['JOB_PROGRESS_MIN_INTERVAL']:
+                    return
+            self._ultimo = (stage, porcentaje)
+            self._ultimo_envio = ahora
+        try:
+            with app.app_context():
+                publish_job_progress(self.job_id, self.worker_id, stage, porcentaje)
+        except Exception as e:
+            app.logger.warning(f"No se pudo publicar el progreso del trabajo {self.job_id}: {e}")
+
+
+def process_video_job(job, worker_id):
+    """Ejecuta un trabajo reclamado y registra su resultado en la cola."""
+    person_id = job.persona_id
+    app.logger.info(f"Tarea recibida (trabajo {job.id}, intento {job.attempts}). Iniciando generación de video para la persona con ID: {person_id}")
+
+    persona = db.session.get(Persona, person_id)
+    if not persona:
+        app.logger.error(f"Error Crítico: Persona con ID {person_id} no encontrada en la base de datos.")
+        fail_video_job(job, 'Persona no encontrada', worker_id, retry=False)
+        return
+
+    job_id, intento = job.id, job.attempts
+    archivos_anteriores = (persona.video_path, persona.hls_path)  # Video previo si es una regeneración
+    spans = metrics.SpanRecorder(job=job_id, persona=person_id, attempt=intento)
+    spans.add(SPAN_QUEUE_WAIT, max((job.started_at - job.available_at).total_seconds(), 0.0))
+
+    try:
+        progreso = _JobProgress(job.id, worker_id, job_stage_rangos(app.config['VIDEO_HLS_ENABLED']))
+        with _Heartbeat(job.id, worker_id), spans.span(SPAN_RENDER):
+            render_memorial_video(persona, progress=progreso, spans=spans)
+    except Exception as e:
+        app.logger.error(f"FALLO la generación de video para la persona {person_id}: {e}", exc_info=True)
+        db.session.rollback()
+        fail_video_job(db.session.get(VideoJob, job_id), e, worker_id)
+        save_job_spans(job_id, intento, spans.spans)
+        return
+
+    # Marcar el proceso como finalizado y guardar el resultado junto con el trabajo
+    video_nuevo, hls_nuevo = persona.video_path, persona.hls_path
+    persona.video_processing = False
+    video_abs = os.path.join(app.root_path, 'static', video_nuevo)
+    with spans.span(SPAN_COMMIT):
+        completado = complete_video_job(job, worker_id,
+                                        output_bytes=os.path.getsize(video_abs) if os.path.exists(video_abs) else None)
+    save_job_spans(job_id, intento, spans.spans)
+    if not completado:
+        # Otro trabajador tiene ahora el trabajo: este video no lo referenciará nadie
+        remove_video_files(video_nuevo, hls_nuevo)
+        return
+    # Al regenerar, el video anterior ya no lo referencia nadie
+    video_anterior, hls_anterior = archivos_anteriores
+    remove_video_files(video_anterior if video_anterior != persona.video_path else None,
+                       hls_anterior if hls_anterior != persona.hls_path else None)
+    app.logger.info(f"Proceso finalizado para la persona {person_id}. Base de datos actualizada.")
+
+
+def video_worker(worker_id=None, stop_event=None):
+    """
+    Bucle de un trabajador de video: reclama trabajos de la tabla video_job
+    y los procesa uno por uno hasta que se active `stop_event`.
+    Se ejecuta en cada proceso lanzado por `worker.py`.
+    """
+    worker_id = worker_id or f'{os.uname().nodename}:{os.getpid()}'
+    stop_event = stop_event or threading.Event()
+    poll = app.config['VIDEO_WORKER_POLL_SECONDS']
+
+    with app.app_context():
+        app.logger.info(f"Trabajador de video {worker_id} esperando nuevas tareas...")
+        while not stop_event.is_set():
+            try:
+                job = claim_next_video_job(worker_id)
             except Exception as e:
-                app.logger.error(f"FALLO la generación de video para la persona {person_id}: {e}", exc_info=True)
-            
-            finally:
-                # Limpiar archivo temporal sin audio si existe
-                if video_sin_audio_filepath_abs and os.path.exists(video_sin_audio_filepath_abs):
-                    os.remove(video_sin_audio_filepath_abs)
-                
-                # Limpiar la carpeta temporal de imágenes redimensionadas
-                if temp_resized_folder and os.path.exists(temp_resized_folder):
-                    try:
-                        shutil.rmtree(temp_resized_folder)
-                        app.logger.info(f"Carpeta temporal de imágenes redimensionadas eliminada: {temp_resized_folder}")
-                    except Exception as e:
-                        app.logger.error(f"Error al eliminar la carpeta temporal de imágenes redimensionadas {temp_resized_folder}: {e}", exc_info=True)
+                app.logger.error(f"Error al reclamar trabajos de video: {e}", exc_info=True)
+                db.session.rollback()
+                job = None
 
-                # Marcar el proceso como finalizado (incluso si falló)
-                persona.video_processing = False
-                db.session.commit()
-                app.logger.info(f"Proceso finalizado para la persona {person_id}. Actualizando base de datos.")
-                video_generation_queue.task_done()
+            if job is None:
+                stop_event.wait(poll)
+                continue
 
+            process_video_job(job, worker_id)
+            db.session.remove()
+        app.logger.info(f"Señal de terminación recibida. Saliendo del trabajador de video {worker_id}.")
 
-# --- INICIAR EL TRABAJADOR EN UN HILO SEPARADO ---
-threading.Thread(target=video_worker, daemon=True).start()
-app.logger.info("Trabajador de video iniciado en segundo plano.")
 
 # --- RUTAS DE LA APLICACIÓN WEB ---
 
+# Filtros de estado del panel de administración (prefijos del índice ix_persona_estado)
+ESTADO_FILTROS = {
+    'procesando': {'video_processing': True},
+    'generado': {'video_processing': False, 'video_generated': True},
+    'imagenes': {'video_processing': False, 'video_generated': False, 'images_uploaded': True},
+    'sin_imagenes': {'video_processing': False, 'video_generated': False, 'images_uploaded': False},
+}
+ESTADO_ETIQUETAS = {
+    'procesando': 'Procesando Video',
+    'generado': 'Video Generado',
+    'imagenes': 'Imágenes Subidas',
+    'sin_imagenes': 'Sin Imágenes',
+}
+
 @app.route('/', methods=['GET', 'POST'])
 def login():
     if 'logged_in' in session:
@@ -272,13 +1314,37 @@ def admin():
         flash('Debes iniciar sesión para ver esta página.', 'warning')
         return redirect(url_for('login'))
     
-    search_query = request.args.get('search')
-    if search_query:
-        personas = Persona.query.filter(Persona.nombre.ilike(f'%{search_query}%')).order_by(Persona.id.desc()).all()
+    search_query = request.args.get('search', '').strip()
+    estado = request.args.get('estado', '')
+    after = request.args.get('after', type=int)   # Página siguiente: ids menores que `after`
+    before = request.args.get('before', type=int) # Página anterior: ids mayores que `before`
+    page_size = app.config['ADMIN_PAGE_SIZE']
+
+    query = search.apply_name_search(Persona.query, Persona, search_query,
+                                     search_backend() if search_query else search.BACKEND_LIKE)
+    if estado in ESTADO_FILTROS:
+        query = query.filter_by(**ESTADO_FILTROS[estado])
+
+    # Paginación por clave (keyset) sobre Persona.id: el costo no depende de la página
+    if before is not None:
+        personas = query.filter(Persona.id > before).order_by(Persona.id.asc()).limit(page_size + 1).all()
+        hay_mas_recientes = len(personas) > page_size
+        personas = list(reversed(personas[:page_size]))
+        hay_mas_antiguas = True
     else:
-        personas = Persona.query.order_by(Persona.id.desc()).all()
-    
-    return render_template('admin.html', personas=personas, search_query=search_query)
+        if after is not None:
+            query = query.filter(Persona.id < after)
+        personas = query.order_by(Persona.id.desc()).limit(page_size + 1).all()
+        hay_mas_antiguas = len(personas) > page_size
+        personas = personas[:page_size]
+        hay_mas_recientes = after is not None
+
+    filtros = {k: v for k, v in (('search', search_query), ('estado', estado)) if v}
+    next_url = url_for('admin', after=personas[-1].id, **filtros) if personas and hay_mas_antiguas else None
+    prev_url = url_for('admin', before=personas[0].id, **filtros) if personas and hay_mas_recientes else None
+
+    return render_template('admin.html', personas=personas, search_query=search_query, estado=estado,
+                           estados=ESTADO_ETIQUETAS, next_url=next_url, prev_url=prev_url)
 
 @app.route('/add_person', methods=['POST'])
 def add_person():
@@ -293,36 +1359,177 @@ def add_person():
         )
         db.session.add(nueva_persona)
         db.session.commit()
+        # El QR no se genera aquí: se sirve bajo demanda desde /qr/<id>.png o .svg
 
-        qr_path_rel = generate_qr_code(nueva_persona.id)
-        nueva_persona.qr_code_path = qr_path_rel
-        db.session.commit()
-
-        flash(f'Persona "{nueva_persona.nombre}" añadida y QR generado.', 'success')
+        flash(f'Persona "{nueva_persona.nombre}" añadida. Su código QR ya está disponible.', 'success')
     except Exception as e:
         flash(f'Error al añadir persona: {e}', 'danger')
     
     return redirect(url_for('admin'))
 
+@app.route('/import_personas', methods=['POST'])
+def import_personas_route():
+    """Importación masiva desde un archivo CSV o JSON; muestra (o devuelve en JSON) el informe por fila."""
+    if 'logged_in' not in session:
+        return redirect(url_for('login'))
+
+    archivo = request.files.get('archivo')
+    if not archivo or archivo.filename == '':
+        flash('Selecciona un archivo CSV o JSON para importar.', 'warning')
+        return redirect(url_for('admin'))
+
+    try:
+        registros = bulk_import.parse_records(archivo.read(), archivo.filename)
+    except (bulk_import.ImportFormatError, UnicodeDecodeError) as e:
+        flash(f'No se pudo leer el archivo: {e}', 'danger')
+        return redirect(url_for('admin'))
+
+    informe = import_personas(registros)
+    app.logger.info(f"Importación masiva: {sum(r['estado'] == 'ok' for r in informe)} de {len(informe)} filas importadas.")
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(informe)
+    return render_template('import_report.html', informe=informe)
+
+_VIEW_TEMPLATES = ('view_person.html', '_base.html')
+_view_templates_digest = None
+
+def view_page_etag(persona):
+    """
+    ETag de la página pública de una persona: su fila (updated_at cambia con cada
+    modificación) y el contenido de las plantillas, para que un despliegue la invalide.
+    """
+    global _view_templates_digest
+    if _view_templates_digest is None:
+        fuentes = [app.jinja_env.loader.get_source(app.jinja_env, nombre)[0] for nombre in _VIEW_TEMPLATES]
+        _view_templates_digest = page_cache.state_etag(*fuentes)
+    return page_cache.state_etag(
+        _view_templates_digest, persona.id, persona.updated_at, persona.nombre,
+        persona.fecha_nacimiento, persona.fecha_muerte, persona.images_uploaded, persona.images_indexed,
+        persona.video_generated, persona.video_processing, persona.video_path, persona.hls_path,
+        persona.music_track, persona.video_style, *(pista['id'] for pista in music.tracks()),
+    )
+
 @app.route('/view/<int:person_id>')
 def view_person(person_id):
     persona = db.session.get(Persona, person_id)
     if not persona:
         return "No encontrado", 404
         
-    image_files = []
-    if persona.images_uploaded:
-        person_upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(persona.id))
-        if os.path.exists(person_upload_folder):
-            try:
-                # Filtrar directorios (como la carpeta temporal resized_temp)
-                all_files = os.listdir(person_upload_folder)
-                image_files = sorted([f for f in all_files if os.path.isfile(os.path.join(person_upload_folder, f))])
-            except OSError:
-                image_files = []
+    galeria = persona.images_uploaded and not persona.video_generated and not persona.video_processing
+    fotos_antiguas = None
+    if galeria and not persona.images_indexed and not persona.imagenes:
+        # Personas anteriores al registro de imágenes: se listan sus fotos originales como antes
+        # hasta que `worker.py` o `flask backfill-images` las registre (ver backfill_image_manifest)
+        fotos_antiguas = legacy_image_files(persona.id)
+
+    if persona.video_processing:
+        # El progreso cambia sin que cambie la persona: no se cachea
+        estado_video = video_job_status(person_id)
+        response = make_response(render_template('view_person.html', persona=persona, estado_video=estado_video,
+                                                 fotos_antiguas=fotos_antiguas))
+        response.cache_control.no_cache = True
+        return response
+
+    etag = view_page_etag(persona)
+    # Con mensajes flash pendientes la página es distinta para este visitante
+    if '_flashes' in session:
+        return render_template('view_person.html', persona=persona, estado_video=None, fotos_antiguas=fotos_antiguas)
+    html = view_page_cache.get(etag)
+    if html is None:
+        html = render_template('view_person.html', persona=persona, estado_video=None, fotos_antiguas=fotos_antiguas)
+        view_page_cache.put(etag, html)
+    response = make_response(html)
+    response.set_etag(etag)
+    if persona.updated_at:
+        response.last_modified = persona.updated_at.replace(tzinfo=timezone.utc)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['VIEW_PAGE_MAX_AGE']
+    return response.make_conditional(request)
+
+def ingest_person_images(person_id, filenames):
+    """
+    Valida las imágenes ya guardadas en la carpeta de subidas de la persona y genera sus
+    derivados (miniaturas para la galería y masters para el video).
+    Devuelve (imágenes válidas como objetos Imagen sin añadir a la sesión, nombres rechazados).
+    """
+    rel_folder = f'uploads/{person_id}'
+    static_folder = app.static_folder
+    derivados = []
+    for pos, filename in enumerate(filenames):
+        derivados.append({
+            'original_path': f'{rel_folder}/{filename}',
+            'thumb_webp_path': f'{rel_folder}/thumbs/{pos:02d}.webp',
+            'thumb_jpeg_path': f'{rel_folder}/thumbs/{pos:02d}.jpg',
+            'master_path': f'{rel_folder}/masters/{pos:02d}.jpg',
+        })
+    resultados = image_pipeline.ingest_images(
+        [tuple(os.path.join(static_folder, d[k]) for k in ('original_path', 'thumb_webp_path', 'thumb_jpeg_path', 'master_path'))
+         for d in derivados],
+        (app.config['VIDEO_WIDTH'], app.config['VIDEO_HEIGHT']),
+        mode=app.config['VIDEO_FIT_MODE'],
+        workers=app.config['IMAGE_INGEST_WORKERS'],
+    )
+
+    validas = []
+    rechazadas = []
+    for filename, rutas, (info, error) in zip(filenames, derivados, resultados):
+        if error:
+            app.logger.warning(f"Imagen rechazada {filename} para la persona {person_id}: {error}")
+            rechazadas.append(filename)
+            continue
+        validas.append(Imagen(persona_id=person_id, posicion=len(validas), filename=filename, **rutas, **info))
+    return validas, rechazadas
+
+def legacy_image_files(person_id):
+    """Fotos de la carpeta de subidas de una persona sin registro en Imagen, por nombre."""
+    carpeta = os.path.join(app.config['UPLOAD_FOLDER'], str(person_id))
+    try:
+        return sorted(entry.name for entry in os.scandir(carpeta)
+                      if entry.is_file() and not storage.is_temp(entry.name))
+    except FileNotFoundError:
+        return []
 
-    return render_template('view_person.html', persona=persona, image_files=image_files)
+def backfill_image_manifest(persona):
+    """
+    Registra en la tabla Imagen (con miniaturas y masters) las fotos de una persona anterior
+    al registro de imágenes y la marca con `images_indexed`, también si ninguna era válida,
+    para no volver a intentarlo. No borra nada de la carpeta. Devuelve el número de imágenes registradas.
+    """
+    validas = []
+    filenames = legacy_image_files(persona.id)
+    if filenames:
+        validas, _ = ingest_person_images(persona.id, filenames)
+    # Otro proceso pudo completar el registro mientras se generaban los derivados
+    if db.session.query(Imagen.id).filter_by(persona_id=persona.id).first():
+        validas = []
+    db.session.add_all(validas)
+    persona.images_indexed = True
+    if validas:
+        persona.updated_at = _utcnow()  # Cambia la página pública (galería con miniaturas)
+    db.session.commit()
+    app.logger.info(f"Registradas {len(validas)} imágenes existentes de la persona {persona.id}.")
+    return len(validas)
 
+def backfill_image_manifests(limit=None):
+    """
+    Registra las fotos de las personas anteriores al registro de imágenes que aún no lo
+    tienen (como mucho `limit`). Un fallo con una persona no detiene a las demás.
+    Devuelve el número de personas procesadas.
+    """
+    pendientes = (db.session.query(Persona.id)
+                  .filter(Persona.images_uploaded.is_(True), db.or_(Persona.images_indexed.is_(False),
+                                                                    Persona.images_indexed.is_(None)))
+                  .order_by(Persona.id)
+                  .limit(limit))
+    procesadas = 0
+    for (persona_id,) in pendientes.all():
+        try:
+            backfill_image_manifest(db.session.get(Persona, persona_id))
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"No se pudieron registrar las imágenes de la persona {persona_id}: {e}", exc_info=True)
+        procesadas += 1
+    return procesadas
 
 @app.route('/upload_images/<int:person_id>', methods=['POST'])
 def upload_images(person_id):
@@ -339,120 +1546,445 @@ def upload_images(person_id):
         flash('Debes subir entre 3 y 10 imágenes.', 'danger')
         return redirect(url_for('view_person', person_id=person_id))
 
+    aviso = storage_write_refusal('uploads')
+    if aviso:
+        flash(aviso, 'warning')
+        return redirect(url_for('view_person', person_id=person_id))
+
     person_upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(person_id))
     os.makedirs(person_upload_folder, exist_ok=True)
 
+    filenames = []
     for file in uploaded_files:
         if file and file.filename != '':
             filename = secure_filename(file.filename)
-            file.save(os.path.join(person_upload_folder, filename))
+            if not filename or filename in filenames:
+                continue
+            with storage.atomic_path(os.path.join(person_upload_folder, filename)) as temporal:
+                file.save(temporal)
+            filenames.append(filename)
+
+    validas, rechazadas = ingest_person_images(person_id, filenames)
+    for filename in rechazadas:
+        os.remove(os.path.join(person_upload_folder, filename))
 
+    if len(validas) < 3:
+        shutil.rmtree(person_upload_folder, ignore_errors=True)
+        flash('Debes subir entre 3 y 10 imágenes válidas (JPEG, PNG, WebP...).', 'danger')
+        return redirect(url_for('view_person', person_id=person_id))
+
+    db.session.add_all(validas)
     persona.images_uploaded = True
+    persona.images_indexed = True
     db.session.commit()
 
+    if rechazadas:
+        flash(f'Se omitieron imágenes no válidas: {", ".join(rechazadas)}.', 'warning')
     flash('Imágenes subidas. Ya puedes generar el video memorial.', 'success')
     return redirect(url_for('view_person', person_id=person_id))
 
+@app.template_global()
+def music_tracks():
+    """Pistas de música disponibles para elegir en los formularios de generación."""
+    return music.tracks()
+
+def apply_music_choice(persona):
+    """Guarda la pista elegida en el formulario ('' = la pista por defecto). Ignora pistas desconocidas."""
+    if 'music_track' not in request.form:
+        return
+    eleccion = request.form['music_track']
+    if not eleccion:
+        persona.music_track = None
+    elif music.has_track(eleccion):
+        persona.music_track = eleccion
+    else:
+        app.logger.warning(f"Pista de música desconocida para la persona {persona.id}: {eleccion!r}")
+
+@app.template_global()
+def video_styles():
+    """Estilos de video disponibles para elegir en los formularios de generación."""
+    return [{'id': clave, 'titulo': estilo['titulo']} for clave, estilo in transitions.STYLES.items()]
+
+def apply_video_style(persona):
+    """Guarda el estilo elegido en el formulario ('' = el estilo por defecto). Ignora estilos desconocidos."""
+    if 'video_style' not in request.form:
+        return
+    eleccion = request.form['video_style']
+    if not eleccion:
+        persona.video_style = None
+    elif eleccion in transitions.STYLES:
+        persona.video_style = eleccion
+    else:
+        app.logger.warning(f"Estilo de video desconocido para la persona {persona.id}: {eleccion!r}")
+
+def admission_rejected_response(error, destino):
+    """
+    Respuesta a una solicitud de video rechazada. Los clientes que piden JSON reciben el
+    código (429 o 503) y Retry-After; en el navegador se muestra el aviso en la página.
+    """
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'error': error.reason, 'mensaje': error.message, 'retry_after': error.retry_after})
+        response.status_code = error.status_code
+    else:
+        flash(error.message, 'warning')
+        response = redirect(destino)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @app.route('/generate_video/<int:person_id>', methods=['POST'])
 def generate_video(person_id):
     persona = db.session.get(Persona, person_id)
     if not persona:
         return "No encontrado", 404
-    
-    if not persona.images_uploaded or persona.video_generated or persona.video_processing:
+
+    destino = url_for('view_person', person_id=person_id)
+    if persona.video_processing:
+        # Formulario enviado otra vez (doble clic, recarga): el trabajo ya está en cola
+        flash('El video ya se está generando. Puedes seguir su progreso en esta página.', 'info')
+        return redirect(destino)
+    if not persona.images_uploaded or persona.video_generated:
         flash('Acción no permitida: el video no se puede generar en este estado.', 'warning')
-        return redirect(url_for('view_person', person_id=person_id))
+        return redirect(destino)
 
-    persona.video_processing = True
+    apply_music_choice(persona)
+    apply_video_style(persona)
+    try:
+        job = admit_video_job(persona, admission.LANE_PUBLIC, request_client_key())
+    except admission.AdmissionRejected as e:
+        db.session.rollback()
+        app.logger.warning(f"🚦 Solicitud de video rechazada para la persona {person_id}: {e.reason} "
+                           f"(reintentar en {e.retry_after}s).")
+        return admission_rejected_response(e, destino)
+    if job is None:
+        db.session.rollback()
+        flash('El video ya se está generando. Puedes seguir su progreso en esta página.', 'info')
+        return redirect(destino)
     db.session.commit()
-
-    video_generation_queue.put(person_id)
     app.logger.info(f"Persona con ID {person_id} añadida a la cola de generación de video.")
 
-    flash('El video se está generando. Esta operación puede tardar unos minutos.', 'info')
-    return redirect(url_for('view_person', person_id=person_id))
+    estado = video_job_status(person_id)
+    flash(f'El video se está generando. Tiempo estimado: {estado["espera"]}.', 'info')
+    return redirect(destino)
 
-@app.route('/export_pdf')
-def export_pdf():
+@app.route('/rerender_video/<int:person_id>', methods=['POST'])
+def rerender_video(person_id):
+    """
+    Vuelve a generar el video de una persona (administración). Gracias a la caché de
+    segmentos solo se codifican las fotos nuevas o cambiadas; mientras tanto se sigue
+    mostrando el video anterior, que se elimina cuando el nuevo está listo.
+    """
     if 'logged_in' not in session:
-        flash('Debes iniciar sesión para exportar.', 'warning')
         return redirect(url_for('login'))
 
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
+    persona = db.session.get(Persona, person_id)
+    if not persona:
+        flash('Persona no encontrada.', 'danger')
+        return redirect(url_for('admin'))
+    if not persona.images_uploaded:
+        flash('El video no se puede regenerar en este estado.', 'warning')
+        return redirect(url_for('admin'))
 
-    story = []
+    apply_music_choice(persona)
+    apply_video_style(persona)
+    # Carril del administrador: pasa por delante de las solicitudes públicas y no tiene límites
+    try:
+        job = None if persona.video_processing else admit_video_job(persona, admission.LANE_ADMIN)
+    except admission.AdmissionRejected as e:
+        db.session.rollback()
+        flash(e.message, 'warning')
+        return redirect(url_for('admin'))
+    if job is None:
+        db.session.rollback()
+        flash(f'El video de "{persona.nombre}" ya está en la cola.', 'info')
+        return redirect(url_for('admin'))
+    db.session.commit()
+    app.logger.info(f"Persona con ID {person_id} añadida a la cola para regenerar su video.")
+    flash(f'Se está regenerando el video de "{persona.nombre}".', 'info')
+    return redirect(url_for('admin'))
 
-    # Title
-    story.append(Paragraph("Registro de Personas", styles['h1']))
-    story.append(Spacer(1, 0.2 * inch))
+# --- PROGRESO DEL VIDEO EN VIVO ---
+
+# Estados tras los que ya no habrá más cambios que enviar a la página
+ESTADOS_FINALES = (JOB_DONE, JOB_FAILED, 'idle')
+
+@app.route('/status/<int:person_id>')
+def video_status(person_id):
+    """Estado actual del video en JSON (consulta puntual, alternativa a la conexión SSE)."""
+    estado = video_job_status(person_id)
+    if estado is None:
+        abort(404)
+    response = jsonify(estado)
+    response.cache_control.no_store = True
+    return response
+
+# Conexiones SSE abiertas en este proceso (ver JOB_STATUS_MAX_STREAMS)
+_status_streams = 0
+_status_streams_lock = threading.Lock()
+
+def _open_status_stream():
+    """Reserva un hilo para una conexión SSE. False si el proceso ya tiene el máximo abierto."""
+    global _status_streams
+    with _status_streams_lock:
+        if _status_streams >= app.config['JOB_STATUS_MAX_STREAMS']:
+            return False
+        _status_streams += 1
+        return True
+
+def _close_status_stream():
+    global _status_streams
+    with _status_streams_lock:
+        _status_streams -= 1
+
+@app.route('/status/<int:person_id>/events')
+def video_status_events(person_id):
+    """
+    Progreso del video por Server-Sent Events. Envía un evento cada vez que cambia el
+    estado y cierra al terminar el trabajo o tras JOB_STATUS_STREAM_SECONDS; el
+    navegador se reconecta solo. Cada lectura es una consulta pequeña a la base de
+    datos, que comparten todos los procesos de gunicorn y los trabajadores de video.
+    Con JOB_STATUS_MAX_STREAMS conexiones abiertas responde 503 y la página pasa a
+    consultar /status.
+    """
+    if app.config['JOB_STATUS_STREAM_SECONDS'] <= 0:
+        abort(404)
+    if not db.session.query(Persona.id).filter_by(id=person_id).first():
+        abort(404)
+    db.session.remove()  # No retener la conexión mientras dura el flujo
+    if not _open_status_stream():
+        app.logger.warning(f"Conexiones SSE agotadas ({app.config['JOB_STATUS_MAX_STREAMS']}): "
+                           f"la persona {person_id} consultará /status.")
+        response = Response(status=503)
+        response.headers['Retry-After'] = str(app.config['JOB_STATUS_STREAM_SECONDS'])
+        return response
+
+    def eventos():
+        limite = time.monotonic() + app.config['JOB_STATUS_STREAM_SECONDS']
+        ultimo = None
+        ultimo_envio = time.monotonic()
+        yield 'retry: 3000\n\n'  # Reconexión del navegador al cerrar el flujo
+        while True:
+            estado = video_job_status(person_id)
+            db.session.remove()
+            if estado is None:
+                return
+            if estado != ultimo:
+                yield f'data: {json.dumps(estado)}\n\n'
+                ultimo = estado
+                ultimo_envio = time.monotonic()
+            elif time.monotonic() - ultimo_envio >= 10:
+                yield ': ping\n\n'  # Comentario SSE: mantiene viva la conexión en proxies
+                ultimo_envio = time.monotonic()
+            if estado['estado'] in ESTADOS_FINALES or time.monotonic() >= limite:
+                return
+            time.sleep(app.config['JOB_STATUS_POLL_SECONDS'])
+
+    response = Response(stream_with_context(eventos()), mimetype='text/event-stream')
+    response.call_on_close(_close_status_stream)  # También si el navegador corta la conexión
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Evitar que un proxy nginx acumule los eventos
+    return response
+
+# --- MÉTRICAS (PROMETHEUS) ---
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Métricas del pipeline de video en formato Prometheus. Los gauges de la cola se
+    calculan con consultas agregadas sobre video_job; los contadores e histogramas son
+    las muestras acumuladas de video_metric, que no bajan aunque se borren trabajos.
+    Cualquier proceso de gunicorn devuelve los mismos valores. El uso del disco por área
+    sale de storage_usage, que lo vuelve a medir cada pocos minutos.
+    """
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+
+    por_estado = dict(db.session.query(VideoJob.status, db.func.count(VideoJob.id)).group_by(VideoJob.status).all())
+    mas_antiguo = (db.session.query(db.func.min(VideoJob.available_at))
+                   .filter(VideoJob.status == JOB_QUEUED, VideoJob.available_at <= _utcnow())
+                   .scalar())
+    espera_actual = (_utcnow() - mas_antiguo).total_seconds() if mas_antiguo else 0.0
+    acumuladas = metrics.collect_samples(
+        db.session.query(VideoMetric.name, VideoMetric.labels, VideoMetric.sample, VideoMetric.value))
+    areas = storage_usage.get()  # Medido como mucho cada STORAGE_USAGE_REFRESH_SECONDS
+
+    cuerpo = metrics.render_exposition([
+        metrics.render_metric('memorial_video_jobs', 'gauge', 'Trabajos de video por estado (queued = profundidad de la cola).',
+                              [({'status': estado}, por_estado.get(estado, 0))
+                               for estado in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)]),
+        metrics.render_metric('memorial_video_queue_oldest_wait_seconds', 'gauge',
+                              'Antigüedad del trabajo disponible más antiguo que aún no se ha tomado.',
+                              [(None, espera_actual)]),
+        metrics.render_metric(METRIC_JOBS_COMPLETED, 'counter', 'Videos generados correctamente.',
+                              metrics.counter_series(acumuladas.get(METRIC_JOBS_COMPLETED)) or [(None, 0)]),
+        metrics.render_metric(METRIC_JOB_FAILURES, 'counter', 'Intentos de generación fallidos (incluye los reintentados).',
+                              metrics.counter_series(acumuladas.get(METRIC_JOB_FAILURES)) or [(None, 0)]),
+        metrics.render_histogram(METRIC_QUEUE_WAIT, 'Espera en la cola antes de que un trabajador tome el trabajo.',
+                                 metrics.histogram_series(acumuladas.get(METRIC_QUEUE_WAIT), metrics.WAIT_BUCKETS),
+                                 metrics.WAIT_BUCKETS),
+        metrics.render_histogram(METRIC_STAGE_SECONDS, 'Duración de cada etapa del render (render = total).',
+                                 metrics.histogram_series(acumuladas.get(METRIC_STAGE_SECONDS), metrics.DURATION_BUCKETS),
+                                 metrics.DURATION_BUCKETS),
+        metrics.render_histogram(METRIC_OUTPUT_BYTES, 'Tamaño del MP4 generado.',
+                                 metrics.histogram_series(acumuladas.get(METRIC_OUTPUT_BYTES), metrics.SIZE_BUCKETS),
+                                 metrics.SIZE_BUCKETS),
+        metrics.render_metric('memorial_storage_bytes', 'gauge', 'Bytes ocupados por cada área de almacenamiento.',
+                              [({'area': nombre}, uso['bytes']) for nombre, uso in areas.items()]),
+        metrics.render_metric('memorial_storage_quota_bytes', 'gauge', 'Cuota de cada área de almacenamiento (0 = sin límite).',
+                              [({'area': nombre}, uso['cuota']) for nombre, uso in areas.items()]),
+        metrics.render_metric('memorial_storage_free_bytes', 'gauge', 'Espacio libre en el disco de la aplicación.',
+                              [(None, storage.disk_free(app.config['VIDEO_FOLDER']))]),
+    ])
+    return Response(cuerpo, content_type=metrics.CONTENT_TYPE)
+
+# --- ENTREGA DE VIDEOS ---
+
+@app.template_global()
+def video_url(video_path):
+    """URL de reproducción para un `video_path` relativo a 'static' (p. ej. 'videos/memorial_1_123.mp4')."""
+    return url_for('stream_video', filename=os.path.basename(video_path))
+
+@app.route('/media/videos/<path:filename>')
+def stream_video(filename):
+    """
+    Sirve un video generado con soporte de rangos (206), ETag fuerte y
+    revalidación (304). Los nombres llevan la marca de tiempo de generación,
+    así que el contenido de una URL nunca cambia y puede cachearse como inmutable.
+    """
+    if not (filename.startswith('memorial_') and filename.endswith('.mp4')):
+        abort(404)
+    # send_from_directory usa wsgi.file_wrapper (sendfile en gunicorn) y atiende Range/If-None-Match
+    response = send_from_directory(app.config['VIDEO_FOLDER'], filename,
+                                   mimetype='video/mp4', conditional=True, etag=True,
+                                   max_age=app.config['VIDEO_CACHE_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.template_global()
+def hls_url(hls_path):
+    """URL de la lista maestra HLS para un `hls_path` relativo a 'static'."""
+    return url_for('stream_hls', filename=hls_path.removeprefix('videos/hls/'))
+
+HLS_MIMETYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+@app.route('/media/hls/<path:filename>')
+def stream_hls(filename):
+    """Sirve listas y segmentos HLS. Cada render usa su propia carpeta, así que también son inmutables."""
+    mimetype = HLS_MIMETYPES.get(os.path.splitext(filename)[1])
+    if not filename.startswith('memorial_') or mimetype is None:
+        abort(404)
+    response = send_from_directory(os.path.join(app.config['VIDEO_FOLDER'], 'hls'), filename,
+                                   mimetype=mimetype, conditional=True, etag=True,
+                                   max_age=app.config['VIDEO_CACHE_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def _qr_path_for(row):
+    """Ruta absoluta del PNG de impresión del QR de una fila exportada (generado si faltaba)."""
+    return qr_cache.ensure_file(qr_view_url(row.id), qr_service.FORMAT_PNG, app.config['QR_PDF_SIZE'])
+
+def _qr_url_for(row):
+    """URL codificada en el QR de una fila exportada."""
+    return qr_view_url(row.id)
+
+def _run_background_pdf_export(path):
+    """Genera un PDF de exportación en segundo plano (hilo) con su propio contexto de aplicación."""
+    with app.app_context():
+        try:
+            total = exports.write_pdf_file(path, exports.iter_personas(db.session, Persona), _qr_path_for)
+            app.logger.info(f"📄 Exportación PDF terminada: {path} ({total} registros)")
+        except Exception as e:
+            app.logger.error(f"Error al generar la exportación PDF {path}: {e}", exc_info=True)
+        finally:
+            db.session.remove()
 
-    # Table Header
-    data = [["ID", "Nombre", "Nacimiento", "Fallecimiento", "Estado", "Código QR"]]
+@app.route('/export_pdf')
+def export_pdf():
+    if 'logged_in' not in session:
+        flash('Debes iniciar sesión para exportar.', 'warning')
+        return redirect(url_for('login'))
 
-    # Table Rows
-    # Export all records, not just filtered ones, for the PDF export
-    all_personas = Persona.query.order_by(Persona.id.asc()).all() 
-    for persona in all_personas:
-        qr_image_element = ""
-        if persona.qr_code_path:
-            # Construct the absolute path to the QR code image
-            qr_full_path = os.path.join(app.root_path, 'static', persona.qr_code_path)
-            if os.path.exists(qr_full_path):
-                # ReportLabImage takes width and height. Adjust as needed.
-                qr_image_element = ReportLabImage(qr_full_path, width=50, height=50) 
-            else:
-                qr_image_element = "QR Missing"
-        else:
-            qr_image_element = "No generado"
+    total = db.session.query(db.func.count(Persona.id)).scalar()
+    download_name = 'registros_personas.pdf'
+
+    if total <= app.config['EXPORT_SYNC_MAX_ROWS']:
+        # Registro pequeño: generar en la petición, sobre un archivo temporal en lugar de memoria
+        tmp = tempfile.TemporaryFile()
+        exports.write_pdf(tmp, exports.iter_personas(db.session, Persona), _qr_path_for)
+        tmp.seek(0)
+        return send_file(tmp, as_attachment=True, download_name=download_name, mimetype='application/pdf')
+
+    # Registro grande: generar en segundo plano para no agotar el timeout de gunicorn
+    export_name = f'registros_personas_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+    export_path = os.path.join(app.config['EXPORT_FOLDER'], export_name)
+    threading.Thread(target=_run_background_pdf_export, args=(export_path,), daemon=True).start()
+    flash(f'Se está generando el PDF con {total} registros. '
+          f'Estará disponible en unos minutos en: {url_for("download_export", filename=export_name)}', 'info')
+    return redirect(url_for('admin'))
 
-        status = ""
-        if persona.video_generated:
-            status = "Video Generado"
-        elif persona.images_uploaded:
-            status = "Imágenes Subidas"
-        else:
-            status = "Sin Imágenes"
-
-        data.append([
-            str(persona.id),
-            persona.nombre,
-            persona.fecha_nacimiento.strftime('%d/%m/%Y'),
-            persona.fecha_muerte.strftime('%d/%m/%Y'),
-            status,
-            qr_image_element
-        ])
+@app.route('/exports/<path:filename>')
+def download_export(filename):
+    """Descarga una exportación generada en segundo plano (o avisa si aún no está lista)."""
+    if 'logged_in' not in session:
+        return redirect(url_for('login'))
+    ruta = os.path.join(app.config['EXPORT_FOLDER'], secure_filename(filename))
+    if os.path.exists(ruta):
+        return send_from_directory(app.config['EXPORT_FOLDER'], secure_filename(filename), as_attachment=True)
+    if storage.is_being_written(ruta):
+        flash('La exportación todavía se está generando. Inténtalo de nuevo en unos momentos.', 'info')
+    else:
+        flash('Exportación no encontrada.', 'danger')
+    return redirect(url_for('admin'))
 
-    table = Table(data)
-
-    # Table Style
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#6c757d')), # Bootstrap secondary color
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f8f9fa')), # Bootstrap light color
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('LEFTPADDING', (0,0), (-1,-1), 6),
-        ('RIGHTPADDING', (0,0), (-1,-1), 6),
-        ('TOPPADDING', (0,0), (-1,-1), 6),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-    ]))
-    story.append(table)
-    doc.build(story)
-    buffer.seek(0)
-
-    return send_file(buffer, as_attachment=True, download_name='registros_personas.pdf', mimetype='application/pdf')
+@app.route('/export_csv')
+def export_csv():
+    """Exporta el registro como CSV, enviado por partes a medida que se leen las filas."""
+    if 'logged_in' not in session:
+        flash('Debes iniciar sesión para exportar.', 'warning')
+        return redirect(url_for('login'))
+
+    contenido = exports.iter_csv(exports.iter_personas(db.session, Persona), _qr_url_for)
+    return Response(stream_with_context(contenido), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=registros_personas.csv'})
 
 
 # --- NUEVAS RUTAS PARA ACTUALIZAR QR Y ELIMINAR ---
 
+@app.route('/qr/<int:person_id>.<fmt>')
+def qr_image(person_id, fmt):
+    """
+    Sirve el QR de una persona en PNG (?size=128|256|512|1024) o SVG, generándolo solo
+    la primera vez. La ETag es la clave de caché, así que cambia si cambia la URL codificada.
+    """
+    if fmt not in qr_service.MIMETYPES:
+        abort(404)
+    if not db.session.query(Persona.id).filter_by(id=person_id).first():
+        abort(404)
+
+    size = qr_service.nearest_png_size(request.args.get('size', app.config['QR_DEFAULT_SIZE'], type=int))
+    key = qr_service.qr_key(qr_view_url(person_id), fmt, size)
+    if key in request.if_none_match:
+        # El navegador ya tiene esta versión: ni siquiera hace falta leer la caché
+        response = Response(status=304)
+    else:
+        key, data = qr_cache.get(qr_view_url(person_id), fmt, size)
+        response = Response(data, mimetype=qr_service.MIMETYPES[fmt])
+        if request.args.get('download'):
+            nombre = f'qr_{person_id}.{fmt}' if fmt == qr_service.FORMAT_SVG else f'qr_{person_id}_{size}.{fmt}'
+            response.headers['Content-Disposition'] = f'attachment; filename={nombre}'
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['QR_CACHE_MAX_AGE']
+    return response
+
 @app.route('/update_qr/<int:person_id>', methods=['POST'])
 def update_qr(person_id):
-    """Regenera el código QR para una persona existente."""
+    """Regenera el código QR de una persona solo si la URL codificada cambió."""
     if 'logged_in' not in session:
         return redirect(url_for('login'))
     
@@ -462,11 +1994,20 @@ def update_qr(person_id):
         return redirect(url_for('admin'))
     
     try:
-        # La función generate_qr_code sobrescribirá el archivo QR existente
-        qr_path_rel = generate_qr_code(persona.id)
-        persona.qr_code_path = qr_path_rel
-        db.session.commit()
-        flash(f'Código QR para "{persona.nombre}" actualizado exitosamente.', 'success')
+        contenido = qr_view_url(persona.id)
+        if os.path.exists(qr_cache.disk_path(contenido, qr_service.FORMAT_PNG, app.config['QR_DEFAULT_SIZE'])):
+            mensaje = f'El código QR de "{persona.nombre}" ya estaba al día.'
+        else:
+            qr_cache.get(contenido, qr_service.FORMAT_PNG, app.config['QR_DEFAULT_SIZE'])
+            mensaje = f'Código QR para "{persona.nombre}" actualizado exitosamente.'
+        # Los PNG antiguos en static/qrcodes se sustituyen por la caché
+        if persona.qr_code_path:
+            legacy_path = os.path.join(app.root_path, 'static', persona.qr_code_path)
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+            persona.qr_code_path = None
+            db.session.commit()
+        flash(mensaje, 'success')
     except Exception as e:
         flash(f'Error al actualizar el código QR: {e}', 'danger')
     
@@ -484,62 +2025,456 @@ def delete_person(person_id):
         return redirect(url_for('admin'))
 
     nombre_persona = persona.nombre
+    qr_code_path, video_path, hls_path = persona.qr_code_path, persona.video_path, persona.hls_path
     try:
-        # 1. Eliminar archivo de Código QR
-        if persona.qr_code_path:
-            qr_full_path = os.path.join(app.root_path, 'static', persona.qr_code_path)
+        # 1. Eliminar el registro de la Base de Datos (y sus trabajos de video). Va primero:
+        # si después falla el borrado de algún archivo, el barrido de almacenamiento lo recoge.
+        trabajos = db.session.query(VideoJob.id).filter_by(persona_id=person_id)
+        VideoJobSpan.query.filter(VideoJobSpan.job_id.in_(trabajos)).delete(synchronize_session=False)
+        VideoJob.query.filter_by(persona_id=person_id).delete()
+        db.session.delete(persona)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al eliminar el registro: {e}', 'danger')
+        app.logger.error(f"Error al eliminar persona con ID {person_id}: {e}", exc_info=True)
+        return redirect(url_for('admin'))
+
+    try:
+        # 2. Eliminar el Código QR (archivo antiguo en static y variantes en caché)
+        if qr_code_path:
+            qr_full_path = os.path.join(app.root_path, 'static', qr_code_path)
             if os.path.exists(qr_full_path):
                 os.remove(qr_full_path)
                 app.logger.info(f"Archivo QR eliminado: {qr_full_path}")
+        qr_cache.discard(qr_view_url(person_id))
 
-        # 2. Eliminar archivo de Video
-        if persona.video_path:
-            video_full_path = os.path.join(app.root_path, 'static', persona.video_path)
-            if os.path.exists(video_full_path):
-                os.remove(video_full_path)
-                app.logger.info(f"Archivo de video eliminado: {video_full_path}")
+        # 3. Eliminar el archivo de Video y sus rendiciones HLS
+        remove_video_files(video_path, hls_path)
 
-        # 3. Eliminar carpeta de Imágenes Subidas
+        # 4. Eliminar carpeta de Imágenes Subidas
         upload_folder_path = os.path.join(app.config['UPLOAD_FOLDER'], str(person_id))
         if os.path.exists(upload_folder_path):
             shutil.rmtree(upload_folder_path)
             app.logger.info(f"Carpeta de imágenes eliminada: {upload_folder_path}")
-
-        # 4. Eliminar el registro de la Base de Datos
-        db.session.delete(persona)
-        db.session.commit()
-
-        flash(f'El registro de "{nombre_persona}" y todos sus archivos asociados han sido eliminados.', 'success')
-
     except Exception as e:
-        db.session.rollback() # Revertir cambios en la BD si falla la eliminación de archivos
-        flash(f'Error al eliminar el registro: {e}', 'danger')
-        app.logger.error(f"Error al eliminar persona con ID {person_id}: {e}", exc_info=True)
-    
+        app.logger.error(f"No se pudieron eliminar todos los archivos de la persona {person_id} "
+                         f"(el barrido de almacenamiento los eliminará): {e}", exc_info=True)
+
+    flash(f'El registro de "{nombre_persona}" y todos sus archivos asociados han sido eliminados.', 'success')
     return redirect(url_for('admin'))
 
 
 # --- FUNCIONES AUXILIARES ---
-def generate_qr_code(person_id):
-    """Genera un QR que apunta a la página de visualización y devuelve la ruta relativa."""
-    # Usamos la URL fija para el entorno de producción
-    view_url = f"https://memorialscan.onrender.com/view/{person_id}"
-    qr_filename = f'qr_{person_id}.png'
-    qr_path_abs = os.path.join(app.config['QR_CODE_FOLDER'], qr_filename)
-    
-    img = qrcode.make(view_url)
-    img.save(qr_path_abs)
-    
-    # CRÍTICO: ALMACENAR LA RUTA RELATIVA CON BARRAS DIAGONALES PARA LAS URLs.
-    # La ruta devuelta debe ser relativa a la carpeta 'static'
-    return f'qrcodes/{qr_filename}'
+def remove_video_files(video_path, hls_path):
+    """Elimina un MP4 generado y su carpeta de rendiciones HLS (rutas relativas a 'static')."""
+    if video_path:
+        video_full_path = os.path.join(app.root_path, 'static', video_path)
+        if os.path.exists(video_full_path):
+            os.remove(video_full_path)
+            app.logger.info(f"Archivo de video eliminado: {video_full_path}")
+    if hls_path:
+        hls_dir = os.path.dirname(os.path.join(app.root_path, 'static', hls_path))
+        if os.path.exists(hls_dir):
+            shutil.rmtree(hls_dir)
+            app.logger.info(f"Rendiciones HLS eliminadas: {hls_dir}")
+
+def qr_view_url(person_id):
+    """URL pública de la página de una persona, la que se codifica en su QR."""
+    # Se usa la URL pública configurada (QR_BASE_URL), no la del host de la petición
+    return f"{app.config['QR_BASE_URL']}/view/{person_id}"
+
+def import_personas(registros, batch_size=None, qr_workers=None):
+    """
+    Inserta personas en lotes (un commit por lote) y deja en la caché de disco, en paralelo,
+    el QR de impresión de cada una para que el PDF y las hojas de QR no tengan que generarlo.
+    Devuelve un informe por fila: dicts con fila, estado ('ok' o 'error'), id, nombre y error.
+    """
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    qr_workers = qr_workers or app.config['IMPORT_QR_WORKERS']
+    informe = []
+    validos = []
+    for fila, registro in enumerate(registros, start=1):
+        datos, error = bulk_import.validate_record(registro)
+        if error:
+            informe.append({'fila': fila, 'estado': 'error', 'id': None,
+                            'nombre': registro.get('nombre'), 'error': error})
+        else:
+            validos.append((fila, datos))
+
+    # Pool compartido del proceso: una importación desde la web no arranca procesos nuevos
+    pool = pools.get_pool(pools.QR, qr_workers)
+    for inicio in range(0, len(validos), batch_size):
+        lote = validos[inicio:inicio + batch_size]
+        personas = [Persona(**datos) for _, datos in lote]
+        try:
+            db.session.add_all(personas)
+            db.session.flush()  # Asigna los ids sin cerrar la transacción
+            ids = [p.id for p in personas]  # Leídos antes del commit, que expira los objetos
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error al insertar el lote de importación desde la fila {lote[0][0]}: {e}", exc_info=True)
+            informe.extend({'fila': fila, 'estado': 'error', 'id': None, 'nombre': datos['nombre'],
+                            'error': f'error de base de datos: {e}'} for fila, datos in lote)
+            continue
+
+        # QR del lote en paralelo (fuera de la transacción); si alguno falla se generará al pedirlo
+        errores_qr = qr_service.warm_disk_cache(
+            qr_cache, [qr_view_url(persona_id) for persona_id in ids],
+            qr_service.FORMAT_PNG, app.config['QR_PDF_SIZE'], pool=pool,
+        )
+        for (fila, datos), persona_id, error in zip(lote, ids, errores_qr):
+            informe.append({'fila': fila, 'estado': 'ok', 'id': persona_id, 'nombre': datos['nombre'],
+                            'error': f'QR no generado: {error}' if error else None})
+        db.session.expunge_all()  # Liberar memoria entre lotes
+
+    informe.sort(key=lambda r: r['fila'])
+    return informe
+
+# --- ALMACENAMIENTO: USO, CUOTAS Y BARRIDO DE HUÉRFANOS ---
+def storage_areas():
+    """Carpetas que ocupan el disco, con su tipo (datos o caché) y su cuota (ver storage.py)."""
+    cuotas = app.config['STORAGE_QUOTAS_MB']
+    # Último elemento: temporales de la versión anterior que se reconocen en el área (ver storage.py)
+    areas = [
+        ('videos', app.config['VIDEO_FOLDER'], storage.KIND_DATA, storage.legacy_video_temp),
+        ('uploads', app.config['UPLOAD_FOLDER'], storage.KIND_DATA, storage.legacy_upload_temp),
+        ('qrcodes', app.config['LEGACY_QR_FOLDER'], storage.KIND_DATA, None),
+        ('segment_cache', app.config['VIDEO_SEGMENT_CACHE_FOLDER'], storage.KIND_CACHE, None),
+        ('music_cache', app.config['MUSIC_CACHE_FOLDER'], storage.KIND_CACHE, None),
+        ('qr_cache', app.config['QR_CACHE_FOLDER'], storage.KIND_CACHE, None),
+        ('exports', app.config['EXPORT_FOLDER'], storage.KIND_CACHE, None),
+    ]
+    return [storage.Area(nombre, ruta, tipo, cuotas.get(nombre, 0) * 2**20, temporales)
+            for nombre, ruta, tipo, temporales in areas]
+
+storage_usage = storage.UsageSnapshot(storage_areas, max_age=app.config['STORAGE_USAGE_REFRESH_SECONDS'])
+
+def storage_write_refusal(area):
+    """
+    Mensaje para el usuario si no se debe escribir nada nuevo en `area` (disco casi lleno
+    o área de datos por encima de su cuota), o None si hay espacio.
+    """
+    libre = storage.disk_free(app.config['VIDEO_FOLDER'])
+    if libre < app.config['STORAGE_MIN_FREE_MB'] * 2**20:
+        app.logger.warning(f"💾 Solo quedan {storage.format_bytes(libre)} libres en el disco: no se aceptan escrituras en '{area}'.")
+        return 'El servidor se está quedando sin espacio. Vuelve a intentarlo más tarde.'
+    if app.config['STORAGE_QUOTAS_MB'].get(area):
+        uso = storage_usage.get(area)
+        if uso and uso['bytes'] >= uso['cuota']:
+            app.logger.warning(f"💾 El área '{area}' ocupa {storage.format_bytes(uso['bytes'])} y su cuota es "
+                               f"{storage.format_bytes(uso['cuota'])}: no se aceptan escrituras nuevas.")
+            return 'El servidor ha alcanzado su límite de almacenamiento. Vuelve a intentarlo más tarde.'
+    return None
+
+def _orphan_upload_entries(grace_seconds, now):
+    """Carpetas de subidas de personas que ya no existen (o sin imágenes) y archivos que ninguna Imagen referencia."""
+    carpeta = app.config['UPLOAD_FOLDER']
+    con_imagenes = set()
+    conservar = set()
+    for persona_id, subidas in db.session.query(Persona.id, Persona.images_uploaded):
+        if subidas:
+            conservar.add(str(persona_id))  # Personas anteriores al registro de imágenes: se respeta la carpeta
+    for (persona_id,) in db.session.query(Imagen.persona_id).distinct():
+        con_imagenes.add(persona_id)
+        conservar.add(str(persona_id))
+    encontrados = storage.orphans(carpeta, lambda nombre: nombre in conservar, grace_seconds, now)
+
+    # Dentro de las carpetas con Imagen: archivos sueltos (subidas rechazadas, derivados antiguos)
+    ids = sorted(con_imagenes)
+    for inicio in range(0, len(ids), 500):
+        lote = ids[inicio:inicio + 500]
+        rutas = set()
+        for fila in (db.session.query(Imagen.original_path, Imagen.thumb_webp_path,
+                                      Imagen.thumb_jpeg_path, Imagen.master_path)
+                     .filter(Imagen.persona_id.in_(lote))):
+            rutas.update(ruta for ruta in fila if ruta)
+        for persona_id in lote:
+            prefijo = f'uploads/{persona_id}/'
+            encontrados += storage.unreferenced_files(os.path.join(carpeta, str(persona_id)),
+                                                      lambda relativa: prefijo + relativa in rutas,
+                                                      grace_seconds, now)
+    return encontrados
+
+def _manifest_guard(candidatos):
+    """
+    Quita de `candidatos` las rutas que registra la tabla Imagen (y las carpetas que contienen
+    alguna): por mucho que parezcan temporales o huérfanas, el barrido nunca las borra.
+    """
+    por_persona = {}
+    for ruta in candidatos:
+        partes = os.path.relpath(ruta, app.static_folder).replace(os.sep, '/').split('/')
+        if len(partes) >= 2 and partes[0] == 'uploads' and partes[1].isdigit():
+            por_persona.setdefault(int(partes[1]), []).append((ruta, '/'.join(partes)))
+    protegidas = set()
+    ids = sorted(por_persona)
+    for inicio in range(0, len(ids), 500):
+        lote = ids[inicio:inicio + 500]
+        registradas = set()
+        for fila in (db.session.query(Imagen.original_path, Imagen.thumb_webp_path,
+                                      Imagen.thumb_jpeg_path, Imagen.master_path)
+                     .filter(Imagen.persona_id.in_(lote))):
+            registradas.update(ruta for ruta in fila if ruta)
+        for persona_id in lote:
+            for ruta, relativa in por_persona[persona_id]:
+                if relativa in registradas or any(r.startswith(relativa + '/') for r in registradas):
+                    app.logger.warning(f"🧹 {ruta} figura en el registro de imágenes: el barrido no la toca.")
+                    protegidas.add(ruta)
+    return [ruta for ruta in candidatos if ruta not in protegidas]
+
+def sweep_storage(dry_run=False, grace_seconds=None):
+    """
+    Reconcilia el disco con la base de datos: elimina temporales abandonados, videos y
+    rendiciones HLS que ninguna persona referencia, carpetas de subidas y QR de personas
+    borradas, exportaciones caducadas y, en las cachés que pasan su cuota, lo usado hace
+    más tiempo. Nada modificado en los últimos `grace_seconds` se toca, ni nada que
+    registre la tabla Imagen. Devuelve {categoría: (entradas, bytes)}; con `dry_run` solo mide.
+    """
+    grace = app.config['STORAGE_GRACE_SECONDS'] if grace_seconds is None else grace_seconds
+    ahora = time.time()
+    resultado = {}
+
+    def reclamar(candidatos):
+        return storage.reclaim(_manifest_guard(candidatos), dry_run)
+
+    temporales = []
+    for area in storage_areas():
+        temporales += storage.stale_temp_entries(area.path, grace, ahora, area.legacy_temp)
+    resultado['temporales'] = reclamar(temporales)
+
+    # Videos: los referenciados y los de personas con un render en curso (aún sin guardar en la BD)
+    videos, hls, qr_legacy, en_proceso = set(), set(), set(), []
+    for persona_id, video_path, hls_path, qr_code_path, procesando in db.session.query(
+            Persona.id, Persona.video_path, Persona.hls_path, Persona.qr_code_path, Persona.video_processing):
+        if video_path:
+            videos.add(os.path.basename(video_path))
+        if hls_path:
+            hls.add(os.path.basename(os.path.dirname(hls_path)))
+        if qr_code_path:
+            qr_legacy.add(os.path.basename(qr_code_path))
+        if procesando:
+            en_proceso.append(f'memorial_{persona_id}_')
+    en_proceso = tuple(en_proceso)
+    resultado['videos'] = reclamar(storage.orphans(
+        app.config['VIDEO_FOLDER'],
+        lambda nombre: nombre == 'hls' or nombre in videos or nombre.startswith(en_proceso),
+        grace, ahora))
+    resultado['hls'] = reclamar(storage.orphans(
+        os.path.join(app.config['VIDEO_FOLDER'], 'hls'),
+        lambda nombre: nombre in hls or nombre.startswith(en_proceso),
+        grace, ahora))
+
+    resultado['subidas'] = reclamar(_orphan_upload_entries(grace, ahora))
+
+    # QR: los PNG antiguos de static/qrcodes sin fila y las variantes en caché de personas borradas
+    qr_validas = set()
+    for (persona_id,) in db.session.query(Persona.id):
+        qr_validas.update(key for _, key in qr_service.variant_keys(qr_view_url(persona_id)))
+    huerfanos_qr = storage.orphans(app.config['LEGACY_QR_FOLDER'], lambda nombre: nombre in qr_legacy, grace, ahora)
+    huerfanos_qr += storage.unreferenced_files(
+        app.config['QR_CACHE_FOLDER'],
+        lambda relativa: os.path.splitext(os.path.basename(relativa))[0] in qr_validas,
+        grace, ahora)
+    resultado['qr'] = reclamar(huerfanos_qr)
+
+    resultado['exports'] = reclamar(storage.orphans(
+        app.config['EXPORT_FOLDER'], lambda nombre: False,
+        max(grace, app.config['EXPORT_RETENTION_SECONDS']), ahora))
+
+    # Cachés por encima de su cuota: se recortan hasta el 90 % para no hacerlo en cada barrido
+    recortados = liberados = 0
+    for area in storage_areas():
+        if area.kind != storage.KIND_CACHE or not area.quota_bytes:
+            continue
+        if storage.tree_usage(area.path)[0] > area.quota_bytes:
+            archivos, bytes_area = storage.evict_lru(area.path, int(area.quota_bytes * 0.9),
+                                                     grace_seconds=grace, dry_run=dry_run, now=ahora)
+            recortados += archivos
+            liberados += bytes_area
+    resultado['cuotas'] = (recortados, liberados)
+
+    entradas = sum(n for n, _ in resultado.values())
+    total = sum(b for _, b in resultado.values())
+    detalle = ', '.join(f'{categoria} {n} ({storage.format_bytes(b)})' for categoria, (n, b) in resultado.items() if n)
+    app.logger.info(f"🧹 Barrido de almacenamiento{' (simulado)' if dry_run else ''}: {entradas} entradas, "
+                    f"{storage.format_bytes(total)}{f' — {detalle}' if detalle else ''}")
+    if not dry_run:
+        storage_usage.invalidate()
+    return resultado
+
+# --- ARRANQUE ---
+# Importar este módulo solo configura la aplicación: no crea carpetas ni abre la base de datos.
+# create_app() prepara carpetas, conexión y esquema y, según el papel del proceso, arranca el
+# trabajador de video embebido. Es la factory que usa gunicorn (`gunicorn 'app:create_app()'`);
+# si se sirve `app:app` directamente, la primera petición la llama igualmente. No crea una
+# aplicación nueva en cada llamada: prepara (una vez) el `app` global de este módulo.
+_app_ready = False
+_app_ready_lock = threading.Lock()
+_embedded_worker = None
+_database_ready = False
+
+def prepare_database():
+    """
+    Crea la carpeta instance/ (la del archivo SQLite) y registra los PRAGMA de cada conexión
+    SQLite. Va antes de la primera conexión; es idempotente. La llaman create_app y los
+    comandos de base de datos.
+    """
+    global _database_ready
+    if _database_ready:
+        return
+    os.makedirs(instance_path, exist_ok=True)
+    with app.app_context():
+        database.configure_sqlite(db.engine, busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT_MS'])
+    _database_ready = True
+
+def create_app(role=None):
+    """Prepara la aplicación para el papel `role` (APP_ROLE por defecto) y la devuelve. Es idempotente."""
+    global _app_ready
+    role = role or app.config['APP_ROLE']
+    with _app_ready_lock:
+        if not _app_ready:
+            prepare_database()
+            for clave in WORK_FOLDERS:
+                os.makedirs(app.config[clave], exist_ok=True)
+            arranque.mark('folders')
+            if app.config['DB_AUTO_MIGRATE']:
+                # Idempotente; si dos procesos de gunicorn compiten, basta con que uno gane
+                with app.app_context():
+                    try:
+                        migrate_schema()
+                    except Exception as e:
+                        app.logger.warning(f"No se pudo actualizar el esquema al iniciar: {e}")
+                arranque.mark('schema')
+            _app_ready = True
+        if role == ROLE_ALL:
+            start_embedded_worker()
+    arranque.mark(f'ready role={role}')
+    return app
+
+def start_embedded_worker():
+    """Procesa la cola de videos en un hilo de este proceso (APP_ROLE=all). Solo una vez por proceso."""
+    global _embedded_worker
+    if _embedded_worker is not None:
+        return
+    with app.app_context():
+        requeue_stale_video_jobs()
+        db.session.remove()
+    _embedded_worker = threading.Thread(target=video_worker, args=(f'embedded:{os.getpid()}',),
+                                        name='video-worker-embedded', daemon=True)
+    _embedded_worker.start()
+    app.logger.info("Trabajador de video iniciado en segundo plano.")
+
+@app.before_request
+def _ensure_app_ready():
+    if not _app_ready:
+        create_app()
+
+_primera_peticion = arranque.enabled
+
+@app.after_request
+def _mark_first_request(response):
+    global _primera_peticion
+    if _primera_peticion:
+        _primera_peticion = False
+        arranque.mark(f'first_request path={request.path}')
+    return response
+
+@app.cli.command('import-personas')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=None, help='Registros por transacción.')
+@click.option('--workers', type=int, default=None, help='Procesos para generar los QR.')
+@click.option('--report', type=click.Path(dir_okay=False), default=None, help='Guardar el informe por fila en JSON.')
+def import_personas_command(archivo, batch_size, workers, report):
+    """Importa personas desde un archivo CSV o JSON."""
+    create_app(role=ROLE_WEB)
+    with open(archivo, 'rb') as f:
+        registros = bulk_import.parse_records(f.read(), archivo)
+    informe = import_personas(registros, batch_size=batch_size, qr_workers=workers)
+    pools.shutdown(pools.QR)
+    ok = sum(1 for r in informe if r['estado'] == 'ok')
+    for r in informe:
+        if r['error']:
+            click.echo(f"Fila {r['fila']}: {r['error']}")
+    click.echo(f"Importadas {ok} de {len(informe)} filas.")
+    if report:
+        with open(report, 'w', encoding='utf-8') as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+
+@app.cli.command('backfill-images')
+@click.option('--limit', type=int, default=None, help='Personas como mucho (todas por defecto).')
+def backfill_images_command(limit):
+    """Registra en la tabla Imagen las fotos de las personas anteriores a ese registro."""
+    create_app(role=ROLE_WEB)
+    procesadas = backfill_image_manifests(limit)
+    click.echo(f"Personas procesadas: {procesadas}.")
+
+@app.cli.command('music-stems')
+@click.option('--min-images', type=int, default=3, help='Menor número de fotos de un memorial.')
+@click.option('--max-images', type=int, default=10, help='Mayor número de fotos de un memorial.')
+def music_stems_command(min_images, max_images):
+    """Prepara de antemano los stems AAC de todas las pistas para cada duración de video posible."""
+    create_app(role=ROLE_WEB)
+    duracion_por_imagen = 10  # Igual que en render_memorial_video
+    for pista in music.tracks():
+        ruta = os.path.join(app.config['MUSIC_FOLDER'], pista['id'])
+        for num_imagenes in range(min_images, max_images + 1):
+            music.stem_for(ruta, duracion_por_imagen * num_imagenes)
+        click.echo(f"{pista['id']}: stems de {min_images} a {max_images} fotos listos.")
+
+@app.cli.command('storage-usage')
+def storage_usage_command():
+    """Muestra lo que ocupa cada área de almacenamiento, su cuota y el espacio libre."""
+    create_app(role=ROLE_WEB)
+    click.echo(f"{'área':<15}{'tipo':<7}{'archivos':>10}{'ocupado':>12}{'cuota':>12}{'uso':>7}")
+    for fila in storage.usage(storage_areas()):
+        cuota = storage.format_bytes(fila['cuota']) if fila['cuota'] else '-'
+        fraccion = f"{fila['fraccion'] * 100:.0f}%" if fila['fraccion'] is not None else '-'
+        click.echo(f"{fila['area']:<15}{fila['tipo']:<7}{fila['archivos']:>10}"
+                   f"{storage.format_bytes(fila['bytes']):>12}{cuota:>12}{fraccion:>7}")
+    click.echo(f"Libre en el disco: {storage.format_bytes(storage.disk_free(app.config['VIDEO_FOLDER']))}")
+
+@app.cli.command('storage-sweep')
+@click.option('--dry-run', is_flag=True, help='Solo mostrar lo que se eliminaría.')
+@click.option('--grace-seconds', type=int, default=None,
+              help='No tocar lo modificado hace menos de esto (STORAGE_GRACE_SECONDS por defecto).')
+def storage_sweep_command(dry_run, grace_seconds):
+    """Elimina archivos huérfanos y temporales abandonados y recorta las cachés que pasan su cuota."""
+    create_app(role=ROLE_WEB)
+    resultado = sweep_storage(dry_run=dry_run, grace_seconds=grace_seconds)
+    for categoria, (entradas, liberados) in resultado.items():
+        click.echo(f"{categoria:<12}{entradas:>8} entradas {storage.format_bytes(liberados):>12}")
+    verbo = 'Se liberarían' if dry_run else 'Liberados'
+    click.echo(f"{verbo} {storage.format_bytes(sum(b for _, b in resultado.values()))}.")
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Crea lo que falte del esquema y aplica las migraciones pendientes."""
+    prepare_database()
+    for clave in WORK_FOLDERS:
+        os.makedirs(app.config[clave], exist_ok=True)
+    aplicadas = migrate_schema()
+    click.echo(f"Migraciones aplicadas: {', '.join(aplicadas) if aplicadas else 'ninguna (el esquema ya está al día)'}")
+
+@app.cli.command('db-status')
+def db_status_command():
+    """Muestra el motor de base de datos y el estado de cada migración."""
+    prepare_database()
+    click.echo(f"Motor: {db.engine.dialect.name} ({db.engine.url.render_as_string(hide_password=True)})")
+    hechas = database.applied_versions(db.engine)
+    for version, nombre, _ in SCHEMA_MIGRATIONS:
+        click.echo(f"  {version:>3} {nombre:<40} {'aplicada' if version in hechas else 'pendiente'}")
+
+arranque.mark('module')  # Configuración, modelos y rutas definidos
 
 if __name__ == '__main__':
-    with app.app_context():
-        # --- CRÍTICO: ELIMINAR LA BASE DE DATOS EXISTENTE PARA ASEGURAR RUTAS LIMPIAS ---
-        # ATENCIÓN: Esto borrará todos tus datos. Comenta esta línea si no quieres perderlos
-        # y prefieres actualizar los registros manualmente si la base de datos es persistente.
-        # db.drop_all() # Descomenta para borrar todos los datos
-        db.create_all()
+    # --- CRÍTICO: ELIMINAR LA BASE DE DATOS EXISTENTE PARA ASEGURAR RUTAS LIMPIAS ---
+    # ATENCIÓN: Esto borrará todos tus datos. Descomenta solo si no te importa perderlos.
+    # with app.app_context(): db.drop_all()
+    # Con APP_ROLE=all la cola de videos se procesa en un hilo de este mismo proceso;
+    # si no, hay que lanzar `python worker.py` aparte, como en producción.
+    create_app()
+    if app.config['APP_ROLE'] != ROLE_ALL:
+        app.logger.info("Sin trabajador de video en este proceso: ejecuta `python worker.py` o usa APP_ROLE=all.")
     # use_reloader=False es importante para evitar que el hilo de fondo se inicie dos veces
     app.run(debug=True, host='0.0.0.0', port=5001, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,279 @@
+"""
+Casos de benchmark. Cada caso se ejecuta en un proceso propio lanzado por `run.py`,
+dentro de una copia temporal de la aplicación (base de datos SQLite y carpetas
+'static' e 'instance' desechables), así que nunca toca los datos reales.
+
+Uso interno:  python cases.py <caso> '<parámetros JSON>'
+Imprime en la última línea un JSON con wall_s, cpu_s, peak_rss_mb y métricas extra.
+
+Cada caso es una función `setup(**params)` que prepara los datos (no se mide) y
+devuelve la función que se mide, que a su vez puede devolver un dict de métricas extra.
+"""
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from PIL import Image
+
+# --- DATOS SINTÉTICOS ---
+
+def synthetic_image(width, height, seed, fmt='JPEG'):
+    """Foto sintética (degradado + ruido, para que el JPEG pese como una foto real) en bytes."""
+    rnd = random.Random(seed)
+    base = Image.linear_gradient('L').resize((width, height))
+    ruido = Image.effect_noise((width, height), 40 + rnd.randint(0, 30))
+    tinte = tuple(rnd.randint(0, 255) for _ in range(3))
+    img = Image.merge('RGB', (base, ruido, Image.new('L', (width, height), tinte[2])))
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, quality=90)
+    return buffer.getvalue()
+
+
+def synthetic_photos(count, seed=0):
+    """Fotos de móvil variadas: horizontales, verticales y cuadradas de 6 a 12 Mpx."""
+    tamanos = [(3000, 2000), (2000, 3000), (4000, 3000), (2400, 2400)]
+    return [synthetic_image(*tamanos[i % len(tamanos)], seed=seed + i) for i in range(count)]
+
+
+def synthetic_music(app):
+    """Pista de audio de 30 s generada con FFmpeg, con el nombre que espera el render."""
+    import subprocess
+    destino = os.path.join(app.config['MUSIC_FOLDER'], 'background_music.mp3')
+    if not os.path.exists(destino):
+        subprocess.run([app.config['FFMPEG_BINARY'], '-hide_banner', '-loglevel', 'error', '-y',
+                        '-f', 'lavfi', '-i', 'sine=frequency=220:duration=30',
+                        '-c:a', 'libmp3lame', '-b:a', '128k', destino], check=True)
+
+
+NOMBRES = ['María', 'José', 'Ana', 'Luis', 'Carmen', 'Jorge', 'Lucía', 'Pedro', 'Elena', 'Tyrone']
+APELLIDOS = ['García', 'González', 'Rodríguez', 'Fernández', 'López', 'Martínez', 'Sánchez', 'Pérez']
+
+
+def seed_personas(app, count, batch=5000):
+    """Inserta `count` personas con estados variados (un cuarto de ellas con video)."""
+    from sqlalchemy import insert
+    from app import db, Persona
+    rnd = random.Random(42)
+    with app.app_context():
+        for inicio in range(0, count, batch):
+            filas = []
+            for i in range(inicio, min(inicio + batch, count)):
+                nacimiento = date(1930, 1, 1) + timedelta(days=rnd.randint(0, 25000))
+                estado = i % 4
+                filas.append({
+                    'nombre': f'{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}',
+                    'fecha_nacimiento': nacimiento,
+                    'fecha_muerte': nacimiento + timedelta(days=rnd.randint(3000, 30000)),
+                    'images_uploaded': estado >= 1,
+                    'video_processing': estado == 2,
+                    'video_generated': estado == 3,
+                    'video_path': f'videos/memorial_{i}_0.mp4' if estado == 3 else None,
+                })
+            db.session.execute(insert(Persona), filas)
+            db.session.commit()
+
+
+def _logged_client(app):
+    client = app.test_client()
+    with client.session_transaction() as sesion:
+        sesion['logged_in'] = True
+    return client
+
+
+def _latencias(client, url, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = client.get(url)
+        tiempos.append(time.perf_counter() - inicio)
+        if respuesta.status_code != 200:
+            raise RuntimeError(f'{url} devolvió {respuesta.status_code}')
+    tiempos.sort()
+    return {'p50_ms': round(statistics.median(tiempos) * 1000, 2),
+            'p95_ms': round(tiempos[int(len(tiempos) * 0.95) - 1] * 1000, 2)}
+
+
+# --- CASOS ---
+
+def setup_render(images=3, width=1280, height=720, backend='ffmpeg', audio=True, hls=False, rerender=False,
+                 style=None):
+    """
+    Render completo de un trabajo de la cola (lo que hace video_worker por cada trabajo).
+    Con `rerender` se mide una regeneración con la caché de segmentos ya llena y con
+    `style` un estilo de transitions.STYLES ('suave', 'movimiento').
+    """
+    import pools
+    from app import create_app, db, Persona, claim_next_video_job, process_video_job
+    app = create_app()
+    app.config.update(VIDEO_BACKEND=backend, VIDEO_WIDTH=width, VIDEO_HEIGHT=height, VIDEO_HLS_ENABLED=hls)
+    if audio:
+        synthetic_music(app)
+
+    client = app.test_client()
+    with app.app_context():
+        persona = Persona(nombre='Benchmark', fecha_nacimiento=date(1950, 1, 1), fecha_muerte=date(2020, 1, 1),
+                          video_style=style)
+        db.session.add(persona)
+        db.session.commit()
+        person_id = persona.id
+    fotos = [(io.BytesIO(data), f'foto_{i}.jpg') for i, data in enumerate(synthetic_photos(images))]
+    client.post(f'/upload_images/{person_id}', data={'images': fotos})
+    client.post(f'/generate_video/{person_id}')
+    if rerender:
+        with app.app_context():
+            process_video_job(claim_next_video_job('benchmark'), 'benchmark')
+        time.sleep(1)  # El nombre del video lleva la marca de tiempo en segundos
+        admin = _logged_client(app)
+        admin.post(f'/rerender_video/{person_id}')
+
+    def run():
+        with app.app_context():
+            job = claim_next_video_job('benchmark')
+            process_video_job(job, 'benchmark')
+            pools.shutdown(pools.IMAGES)  # Cerrar el pool para que su CPU cuente en RUSAGE_CHILDREN
+            persona = db.session.get(Persona, person_id)
+            if not persona.video_generated:
+                raise RuntimeError('El render del benchmark falló (ver el log).')
+            return {'output_mb': round(os.path.getsize(os.path.join(app.root_path, 'static', persona.video_path)) / 2**20, 2)}
+    return run
+
+
+def setup_resize(images=10, width=1280, height=720, workers=1, mode='letterbox'):
+    """Bucle de preparación de cuadros (decodificar, orientar y ajustar) sobre fotos originales."""
+    import tempfile
+    import image_pipeline
+    import pools
+    carpeta = tempfile.mkdtemp(prefix='bench_resize_')
+    rutas = []
+    for i, data in enumerate(synthetic_photos(images)):
+        ruta = os.path.join(carpeta, f'{i:02d}.jpg')
+        with open(ruta, 'wb') as f:
+            f.write(data)
+        rutas.append(ruta)
+
+    def run():
+        frames = image_pipeline.prepare_frames(rutas, (width, height), mode=mode, workers=workers)
+        pools.shutdown(pools.IMAGES)  # Cerrar el pool para que su CPU cuente en RUSAGE_CHILDREN
+        if len(frames) != images:
+            raise RuntimeError('No se prepararon todas las imágenes.')
+    return run
+
+
+def setup_export_pdf(personas=1000, warm_qr=True):
+    """Exportación PDF completa dentro de la petición (con los QR ya en caché si warm_qr)."""
+    import pools
+    import qr_service
+    from app import create_app, qr_cache, qr_view_url
+    app = create_app()
+    app.config['EXPORT_SYNC_MAX_ROWS'] = personas + 1
+    seed_personas(app, personas)
+    if warm_qr:
+        try:
+            qr_service.warm_disk_cache(qr_cache, [qr_view_url(i) for i in range(1, personas + 1)],
+                                       qr_service.FORMAT_PNG, app.config['QR_PDF_SIZE'],
+                                       pool=pools.get_pool(pools.QR, os.cpu_count() or 1))
+        finally:
+            pools.shutdown(pools.QR)
+    client = _logged_client(app)
+
+    def run():
+        respuesta = client.get('/export_pdf')
+        if respuesta.status_code != 200:
+            raise RuntimeError(f'/export_pdf devolvió {respuesta.status_code}')
+        return {'pdf_mb': round(len(respuesta.data) / 2**20, 2)}
+    return run
+
+
+def setup_admin(personas=10000, repeticiones=50):
+    """Latencia del panel: primera página, página profunda, filtro de estado y búsqueda."""
+    from app import create_app
+    app = create_app()
+    seed_personas(app, personas)
+    client = _logged_client(app)
+    consultas = {
+        'first_page': '/admin',
+        'deep_page': f'/admin?after={personas // 2}',
+        'estado': '/admin?estado=generado',
+        'search': '/admin?search=gonz mar',
+    }
+
+    def run():
+        return {nombre: _latencias(client, url, repeticiones) for nombre, url in consultas.items()}
+    return run
+
+
+def setup_view_person(requests=500):
+    """Peticiones por segundo de la página pública en sus tres estados más comunes."""
+    from app import create_app
+    app = create_app()
+    seed_personas(app, 100)
+    client = app.test_client()
+    # ids 1-4 cubren: sin imágenes, imágenes subidas, procesando y video generado
+    urls = [f'/view/{person_id}' for person_id in (1, 2, 3, 4)]
+
+    def run():
+        inicio = time.perf_counter()
+        for i in range(requests):
+            respuesta = client.get(urls[i % len(urls)])
+            if respuesta.status_code != 200:
+                raise RuntimeError(f'{urls[i % len(urls)]} devolvió {respuesta.status_code}')
+        return {'req_per_s': round(requests / (time.perf_counter() - inicio), 1)}
+    return run
+
+
+def setup_cold_start(personas=100):
+    """
+    Arranque en frío de un proceso web: importar la aplicación, create_app() y responder a
+    la primera visita de una página pública (lo que paga cada proceso nuevo de gunicorn).
+    """
+    import subprocess
+    from app import create_app
+    seed_personas(create_app(), personas)  # Deja también el esquema al día, como en un despliegue
+    script = ("import app; app.create_app(); "
+              "r = app.app.test_client().get('/view/4'); assert r.status_code == 200, r.status_code")
+
+    def run():
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, '-c', script], check=True, env=dict(os.environ, STARTUP_TIMING='0'))
+        return {'first_response_ms': round((time.perf_counter() - inicio) * 1000, 1)}
+    return run
+
+
+CASES = {
+    'render': setup_render,
+    'resize': setup_resize,
+    'export_pdf': setup_export_pdf,
+    'admin': setup_admin,
+    'view_person': setup_view_person,
+    'cold_start': setup_cold_start,
+}
+
+
+def measure(run):
+    """Ejecuta `run` midiendo tiempo real, CPU (propia y de subprocesos) y pico de memoria."""
+    antes_propio = resource.getrusage(resource.RUSAGE_SELF)
+    antes_hijos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    inicio = time.perf_counter()
+    extra = run() or {}
+    wall = time.perf_counter() - inicio
+    despues_propio = resource.getrusage(resource.RUSAGE_SELF)
+    despues_hijos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(getattr(despues, campo) - getattr(antes, campo)
+              for antes, despues in ((antes_propio, despues_propio), (antes_hijos, despues_hijos))
+              for campo in ('ru_utime', 'ru_stime'))
+    # ru_maxrss está en KiB en Linux (en bytes en macOS)
+    escala = 1 if sys.platform == 'darwin' else 1024
+    pico = max(despues_propio.ru_maxrss, despues_hijos.ru_maxrss) * escala / 2**20
+    return {'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3), 'peak_rss_mb': round(pico, 1), **extra}
+
+
+if __name__ == '__main__':
+    caso, params = sys.argv[1], json.loads(sys.argv[2]) if len(sys.argv) > 2 else {}
+    resultado = measure(CASES[caso](**params))
+    print(json.dumps(resultado))
@@ -0,0 +1,193 @@
+"""
+Benchmarks de los caminos críticos de la aplicación: render de video, preparación
+de imágenes, exportación PDF, panel de administración, página pública y arranque en frío.
+
+Todo funciona sin red: las fotos, la música y las personas son sintéticas y cada
+caso corre en un proceso nuevo dentro de una copia temporal de la aplicación, con
+su propia base de datos SQLite. Se mide el tiempo real, el tiempo de CPU (incluidos
+FFmpeg y los pools de procesos) y el pico de memoria (RSS).
+
+Uso (desde la raíz del repositorio, con FFmpeg en el PATH):
+
+    python benchmarks/run.py                   # conjunto por defecto
+    python benchmarks/run.py --quick           # versión corta, para comprobar que todo funciona
+    python benchmarks/run.py --full            # incluye 50k personas y el motor MoviePy
+    python benchmarks/run.py --only render --only resize
+    python benchmarks/run.py --save-baseline   # guarda los resultados como referencia
+    python benchmarks/run.py --check           # falla (código 1) si algo empeora más de --tolerance
+
+La referencia se guarda en benchmarks/baseline.json. Solo es comparable en la misma
+máquina, así que cada entorno (portátil, CI) debe generar la suya.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# Métricas comparadas con la referencia (menos es mejor en todas)
+COMPARED = ('wall_s', 'cpu_s', 'peak_rss_mb')
+
+# (nombre del caso, parámetros) por conjunto
+SUITES = {
+    'quick': [
+        ('render', {'images': 3}),
+        ('render', {'images': 3, 'style': 'suave'}),
+        ('resize', {'images': 3}),
+        ('export_pdf', {'personas': 200}),
+        ('admin', {'personas': 2000, 'repeticiones': 10}),
+        ('view_person', {'requests': 100}),
+        ('cold_start', {}),
+    ],
+    'default': [
+        ('render', {'images': 3}),
+        ('render', {'images': 6}),
+        ('render', {'images': 10}),
+        ('render', {'images': 10, 'width': 1920, 'height': 1080}),
+        ('render', {'images': 10, 'hls': True}),
+        ('render', {'images': 10, 'rerender': True}),
+        ('render', {'images': 10, 'style': 'suave'}),
+        ('render', {'images': 10, 'style': 'movimiento'}),
+        ('resize', {'images': 10, 'workers': 1}),
+        ('resize', {'images': 10, 'workers': os.cpu_count() or 1}),
+        ('resize', {'images': 10, 'width': 1920, 'height': 1080, 'mode': 'crop'}),
+        ('export_pdf', {'personas': 1000}),
+        ('export_pdf', {'personas': 10000}),
+        ('admin', {'personas': 10000}),
+        ('view_person', {'requests': 500}),
+        ('cold_start', {}),
+    ],
+}
+SUITES['full'] = SUITES['default'] + [
+    ('render', {'images': 3, 'backend': 'moviepy'}),
+    ('render', {'images': 10, 'backend': 'moviepy'}),
+    ('export_pdf', {'personas': 50000}),
+    ('admin', {'personas': 50000}),
+]
+
+
+def case_id(name, params):
+    """Identificador estable de un caso con sus parámetros (clave en la referencia)."""
+    return name + ''.join(f' {clave}={valor}' for clave, valor in sorted(params.items()))
+
+
+def make_workspace():
+    """Copia temporal de la aplicación (código, plantillas y recursos estáticos, sin datos)."""
+    destino = tempfile.mkdtemp(prefix='memorial_bench_')
+    for nombre in os.listdir(REPO_DIR):
+        origen = os.path.join(REPO_DIR, nombre)
+        if nombre.endswith('.py'):
+            shutil.copy2(origen, destino)
+    shutil.copytree(os.path.join(REPO_DIR, 'templates'), os.path.join(destino, 'templates'))
+    for carpeta in ('css', 'js'):
+        shutil.copytree(os.path.join(REPO_DIR, 'static', carpeta), os.path.join(destino, 'static', carpeta))
+    return destino
+
+
+def run_case(name, params, verbose=False):
+    """Ejecuta un caso en un proceso nuevo y en un espacio de trabajo limpio."""
+    workspace = make_workspace()
+    try:
+        env = dict(os.environ, PYTHONPATH=workspace, LOG_LEVEL='INFO' if verbose else 'WARNING')
+        proceso = subprocess.run(
+            [sys.executable, os.path.join(BENCH_DIR, 'cases.py'), name, json.dumps(params)],
+            cwd=workspace, env=env, capture_output=True, text=True,
+        )
+        if verbose or proceso.returncode != 0:
+            sys.stderr.write(proceso.stderr)
+        if proceso.returncode != 0:
+            return {'error': proceso.stderr.strip().splitlines()[-1] if proceso.stderr.strip() else 'error'}
+        return json.loads(proceso.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def compare(resultado, referencia, tolerance):
+    """Devuelve las métricas que empeoraron más de `tolerance` (fracción) respecto a la referencia."""
+    regresiones = []
+    for metrica in COMPARED:
+        antes, ahora = referencia.get(metrica), resultado.get(metrica)
+        if antes and ahora is not None and ahora > antes * (1 + tolerance):
+            regresiones.append(f'{metrica} {antes} -> {ahora} (+{(ahora / antes - 1) * 100:.0f}%)')
+    return regresiones
+
+
+def format_row(cid, resultado, referencia):
+    if 'error' in resultado:
+        return f'{cid:<55} ERROR: {resultado["error"]}'
+    columnas = []
+    for metrica in COMPARED:
+        valor = resultado[metrica]
+        texto = f'{valor:>9}'
+        if referencia and referencia.get(metrica):
+            texto += f' ({(valor / referencia[metrica] - 1) * 100:+.0f}%)'
+        columnas.append(f'{texto:<17}')
+    extra = {k: v for k, v in resultado.items() if k not in COMPARED}
+    return f'{cid:<55} ' + ''.join(columnas) + (json.dumps(extra, ensure_ascii=False) if extra else '')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks de la aplicación de memoriales.')
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument('--quick', action='store_true', help='Conjunto corto.')
+    grupo.add_argument('--full', action='store_true', help='Conjunto completo (lento).')
+    parser.add_argument('--only', action='append', default=[], help='Ejecutar solo este caso (repetible).')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Archivo de referencia.')
+    parser.add_argument('--save-baseline', action='store_true', help='Guardar los resultados como referencia.')
+    parser.add_argument('--check', action='store_true', help='Salir con código 1 si hay regresiones.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Empeoramiento tolerado (0.25 = 25%%).')
+    parser.add_argument('--output', help='Guardar también los resultados en este archivo JSON.')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar el log de cada caso.')
+    args = parser.parse_args(argv)
+
+    suite = SUITES['quick' if args.quick else 'full' if args.full else 'default']
+    if args.only:
+        suite = [(nombre, params) for nombre, params in suite if nombre in args.only]
+
+    referencia = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            referencia = json.load(f).get('results', {})
+
+    print(f'{"caso":<55} {"wall_s":<17}{"cpu_s":<17}{"peak_rss_mb":<17}extra')
+    resultados, regresiones = {}, []
+    for nombre, params in suite:
+        cid = case_id(nombre, params)
+        resultado = run_case(nombre, params, verbose=args.verbose)
+        resultados[cid] = resultado
+        print(format_row(cid, resultado, referencia.get(cid)), flush=True)
+        if 'error' not in resultado and cid in referencia:
+            regresiones += [f'{cid}: {r}' for r in compare(resultado, referencia[cid], args.tolerance)]
+
+    documento = {'machine': {'cpus': os.cpu_count(), 'platform': sys.platform, 'python': sys.version.split()[0]},
+                 'results': resultados}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(documento, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                anterior = json.load(f)
+            documento['results'] = {**anterior.get('results', {}), **resultados}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(documento, f, ensure_ascii=False, indent=2)
+        print(f'Referencia guardada en {args.baseline}')
+
+    errores = [cid for cid, r in resultados.items() if 'error' in r]
+    if regresiones:
+        print('\nRegresiones respecto a la referencia:')
+        for linea in regresiones:
+            print(f'  - {linea}')
+    if errores or (args.check and regresiones):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
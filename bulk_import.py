@@ -0,0 +1,94 @@
+"""
+Importación masiva de personas desde CSV o JSON.
+
+Este módulo no depende de Flask: lee y valida los registros. La inserción por
+lotes en la base de datos la hace `app.import_personas`, que además deja listos
+en la caché de `qr_service` los QR que se usan al imprimir y exportar a PDF.
+
+Formatos aceptados:
+- CSV con cabecera: nombre, fecha_nacimiento, fecha_muerte
+  (también sirven las cabeceras del CSV exportado: Nombre, Nacimiento, Fallecimiento).
+- JSON: lista de objetos con esas mismas claves (o {"personas": [...]}).
+Las fechas pueden venir como AAAA-MM-DD o DD/MM/AAAA.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+NOMBRE_MAX = 150
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+# Cabeceras admitidas -> campo del modelo
+FIELD_ALIASES = {
+    'nombre': 'nombre',
+    'fecha_nacimiento': 'fecha_nacimiento',
+    'nacimiento': 'fecha_nacimiento',
+    'fecha_muerte': 'fecha_muerte',
+    'fallecimiento': 'fecha_muerte',
+}
+
+
+class ImportFormatError(ValueError):
+    """El archivo no se puede leer como CSV o JSON de personas."""
+
+
+def parse_records(data, filename=''):
+    """Lee los registros de `data` (bytes o str) según la extensión del archivo."""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    es_json = filename.lower().endswith('.json') or data.lstrip().startswith(('[', '{'))
+
+    if es_json:
+        try:
+            contenido = json.loads(data)
+        except json.JSONDecodeError as e:
+            raise ImportFormatError(f"JSON no válido: {e}")
+        if isinstance(contenido, dict):
+            contenido = contenido.get('personas')
+        if not isinstance(contenido, list) or not all(isinstance(r, dict) for r in contenido):
+            raise ImportFormatError("El JSON debe ser una lista de objetos de personas.")
+        registros = contenido
+    else:
+        registros = list(csv.DictReader(io.StringIO(data)))
+
+    normalizados = []
+    for registro in registros:
+        normalizado = {}
+        for clave, valor in registro.items():
+            campo = FIELD_ALIASES.get(str(clave or '').strip().lower())
+            if campo:
+                normalizado[campo] = valor.strip() if isinstance(valor, str) else valor
+        normalizados.append(normalizado)
+    return normalizados
+
+
+def parse_date(valor):
+    """Convierte una fecha en texto a `date` probando los formatos admitidos."""
+    for formato in DATE_FORMATS:
+        try:
+            return datetime.strptime(str(valor).strip(), formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"fecha no válida: {valor!r}")
+
+
+def validate_record(registro):
+    """Valida un registro y devuelve (datos, error); exactamente uno de los dos es None."""
+    nombre = registro.get('nombre')
+    if nombre is not None and not isinstance(nombre, str):
+        # JSON admite números, listas... que no son un nombre (y no tienen .strip())
+        return None, f"el nombre debe ser texto, no {nombre!r}"
+    nombre = (nombre or '').strip()
+    if not nombre:
+        return None, "falta el nombre"
+    if len(nombre) > NOMBRE_MAX:
+        return None, f"el nombre supera {NOMBRE_MAX} caracteres"
+    try:
+        fecha_nacimiento = parse_date(registro.get('fecha_nacimiento'))
+        fecha_muerte = parse_date(registro.get('fecha_muerte'))
+    except ValueError as e:
+        return None, str(e)
+    if fecha_muerte < fecha_nacimiento:
+        return None, "la fecha de fallecimiento es anterior a la de nacimiento"
+    return {'nombre': nombre, 'fecha_nacimiento': fecha_nacimiento, 'fecha_muerte': fecha_muerte}, None
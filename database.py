@@ -0,0 +1,213 @@
+"""
+Configuración del motor de base de datos y migraciones del esquema.
+
+- `database_url` elige la base de datos: `DATABASE_URL` si está definida (PostgreSQL
+  en Render) o el archivo SQLite de `instance/` en desarrollo.
+- `engine_options` ajusta el pool de conexiones según el motor:
+  PostgreSQL usa un pool acotado con `pool_pre_ping` (descarta conexiones cortadas por
+  el servidor o un proxy) y `pool_recycle`; SQLite espera a que se libere el bloqueo
+  en lugar de fallar al instante con "database is locked".
+- `configure_sqlite` aplica los PRAGMA de cada conexión SQLite: modo WAL (los lectores
+  no bloquean al escritor), `synchronous=NORMAL` y `busy_timeout`.
+- `run_migrations` aplica en orden las migraciones versionadas pendientes y las anota
+  en la tabla `schema_migrations`, para que cada una se ejecute una sola vez aunque
+  arranquen a la vez varios procesos de gunicorn y el trabajador.
+- `lock_transaction` serializa entre procesos una transacción de comprobar y escribir.
+- `increment_statement` suma a un contador guardado en una tabla de forma atómica
+  (INSERT ... ON CONFLICT DO UPDATE), aunque varios procesos escriban la misma fila.
+- `schema_is_current` compara una huella de los modelos con la guardada tras la última
+  actualización: si coinciden, arrancar no necesita inspeccionar la base de datos.
+"""
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = 'schema_migrations'
+STATE_TABLE = 'schema_state'
+# Claves de los bloqueos consultivos de PostgreSQL que serializan entre procesos
+MIGRATION_LOCK_KEY = 727_001       # Migraciones
+VIDEO_ADMISSION_LOCK_KEY = 727_002  # Comprobar los límites de la cola y encolar (ver app.admit_video_job)
+
+
+def database_url(url, sqlite_path):
+    """URL de SQLAlchemy a partir de DATABASE_URL (o el archivo SQLite por defecto)."""
+    if not url:
+        return 'sqlite:///' + sqlite_path
+    # Render y Heroku entregan 'postgres://', que SQLAlchemy 2 ya no acepta. Sin driver
+    # explícito se usa psycopg2 (el de requirements.txt), no el que elija cada versión de SQLAlchemy.
+    for prefijo in ('postgres://', 'postgresql://'):
+        if url.startswith(prefijo):
+            return 'postgresql+psycopg2://' + url[len(prefijo):]
+    return url
+
+
+def is_sqlite(url):
+    return url.startswith('sqlite')
+
+
+def engine_options(url, pool_size=5, max_overflow=10, pool_recycle=1800, pool_timeout=30,
+                   connect_timeout=10, busy_timeout_ms=5000):
+    """Opciones de `create_engine` (SQLALCHEMY_ENGINE_OPTIONS) adecuadas para el motor."""
+    if is_sqlite(url):
+        return {
+            # Tiempo que el driver espera por un bloqueo antes de lanzar "database is locked"
+            'connect_args': {'timeout': busy_timeout_ms / 1000},
+        }
+    opciones = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_recycle': pool_recycle,
+        'pool_timeout': pool_timeout,
+        'pool_pre_ping': True,
+    }
+    if url.startswith('postgresql'):
+        opciones['connect_args'] = {'connect_timeout': connect_timeout}
+    return opciones
+
+
+def configure_sqlite(engine, busy_timeout_ms=5000, cache_size_kb=20000):
+    """Registra los PRAGMA que se aplican a cada conexión nueva de un motor SQLite."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # Primero la espera por bloqueos: activar WAL en una base nueva compite con los
+            # demás procesos que arrancan a la vez
+            cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+            # WAL persiste en el archivo; repetirlo en cada conexión es inmediato
+            cursor.execute('PRAGMA journal_mode=WAL')
+            # Con WAL, NORMAL solo sincroniza en los checkpoints: seguro ante caídas del proceso
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA cache_size=-{int(cache_size_kb)}')
+            cursor.execute('PRAGMA temp_store=MEMORY')
+        finally:
+            cursor.close()
+
+
+def _ensure_migrations_table(conn):
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ('
+        ' version INTEGER PRIMARY KEY,'
+        ' name VARCHAR(100) NOT NULL,'
+        ' applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def applied_versions(engine):
+    """Versiones ya aplicadas (conjunto vacío si la tabla aún no existe)."""
+    with engine.begin() as conn:
+        _ensure_migrations_table(conn)
+        return {fila[0] for fila in conn.execute(text(f'SELECT version FROM {MIGRATIONS_TABLE}'))}
+
+
+def run_migrations(engine, migrations):
+    """
+    Aplica las migraciones pendientes de `migrations`, una lista de (versión, nombre, función)
+    donde `función(conn)` recibe la conexión de la transacción. Cada migración se ejecuta y se
+    anota en la misma transacción: si falla, no queda a medias ni se marca como aplicada.
+    Devuelve la lista de nombres aplicados.
+    """
+    aplicadas = []
+    with engine.connect() as lock_conn:
+        if engine.dialect.name == 'postgresql':
+            lock_conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+            lock_conn.commit()
+        try:
+            hechas = applied_versions(engine)
+            for version, nombre, funcion in sorted(migrations, key=lambda m: m[0]):
+                if version in hechas:
+                    continue
+                try:
+                    with engine.begin() as conn:
+                        # Anotar primero: si otro proceso SQLite ya la aplicó, la clave primaria lo impide
+                        conn.execute(
+                            text(f'INSERT INTO {MIGRATIONS_TABLE} (version, name, applied_at) '
+                                 'VALUES (:version, :name, :applied_at)'),
+                            {'version': version, 'name': nombre,
+                             'applied_at': datetime.now(timezone.utc).replace(tzinfo=None)},
+                        )
+                        funcion(conn)
+                except IntegrityError:
+                    continue
+                logger.info("Migración %s aplicada: %s", version, nombre)
+                aplicadas.append(nombre)
+        finally:
+            if engine.dialect.name == 'postgresql':
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+                lock_conn.commit()
+    return aplicadas
+
+
+def lock_transaction(executor, dialect_name, key):
+    """
+    Serializa la transacción actual de `executor` (sesión o conexión) con las demás que
+    pidan la misma `key`, hasta su commit o rollback. En PostgreSQL es un bloqueo consultivo
+    de transacción. En SQLite no hace nada: la primera escritura de la transacción ya excluye
+    a los demás escritores hasta el final, así que el llamador debe escribir antes de comprobar.
+    """
+    if dialect_name == 'postgresql':
+        executor.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': key})
+
+
+def increment_statement(table, dialect_name, column='value'):
+    """
+    INSERT que crea la fila de `table` o, si su clave primaria ya existe, le suma el valor de
+    `column` en la misma sentencia. Con varias filas se ejecuta como executemany.
+    Solo PostgreSQL y SQLite (3.24 o posterior) admiten ON CONFLICT.
+    """
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    sentencia = insert(table)
+    return sentencia.on_conflict_do_update(
+        index_elements=[col.name for col in table.primary_key.columns],
+        set_={column: table.c[column] + sentencia.excluded[column]},
+    )
+
+
+def metadata_fingerprint(metadata):
+    """Huella de las tablas, columnas e índices declarados en los modelos."""
+    partes = []
+    for table in metadata.sorted_tables:
+        partes.append(f'T {table.name}')
+        partes += [f'C {col.name} {col.type!r} {col.nullable}' for col in table.columns]
+        partes += sorted(f'I {index.name} {[col.name for col in index.columns]}' for index in table.indexes)
+    return hashlib.sha256('\n'.join(partes).encode('utf-8')).hexdigest()[:32]
+
+
+def schema_is_current(engine, fingerprint, versions):
+    """
+    True si la base de datos ya se actualizó con estos modelos y tiene aplicadas todas las
+    `versions`. Son dos consultas pequeñas; ante cualquier duda (tablas que aún no existen)
+    devuelve False y el llamador hace la actualización completa.
+    """
+    try:
+        with engine.connect() as conn:
+            guardada = conn.execute(text(f'SELECT fingerprint FROM {STATE_TABLE} WHERE id = 1')).scalar()
+            if guardada != fingerprint:
+                return False
+            hechas = {fila[0] for fila in conn.execute(text(f'SELECT version FROM {MIGRATIONS_TABLE}'))}
+    except DBAPIError:
+        return False
+    return set(versions) <= hechas
+
+
+def store_fingerprint(engine, fingerprint):
+    """Guarda la huella de los modelos con los que se actualizó el esquema."""
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS {STATE_TABLE} ('
+                          ' id INTEGER PRIMARY KEY,'
+                          ' fingerprint VARCHAR(64) NOT NULL,'
+                          ' updated_at TIMESTAMP NOT NULL)'))
+        conn.execute(text(f'DELETE FROM {STATE_TABLE} WHERE id = 1'))
+        conn.execute(text(f'INSERT INTO {STATE_TABLE} (id, fingerprint, updated_at) VALUES (1, :fp, :ahora)'),
+                     {'fp': fingerprint, 'ahora': datetime.now(timezone.utc).replace(tzinfo=None)})
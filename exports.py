@@ -0,0 +1,194 @@
+"""
+Exportación del registro de personas (PDF y CSV).
+
+Las filas se leen por bloques con paginación por clave (solo las columnas
+necesarias, sin objetos ORM) y se escriben a medida que llegan:
+
+- CSV: se genera como un flujo de texto que la respuesta HTTP envía por partes.
+- PDF: se dibuja página a página sobre un canvas de ReportLab, sin construir una
+  única tabla gigante. Cada QR se incrusta desde la caché en disco de
+  `qr_service` (PNG de 1 bit al tamaño de impresión), sin regenerarlo.
+"""
+import csv
+import io
+import logging
+from collections import namedtuple
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ["ID", "Nombre", "Nacimiento", "Fallecimiento", "Estado", "Código QR"]
+CHUNK_SIZE = 1000
+
+# Celda de imagen en la tabla del PDF (las demás celdas son texto)
+PdfImage = namedtuple('PdfImage', 'path')
+
+
+def iter_personas(session, model, chunk_size=CHUNK_SIZE):
+    """Recorre todas las personas por orden de id leyendo bloques de `chunk_size` filas."""
+    last_id = 0
+    while True:
+        rows = (session.query(model.id, model.nombre, model.fecha_nacimiento, model.fecha_muerte,
+                              model.images_uploaded, model.video_generated)
+                .filter(model.id > last_id)
+                .order_by(model.id)
+                .limit(chunk_size)
+                .all())
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def estado_persona(row):
+    """Texto de estado de una persona, igual que en el panel."""
+    if row.video_generated:
+        return "Video Generado"
+    if row.images_uploaded:
+        return "Imágenes Subidas"
+    return "Sin Imágenes"
+
+
+# --- CSV ---
+
+def iter_csv(rows, qr_url_for, chunk_rows=500):
+    """
+    Genera el CSV por trozos de texto (con BOM para que Excel detecte UTF-8).
+    Las columnas son las del PDF; la del QR lleva la URL codificada, `qr_url_for(row)`.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow([
+            row.id,
+            row.nombre,
+            row.fecha_nacimiento.strftime('%d/%m/%Y'),
+            row.fecha_muerte.strftime('%d/%m/%Y'),
+            estado_persona(row),
+            qr_url_for(row),
+        ])
+        if i % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# --- PDF ---
+
+class _PdfTableWriter:
+    """Dibuja la tabla del registro fila a fila, repitiendo la cabecera en cada página."""
+
+    MARGIN = 72  # 1 pulgada, como SimpleDocTemplate
+    COL_WIDTHS = (38, 140, 62, 70, 88, 70)
+    HEADER_HEIGHT = 24
+    ROW_HEIGHT = 62   # QR de 50 pt + 6 pt de relleno arriba y abajo
+    QR_SIZE = 50
+
+    def __init__(self, canvas, pagesize, colors):
+        self.canvas = canvas
+        self.width, self.height = pagesize
+        self.colors = colors
+        self.table_width = sum(self.COL_WIDTHS)
+        self.x0 = (self.width - self.table_width) / 2
+        self.y = None
+
+    def title(self, text):
+        self.canvas.setFont('Helvetica-Bold', 18)
+        self.canvas.drawString(self.x0, self.height - self.MARGIN - 18, text)
+        self.y = self.height - self.MARGIN - 18 - 0.2 * 72
+        self._header()
+
+    def _new_page(self):
+        self.canvas.showPage()
+        self.y = self.height - self.MARGIN
+        self._header()
+
+    def _fit(self, text, font, size, width):
+        """Recorta el texto con '…' para que quepa en el ancho de la celda."""
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        if stringWidth(text, font, size) <= width:
+            return text
+        while text and stringWidth(text + '…', font, size) > width:
+            text = text[:-1]
+        return text + '…'
+
+    def _cells(self, values, top, height, font, size, fill, text_color):
+        c = self.canvas
+        c.setFillColor(fill)
+        c.setStrokeColor(self.colors.black)
+        c.rect(self.x0, top - height, self.table_width, height, stroke=0, fill=1)
+        x = self.x0
+        for value, col_width in zip(values, self.COL_WIDTHS):
+            c.rect(x, top - height, col_width, height, stroke=1, fill=0)
+            if isinstance(value, str):
+                c.setFillColor(text_color)
+                c.setFont(font, size)
+                texto = self._fit(value, font, size, col_width - 12)
+                c.drawCentredString(x + col_width / 2, top - height / 2 - size / 3, texto)
+            elif isinstance(value, PdfImage):
+                c.drawImage(value.path, x + (col_width - self.QR_SIZE) / 2, top - height + (height - self.QR_SIZE) / 2,
+                            width=self.QR_SIZE, height=self.QR_SIZE)
+            x += col_width
+
+    def _header(self):
+        self._cells(EXPORT_COLUMNS, self.y, self.HEADER_HEIGHT, 'Helvetica-Bold', 9,
+                    self.colors.HexColor('#6c757d'), self.colors.whitesmoke)  # Bootstrap secondary color
+        self.y -= self.HEADER_HEIGHT
+
+    def row(self, values):
+        if self.y - self.ROW_HEIGHT < self.MARGIN:
+            self._new_page()
+        self._cells(values, self.y, self.ROW_HEIGHT, 'Helvetica', 9,
+                    self.colors.HexColor('#f8f9fa'), self.colors.black)  # Bootstrap light color
+        self.y -= self.ROW_HEIGHT
+
+
+def write_pdf(output, rows, qr_path_for):
+    """
+    Escribe el PDF del registro en `output` (ruta o archivo binario).
+    `qr_path_for(row)` devuelve la ruta absoluta del PNG del QR.
+    Devuelve el número de filas exportadas.
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen.canvas import Canvas
+
+    canvas = Canvas(output, pagesize=letter)
+    canvas.setTitle("Registro de Personas")
+    tabla = _PdfTableWriter(canvas, letter, colors)
+    tabla.title("Registro de Personas")
+
+    total = 0
+    for row in rows:
+        try:
+            qr_element = PdfImage(qr_path_for(row))
+        except Exception as e:
+            logger.warning("No se pudo obtener el QR de la persona %s: %s", row.id, e)
+            qr_element = "QR Missing"
+
+        tabla.row([
+            str(row.id),
+            row.nombre,
+            row.fecha_nacimiento.strftime('%d/%m/%Y'),
+            row.fecha_muerte.strftime('%d/%m/%Y'),
+            estado_persona(row),
+            qr_element,
+        ])
+        total += 1
+
+    canvas.save()
+    return total
+
+
+def write_pdf_file(path, rows, qr_path_for):
+    """
+    Escribe el PDF mediante una escritura atómica (nunca queda a medias). El temporal
+    existe desde el principio, así que se puede saber que la exportación está en curso.
+    """
+    with storage.atomic_path(path) as temporal:
+        with open(temporal, 'wb') as f:
+            return write_pdf(f, rows, qr_path_for)
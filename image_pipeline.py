@@ -0,0 +1,201 @@
+"""
+Preprocesamiento de imágenes para el video memorial.
+
+Cada foto se decodifica a escala reducida cuando el formato lo permite
+(modo draft de JPEG), se orienta según su EXIF y se ajusta a la resolución del
+video sin deformarla: con bandas negras ('letterbox') o recortando ('crop').
+El resultado son cuadros RGB en memoria que se envían directamente al
+codificador, sin pasar por archivos temporales. Las fotos se reparten entre
+un pool de procesos para no serializar el trabajo de CPU.
+
+Al subir las imágenes se generan además sus derivados (miniaturas para la
+galería y un master ya ajustado a la resolución del video).
+"""
+import logging
+import os
+import time
+
+import pools
+import storage
+
+# Pillow se importa dentro de cada función: los procesos web solo lo cargan al recibir
+# la primera subida, no al arrancar.
+
+logger = logging.getLogger(__name__)
+
+FIT_LETTERBOX = 'letterbox'
+FIT_CROP = 'crop'
+FIT_MODES = (FIT_LETTERBOX, FIT_CROP)
+
+# Validación y derivados generados al subir las imágenes
+ALLOWED_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP', 'GIF', 'BMP', 'TIFF'}
+MAX_PIXELS = 50_000_000          # Rechazar imágenes absurdamente grandes (bombas de descompresión)
+THUMBNAIL_SIZE = (480, 480)      # Caja máxima de las miniaturas de la galería
+THUMBNAIL_QUALITY = 80
+MASTER_QUALITY = 90
+
+def load_image(path, target_size):
+    """
+    Abre una imagen decodificándola a la menor escala útil para `target_size`
+    y la devuelve en RGB con la orientación EXIF aplicada.
+    """
+    from PIL import Image, ImageOps
+    img = Image.open(path)
+    # En JPEG, draft() decodifica directamente a 1/2, 1/4 u 1/8 del tamaño
+    # (siempre por encima de target_size): mucho más barato que decodificar entero.
+    img.draft('RGB', target_size)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def fit_image(img, resolution, mode=FIT_LETTERBOX):
+    """Ajusta la imagen a `resolution` conservando la relación de aspecto."""
+    from PIL import Image, ImageOps
+    if mode not in FIT_MODES:
+        raise ValueError(f"Modo de ajuste desconocido: {mode!r}. Opciones: {', '.join(FIT_MODES)}")
+    if img.size == tuple(resolution):
+        return img
+    if mode == FIT_CROP:
+        return ImageOps.fit(img, resolution, Image.LANCZOS)
+
+    # Letterbox: escalar hasta que quepa y centrar sobre fondo negro
+    width, height = resolution
+    escala = min(width / img.width, height / img.height)
+    nuevo_tamano = (max(1, round(img.width * escala)), max(1, round(img.height * escala)))
+    img = img.resize(nuevo_tamano, Image.LANCZOS, reducing_gap=3.0)
+    lienzo = Image.new('RGB', resolution, (0, 0, 0))
+    lienzo.paste(img, ((width - img.width) // 2, (height - img.height) // 2))
+    return lienzo
+
+
+def prepare_frame(path, resolution, mode=FIT_LETTERBOX):
+    """Devuelve el cuadro RGB24 (bytes) listo para el codificador a partir de una imagen."""
+    img = load_image(path, resolution)
+    return fit_image(img, resolution, mode).tobytes()
+
+
+def _prepare_frame_timed(path, resolution, mode):
+    """Como `prepare_frame`, pero devuelve también los segundos que tardó (medidos en el proceso hijo)."""
+    inicio = time.perf_counter()
+    frame = prepare_frame(path, resolution, mode)
+    return frame, time.perf_counter() - inicio
+
+
+def validate_image(path):
+    """Comprueba que el archivo sea una imagen legible de un formato admitido y devuelve su formato."""
+    from PIL import Image
+    with Image.open(path) as img:
+        if img.format not in ALLOWED_FORMATS:
+            raise ValueError(f"Formato no admitido: {img.format}")
+        if img.width * img.height > MAX_PIXELS:
+            raise ValueError(f"Imagen demasiado grande: {img.width}x{img.height}")
+        img.verify()
+        return img.format
+
+
+def _oriented_size(path):
+    """Tamaño original de la imagen una vez aplicada la orientación EXIF."""
+    from PIL import Image
+    with Image.open(path) as img:
+        width, height = img.size
+        if img.getexif().get(0x0112) in (5, 6, 7, 8):  # Rotaciones de 90/270 grados
+            width, height = height, width
+    return width, height
+
+
+def create_derivatives(path, thumb_webp_path, thumb_jpeg_path, master_path,
+                       resolution, mode=FIT_LETTERBOX, thumb_size=THUMBNAIL_SIZE):
+    """
+    Valida una imagen subida y genera sus derivados:
+    miniaturas WebP y JPEG para la galería y un master JPEG ya ajustado a la
+    resolución del video, que el codificador puede usar sin redimensionar.
+    """
+    from PIL import Image
+    validate_image(path)
+    width, height = _oriented_size(path)
+
+    img = load_image(path, resolution)
+    # Cada derivado se escribe aparte y se renombra al terminar: nunca queda uno a medias
+    with storage.atomic_path(master_path) as temporal:
+        fit_image(img, resolution, mode).save(temporal, 'JPEG', quality=MASTER_QUALITY)
+
+    miniatura = img.copy()
+    miniatura.thumbnail(thumb_size, Image.LANCZOS)
+    with storage.atomic_path(thumb_webp_path) as temporal:
+        miniatura.save(temporal, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+    with storage.atomic_path(thumb_jpeg_path) as temporal:
+        miniatura.save(temporal, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+
+    return {
+        'width': width,
+        'height': height,
+        'thumb_width': miniatura.width,
+        'thumb_height': miniatura.height,
+    }
+
+
+def _call_safe(func, args):
+    """Ejecuta func(*args) devolviendo (resultado, error) en lugar de lanzar excepciones."""
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def _run_parallel(func, args_list, workers, on_progress=None):
+    """
+    Aplica `func` a cada tupla de argumentos (en el pool si workers > 1), conservando el orden.
+    `on_progress(hechos, total)` se llama a medida que se obtienen los resultados.
+    """
+    total = len(args_list)
+    pool = pools.get_pool(pools.IMAGES, workers) if total > 1 else None
+    futuros = [pool.submit(_call_safe, func, args) for args in args_list] if pool else None
+
+    resultados = []
+    for i, args in enumerate(args_list):
+        resultados.append(futuros[i].result() if futuros else _call_safe(func, args))
+        if on_progress:
+            on_progress(i + 1, total)
+    return resultados
+
+
+def prepare_frames(image_paths, resolution, mode=FIT_LETTERBOX, workers=None, on_progress=None,
+                   timings=None, keep_failed=False):
+    """
+    Prepara todos los cuadros del video en paralelo, conservando el orden.
+    Las imágenes que no se puedan leer se omiten (y se registran en el log);
+    con `keep_failed` ocupan su posición como None.
+    `on_progress(hechos, total)` permite seguir el avance; si se pasa la lista
+    `timings`, se le añaden los segundos que tardó cada imagen preparada.
+    """
+    workers = workers or min(len(image_paths), os.cpu_count() or 1)
+    resolution = tuple(resolution)
+    resultados = _run_parallel(_prepare_frame_timed, [(path, resolution, mode) for path in image_paths], workers,
+                               on_progress=on_progress)
+
+    frames = []
+    for path, (resultado, error) in zip(image_paths, resultados):
+        if error:
+            logger.error("Error al preprocesar la imagen %s: %s", path, error)
+            if keep_failed:
+                frames.append(None)
+            continue
+        frame, segundos = resultado
+        frames.append(frame)
+        if timings is not None:
+            timings.append(segundos)
+    return frames
+
+
+def ingest_images(items, resolution, mode=FIT_LETTERBOX, workers=1):
+    """
+    Genera los derivados de varias imágenes subidas.
+    `items` es una lista de tuplas (original, miniatura_webp, miniatura_jpeg, master).
+    Devuelve, en el mismo orden, una lista de (info, error): `info` es el dict de
+    `create_derivatives` o None si la imagen no es válida.
+    """
+    resolution = tuple(resolution)
+    args_list = [(*item, resolution, mode) for item in items]
+    return _run_parallel(create_derivatives, args_list, workers)
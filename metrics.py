@@ -0,0 +1,202 @@
+"""
+Medición de tiempos del pipeline de video y exposición en formato Prometheus.
+
+- `SpanRecorder` mide la duración de cada etapa de un trabajo (descubrir imágenes,
+  cada redimensionado, codificación, empaquetado, commit...) y la escribe en el log
+  como una línea clave=valor fácil de filtrar.
+- `StartupTimer` hace lo mismo con las fases del arranque de la aplicación.
+- Las funciones `render_*` generan el formato de texto de Prometheus. Los valores
+  salen de la base de datos (ver `app.metrics_endpoint`), así que son correctos
+  aunque los trabajos se procesen en otros procesos o máquinas.
+- Los contadores e histogramas acumulados se guardan como muestras (nombre, etiquetas,
+  muestra, valor) que cada proceso incrementa en la misma transacción que el cambio que
+  miden (`counter_sample`, `histogram_samples`); así nunca bajan aunque se borren o se
+  recorten los trabajos y sus tiempos. `collect_samples` los reagrupa para servirlos.
+"""
+import logging
+import math
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('video.timing')
+startup_logger = logging.getLogger('startup')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Límites superiores de los buckets de los histogramas
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+WAIT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 900, 1800, 3600)
+SIZE_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(-2, 9))  # 256 KiB a 256 MiB
+
+
+class SpanRecorder:
+    """Acumula las duraciones (etapa, segundos) de un trabajo y las registra en el log."""
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.spans = []
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+        etiquetas = ' '.join(f'{clave}={valor}' for clave, valor in self.labels.items())
+        logger.info('span stage=%s seconds=%.3f %s', stage, seconds, etiquetas)
+
+    @contextmanager
+    def span(self, stage):
+        """Mide el bloque `with` como la etapa `stage` (también si lanza una excepción)."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - inicio)
+
+
+class StartupTimer:
+    """
+    Marca las fases del arranque de un proceso (modo STARTUP_TIMING): cada `mark` escribe
+    en el log el tiempo de la fase y el acumulado desde `start` (un `time.perf_counter()`).
+    """
+
+    def __init__(self, start, enabled=True):
+        self.enabled = enabled
+        self.start = start
+        self._anterior = start
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        ahora = time.perf_counter()
+        startup_logger.info('startup phase=%s seconds=%.3f total=%.3f', phase, ahora - self._anterior, ahora - self.start)
+        self._anterior = ahora
+
+
+# --- FORMATO DE TEXTO DE PROMETHEUS ---
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pares = ','.join(f'{clave}="{_escape(valor)}"' for clave, valor in labels.items())
+    return '{' + pares + '}'
+
+
+def _escape(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(valor):
+    if valor is None:
+        return '0'
+    if isinstance(valor, float) and math.isinf(valor):
+        return '+Inf' if valor > 0 else '-Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def render_metric(name, kind, help_text, samples):
+    """
+    Bloque de una métrica simple (counter o gauge).
+    `samples` es una lista de (labels, valor); labels puede ser None o {}.
+    """
+    lineas = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for labels, valor in samples:
+        lineas.append(f'{name}{_labels(labels)} {_number(valor)}')
+    return '\n'.join(lineas)
+
+
+def render_histogram(name, help_text, series, buckets):
+    """
+    Bloque de un histograma. `series` es una lista de (labels, conteos, suma, total), con
+    `conteos[i]` = observaciones <= buckets[i] (acumulados, como los devuelve `histogram_series`).
+    """
+    lineas = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for labels, conteos, suma, total in series:
+        labels = labels or {}
+        for limite, conteo in zip(buckets, conteos):
+            lineas.append(f'{name}_bucket{_labels({**labels, "le": _number(float(limite))})} {_number(conteo or 0)}')
+        lineas.append(f'{name}_bucket{_labels({**labels, "le": "+Inf"})} {_number(total or 0)}')
+        lineas.append(f'{name}_sum{_labels(labels)} {_number(float(suma or 0))}')
+        lineas.append(f'{name}_count{_labels(labels)} {_number(total or 0)}')
+    return '\n'.join(lineas)
+
+
+# --- MUESTRAS ACUMULADAS (CONTADORES E HISTOGRAMAS) ---
+# Una muestra es un dict {'name', 'labels', 'sample', 'value'}: `labels` es la clave de
+# etiquetas de `label_key` y `sample` es '' en un contador y 'le=<límite>', 'sum' o 'count'
+# en un histograma (los buckets se guardan sin acumular: cada observación suma en uno solo).
+SAMPLE_VALUE = ''
+SAMPLE_SUM = 'sum'
+SAMPLE_COUNT = 'count'
+
+
+def label_key(labels):
+    """Clave estable de un conjunto de etiquetas ('' sin etiquetas)."""
+    return ','.join(f'{clave}={valor}' for clave, valor in sorted((labels or {}).items()))
+
+
+def parse_label_key(key):
+    """Inversa de `label_key`."""
+    return dict(par.split('=', 1) for par in key.split(',')) if key else {}
+
+
+def _bucket_sample(limite):
+    return f'le={_number(float(limite))}'
+
+
+def counter_sample(name, delta=1, labels=None):
+    """Muestra que suma `delta` al contador `name`."""
+    return {'name': name, 'labels': label_key(labels), 'sample': SAMPLE_VALUE, 'value': delta}
+
+
+def histogram_samples(name, valor, buckets, labels=None):
+    """Muestras que registran la observación `valor` en el histograma `name`."""
+    limite = next((limite for limite in buckets if valor <= limite), math.inf)
+    clave = label_key(labels)
+    return [{'name': name, 'labels': clave, 'sample': _bucket_sample(limite), 'value': 1},
+            {'name': name, 'labels': clave, 'sample': SAMPLE_SUM, 'value': valor},
+            {'name': name, 'labels': clave, 'sample': SAMPLE_COUNT, 'value': 1}]
+
+
+def merge_samples(muestras):
+    """Suma las muestras con la misma clave, para escribir una fila por serie y no una por observación."""
+    total = {}
+    for muestra in muestras:
+        clave = (muestra['name'], muestra['labels'], muestra['sample'])
+        total[clave] = total.get(clave, 0) + muestra['value']
+    return [{'name': nombre, 'labels': etiquetas, 'sample': sample, 'value': valor}
+            for (nombre, etiquetas, sample), valor in total.items()]
+
+
+def collect_samples(filas):
+    """Agrupa filas (name, labels, sample, value) en {name: {labels: {sample: value}}}."""
+    metricas = {}
+    for nombre, etiquetas, sample, valor in filas:
+        metricas.setdefault(nombre, {}).setdefault(etiquetas, {})[sample] = valor
+    return metricas
+
+
+def counter_series(serie):
+    """Lista (labels, valor) de un contador de `collect_samples`, para `render_metric`."""
+    return [(parse_label_key(clave), _integral(muestras.get(SAMPLE_VALUE, 0)))
+            for clave, muestras in sorted((serie or {}).items())]
+
+
+def histogram_series(serie, buckets):
+    """Lista (labels, conteos acumulados, suma, total) de un histograma de `collect_samples`, para `render_histogram`."""
+    resultado = []
+    for clave, muestras in sorted((serie or {}).items()):
+        conteos, acumulado = [], 0
+        for limite in buckets:
+            acumulado += muestras.get(_bucket_sample(limite), 0)
+            conteos.append(_integral(acumulado))
+        resultado.append((parse_label_key(clave), conteos, muestras.get(SAMPLE_SUM, 0),
+                          _integral(muestras.get(SAMPLE_COUNT, 0))))
+    return resultado
+
+
+def _integral(valor):
+    """Los conteos se guardan en una columna Float: se sirven como enteros."""
+    return int(valor) if float(valor).is_integer() else valor
+
+
+def render_exposition(bloques):
+    """Une los bloques de métricas en el documento que se sirve en /metrics."""
+    return '\n'.join(bloques) + '\n'
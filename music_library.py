@@ -0,0 +1,167 @@
+"""
+Biblioteca de música de fondo.
+
+Las pistas son los archivos de audio de `static/music`. Cada persona puede elegir
+una (columna `Persona.music_track`); si no elige, se usa la pista por defecto.
+
+Antes, cada render volvía a codificar la pista a AAC. Ahora cada pista se
+convierte una sola vez por duración de video en un "stem" AAC listo para mezclar.
+El stem ya tiene la duración exacta, el volumen normalizado (loudnorm) y un
+fundido de salida, y se guarda por hash del contenido de la pista y de esos
+parámetros:
+
+    cache_dir/<clave[:2]>/<clave>.m4a
+
+El render solo copia el stream de audio del stem al MP4 (`-c:a copy`), así que
+el audio no añade casi nada al coste de cada video.
+"""
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.aac', '.wav', '.ogg', '.oga', '.flac', '.opus')
+# Cambiar este número invalida todos los stems (p. ej. si cambia el filtro de audio)
+STEM_FORMAT_VERSION = 1
+
+
+def track_title(filename):
+    """Título legible de una pista a partir de su nombre de archivo."""
+    nombre = os.path.splitext(filename)[0].replace('_', ' ').replace('-', ' ')
+    return ' '.join(nombre.split()).capitalize()
+
+
+def stem_params(duration, loudness=-18, fade_seconds=3, bitrate='128k', sample_rate=48000):
+    """Parámetros que afectan al contenido de un stem."""
+    return {
+        'duration': duration,
+        'loudness': loudness,
+        'fade': fade_seconds,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'version': STEM_FORMAT_VERSION,
+    }
+
+
+def stem_key(source_digest, params):
+    """Clave de un stem: hash de la pista de origen y de los parámetros."""
+    material = json.dumps({'source': source_digest, **params}, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:40]
+
+
+def build_stem_command(track_path, output_path, params, ffmpeg_bin='ffmpeg'):
+    """Comando FFmpeg que convierte una pista en un stem AAC de la duración exacta del video."""
+    duration = params['duration']
+    filtros = [f"loudnorm=I={params['loudness']}:TP=-1.5:LRA=11"]
+    fade = min(params['fade'], duration / 2)
+    if fade > 0:
+        filtros.append(f'afade=t=out:st={duration - fade}:d={fade}')
+    return [
+        ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-y',
+        # Repetir la pista si es más corta que el video; -t recorta al final
+        '-stream_loop', '-1', '-i', track_path,
+        '-t', str(duration),
+        '-vn', '-af', ','.join(filtros),
+        '-ar', str(params['sample_rate']), '-ac', '2',
+        '-c:a', 'aac', '-b:a', params['bitrate'],
+        '-movflags', '+faststart',
+        output_path,
+    ]
+
+
+class MusicLibrary:
+    """Pistas disponibles y caché de stems AAC en disco."""
+
+    def __init__(self, music_dir, cache_dir, default_track=None, loudness=-18, fade_seconds=3,
+                 bitrate='128k', ffmpeg_bin='ffmpeg', refresh_seconds=60):
+        self.music_dir = music_dir
+        self.cache_dir = cache_dir
+        self.default_track = default_track
+        self.loudness = loudness
+        self.fade_seconds = fade_seconds
+        self.bitrate = bitrate
+        self.ffmpeg_bin = ffmpeg_bin
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._tracks = None
+        self._tracks_at = 0
+        self._digests = {}  # ruta -> (mtime, tamaño, hash): no releer la pista en cada render
+
+    def tracks(self):
+        """
+        Lista de pistas [{'id', 'titulo'}] ordenada por nombre. El listado de la carpeta
+        se guarda en memoria durante `refresh_seconds` (se usa en páginas públicas).
+        """
+        with self._lock:
+            if self._tracks is not None and time.monotonic() - self._tracks_at < self.refresh_seconds:
+                return self._tracks
+        try:
+            nombres = sorted(entry.name for entry in os.scandir(self.music_dir)
+                             if entry.is_file() and entry.name.lower().endswith(AUDIO_EXTENSIONS))
+        except FileNotFoundError:
+            nombres = []
+        pistas = [{'id': nombre, 'titulo': track_title(nombre)} for nombre in nombres]
+        with self._lock:
+            self._tracks, self._tracks_at = pistas, time.monotonic()
+        return pistas
+
+    def refresh(self):
+        """Olvida el listado en memoria (p. ej. tras añadir una pista)."""
+        with self._lock:
+            self._tracks = None
+
+    def has_track(self, track_id):
+        return any(pista['id'] == track_id for pista in self.tracks())
+
+    def resolve(self, track_id=None):
+        """
+        Ruta de la pista elegida, o de la pista por defecto si no hay elección o la
+        elegida ya no existe. None si la biblioteca está vacía.
+        """
+        for candidata in (track_id, self.default_track):
+            if candidata and self.has_track(candidata):
+                return os.path.join(self.music_dir, candidata)
+        pistas = self.tracks()
+        return os.path.join(self.music_dir, pistas[0]['id']) if pistas else None
+
+    def _digest(self, path):
+        info = os.stat(path)
+        with self._lock:
+            guardado = self._digests.get(path)
+        if guardado and guardado[:2] == (info.st_mtime_ns, info.st_size):
+            return guardado[2]
+        digest = storage.file_digest(path)
+        with self._lock:
+            self._digests[path] = (info.st_mtime_ns, info.st_size, digest)
+        return digest
+
+    def stem_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.m4a')
+
+    def stem_for(self, track_path, duration):
+        """
+        Ruta del stem AAC de `track_path` para un video de `duration` segundos,
+        convirtiéndolo solo si todavía no está en caché.
+        """
+        params = stem_params(duration, loudness=self.loudness, fade_seconds=self.fade_seconds,
+                             bitrate=self.bitrate)
+        key = stem_key(self._digest(track_path), params)
+        path = self.stem_path(key)
+        try:
+            os.utime(path)  # Marcar como usado para la limpieza por antigüedad
+            return path
+        except FileNotFoundError:
+            pass
+
+        logger.info("🎵 Preparando el audio de %s (%ss)...", os.path.basename(track_path), duration)
+        with storage.atomic_path(path) as temporal:
+            subprocess.run(build_stem_command(track_path, temporal, params, self.ffmpeg_bin),
+                           check=True, capture_output=True)
+        return path
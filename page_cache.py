@@ -0,0 +1,46 @@
+"""
+Caché de páginas renderizadas para la vista pública de un memorial.
+
+La página de una persona solo cambia cuando cambia su fila en la base de datos
+(o la plantilla), así que su ETag se calcula a partir de esos datos:
+
+- si el navegador ya tiene esa versión, la respuesta es un 304 sin cuerpo;
+- si no, el HTML se sirve desde una caché LRU en memoria por proceso y solo se
+  vuelve a renderizar la primera vez que se pide cada versión.
+
+Ninguna de las dos cosas toca el disco.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def state_etag(*parts):
+    """ETag fuerte a partir de los valores que determinan el contenido de una página."""
+    material = '\x1f'.join('' if parte is None else str(parte) for parte in parts)
+    return hashlib.sha1(material.encode('utf-8')).hexdigest()[:32]
+
+
+class PageCache:
+    """LRU en memoria de HTML renderizado, indexado por ETag."""
+
+    def __init__(self, max_items=1024):
+        self.max_items = max_items
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            html = self._pages.get(etag)
+            if html is not None:
+                self._pages.move_to_end(etag)
+            return html
+
+    def put(self, etag, html):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._pages[etag] = html
+            self._pages.move_to_end(etag)
+            while len(self._pages) > self.max_items:
+                self._pages.popitem(last=False)
@@ -0,0 +1,44 @@
+"""
+Pools de procesos compartidos.
+
+La preparación de fotos (`image_pipeline`) y la generación de QR (`qr_service`) reparten
+el trabajo de CPU entre procesos. Arrancar procesos es caro (con 'spawn' cada uno vuelve
+a importar los módulos), así que cada proceso mantiene un pool por uso, creado la primera
+vez que se pide y reutilizado en los trabajos y peticiones siguientes.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+IMAGES = 'imagenes'
+QR = 'qr'
+
+_pools = {}  # nombre -> (pool, procesos)
+_lock = threading.Lock()
+
+
+def get_pool(name, workers):
+    """
+    Pool `name` de este proceso con `workers` procesos (None si workers <= 1: el trabajo
+    se hace en el propio proceso). Si se pide con otro tamaño, se sustituye.
+    """
+    if workers <= 1:
+        return None
+    with _lock:
+        pool, procesos = _pools.get(name, (None, 0))
+        if pool is None or procesos != workers:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            # 'spawn' evita duplicar hilos y conexiones abiertas del proceso padre
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pools[name] = (pool, workers)
+        return pool
+
+
+def shutdown(name=None):
+    """Cierra el pool `name` (o todos) esperando sus tareas; se vuelve a crear si hace falta."""
+    with _lock:
+        nombres = [name] if name else list(_pools)
+        cerrar = [_pools.pop(nombre)[0] for nombre in nombres if nombre in _pools]
+    for pool in cerrar:
+        pool.shutdown(wait=True)
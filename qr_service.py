@@ -0,0 +1,158 @@
+"""
+Servicio de códigos QR.
+
+Los QR se generan bajo demanda a partir de su contenido (la URL pública de la
+persona) y se guardan por hash del contenido, formato y tamaño:
+
+- en memoria, en una caché LRU por proceso;
+- en disco, en `cache_dir/<hash[:2]>/<hash>.<ext>`, compartida entre procesos.
+
+Como la clave depende del contenido, cambiar la URL base produce QR nuevos sin
+tener que invalidar nada, y pedir dos veces el mismo QR no lo vuelve a generar.
+"""
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import storage
+
+FORMAT_PNG = 'png'
+FORMAT_SVG = 'svg'
+MIMETYPES = {
+    FORMAT_PNG: 'image/png',
+    FORMAT_SVG: 'image/svg+xml',
+}
+PNG_SIZES = (128, 256, 512, 1024)  # Tamaños raster admitidos (px)
+QR_BORDER = 4                      # Zona de silencio mínima del estándar (módulos)
+
+
+def qr_key(content, fmt, size):
+    """Clave de caché de un QR: hash del contenido, el formato y el tamaño."""
+    if fmt == FORMAT_SVG:
+        size = 0  # El SVG es vectorial: un único archivo sirve para cualquier tamaño
+    return hashlib.sha256(f'{fmt}:{size}:{content}'.encode('utf-8')).hexdigest()[:32]
+
+
+def variant_keys(content):
+    """Claves de todas las variantes (SVG y cada tamaño PNG) del QR de un contenido."""
+    variantes = [(FORMAT_SVG, 0)] + [(FORMAT_PNG, size) for size in PNG_SIZES]
+    return [(fmt, qr_key(content, fmt, size)) for fmt, size in variantes]
+
+
+def nearest_png_size(size):
+    """Ajusta un tamaño pedido al tamaño raster admitido más cercano."""
+    return min(PNG_SIZES, key=lambda s: abs(s - size))
+
+
+def render_qr(content, fmt=FORMAT_PNG, size=256):
+    """Genera el QR de `content` y devuelve sus bytes (PNG de `size` px o SVG)."""
+    import qrcode
+
+    if fmt == FORMAT_SVG:
+        import qrcode.image.svg
+        qr = qrcode.QRCode(box_size=10, border=QR_BORDER)
+        qr.add_data(content)
+        qr.make(fit=True)
+        return qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).to_string()
+
+    if fmt != FORMAT_PNG:
+        raise ValueError(f"Formato de QR no admitido: {fmt!r}")
+
+    from PIL import Image
+    qr = qrcode.QRCode(box_size=1, border=QR_BORDER)
+    qr.add_data(content)
+    qr.make(fit=True)
+    modulos = qr.modules_count + 2 * QR_BORDER
+    # Generar con módulos enteros y reducir con NEAREST para que los bordes sigan nítidos
+    qr.box_size = max(1, math.ceil(size / modulos))
+    img = qr.make_image().get_image().convert('1')
+    if img.size != (size, size):
+        img = img.resize((size, size), Image.NEAREST)
+    buffer = BytesIO()
+    img.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class QrCache:
+    """Caché de QR en dos niveles: LRU en memoria y archivos en disco."""
+
+    def __init__(self, cache_dir, memory_items=512):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def disk_path(self, content, fmt=FORMAT_PNG, size=256):
+        """Ruta del archivo en disco para este QR (exista o no)."""
+        return self.key_path(qr_key(content, fmt, size), fmt)
+
+    def key_path(self, key, fmt):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.{fmt}')
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, content, fmt=FORMAT_PNG, size=256):
+        """Devuelve (clave, bytes) del QR, generándolo solo si no está en ninguna caché."""
+        key = qr_key(content, fmt, size)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return key, data
+
+        path = self.disk_path(content, fmt, size)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = render_qr(content, fmt, size)
+            storage.write_atomic(path, data)
+
+        self._remember(key, data)
+        return key, data
+
+    def ensure_file(self, content, fmt=FORMAT_PNG, size=256):
+        """Garantiza que el QR exista en disco y devuelve su ruta (útil para PDF e impresión)."""
+        path = self.disk_path(content, fmt, size)
+        if not os.path.exists(path):
+            self.get(content, fmt, size)
+        return path
+
+    def discard(self, content):
+        """Elimina de ambas cachés todas las variantes de un contenido."""
+        for fmt, key in variant_keys(content):
+            with self._lock:
+                self._memory.pop(key, None)
+            path = self.key_path(key, fmt)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def render_to_file(content, path, fmt=FORMAT_PNG, size=256):
+    """Genera un QR directamente en `path` si aún no existe. Devuelve None o el mensaje de error."""
+    try:
+        if not os.path.exists(path):
+            storage.write_atomic(path, render_qr(content, fmt, size))
+        return None
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+
+def warm_disk_cache(cache, contents, fmt=FORMAT_PNG, size=256, pool=None):
+    """
+    Genera en la caché de disco los QR de `contents` que falten, en paralelo si se pasa
+    un `pool`. Devuelve la lista de errores (None si fue bien) en el mismo orden.
+    """
+    paths = [cache.disk_path(content, fmt, size) for content in contents]
+    if pool is None or len(contents) <= 1:
+        return [render_to_file(content, path, fmt, size) for content, path in zip(contents, paths)]
+    n = len(contents)
+    return list(pool.map(render_to_file, contents, paths, [fmt] * n, [size] * n, chunksize=16))
@@ -0,0 +1,104 @@
+"""
+Búsqueda por nombre en el panel de administración.
+
+La búsqueda es por subcadena en todos los motores: "zál" encuentra "González" y
+"mar gon" solo encuentra nombres que contengan ese texto tal cual, como el
+`ILIKE '%texto%'` de siempre (sin distinguir mayúsculas; las tildes sí cuentan).
+
+- SQLite: tabla virtual FTS5 `persona_fts` con el tokenizador `trigram`, sincronizada
+  con `persona` mediante triggers. Los textos de menos de 3 caracteres no tienen
+  trigramas y se buscan con `LIKE` sin índice.
+- PostgreSQL: índice GIN de trigramas (pg_trgm) que acelera `ILIKE '%texto%'`.
+- Cualquier otro motor (o SQLite sin trigramas en FTS5): `ILIKE` sin índice, como antes.
+"""
+import logging
+
+from sqlalchemy import Integer, column, text
+
+logger = logging.getLogger(__name__)
+
+BACKEND_FTS5 = 'fts5'
+BACKEND_TRIGRAM = 'trigram'
+BACKEND_LIKE = 'like'
+
+FTS5_MIN_CHARS = 3  # Longitud de un trigrama: con menos, FTS5 no encuentra nada
+
+_SQLITE_FTS_SETUP = (
+    """CREATE VIRTUAL TABLE persona_fts USING fts5(
+           nombre, content='persona', content_rowid='id',
+           tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS persona_fts_ai AFTER INSERT ON persona BEGIN
+           INSERT INTO persona_fts(rowid, nombre) VALUES (new.id, new.nombre);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS persona_fts_ad AFTER DELETE ON persona BEGIN
+           INSERT INTO persona_fts(persona_fts, rowid, nombre) VALUES ('delete', old.id, old.nombre);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS persona_fts_au AFTER UPDATE OF nombre ON persona BEGIN
+           INSERT INTO persona_fts(persona_fts, rowid, nombre) VALUES ('delete', old.id, old.nombre);
+           INSERT INTO persona_fts(rowid, nombre) VALUES (new.id, new.nombre);
+       END""",
+    # Indexar los registros que ya existían antes de crear la tabla
+    "INSERT INTO persona_fts(persona_fts) VALUES ('rebuild')",
+)
+
+_SQLITE_FTS_DROP = (
+    "DROP TRIGGER IF EXISTS persona_fts_ai",
+    "DROP TRIGGER IF EXISTS persona_fts_ad",
+    "DROP TRIGGER IF EXISTS persona_fts_au",
+    "DROP TABLE persona_fts",
+)
+
+_POSTGRES_TRGM_SETUP = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_persona_nombre_trgm ON persona USING gin (nombre gin_trgm_ops)",
+)
+
+
+def setup_search_index(engine):
+    """Crea el índice de búsqueda adecuado para el motor y devuelve el backend activo."""
+    dialect = engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            with engine.begin() as conn:
+                existente = conn.execute(text(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'persona_fts'"
+                )).scalar()
+                if existente and 'trigram' not in existente:
+                    # Índice por palabras de una versión anterior: no encuentra subcadenas
+                    for sentencia in _SQLITE_FTS_DROP:
+                        conn.execute(text(sentencia))
+                    existente = None
+                if not existente:
+                    for sentencia in _SQLITE_FTS_SETUP:
+                        conn.execute(text(sentencia))
+                    logger.info("Índice FTS5 de nombres creado.")
+            return BACKEND_FTS5
+        if dialect == 'postgresql':
+            with engine.begin() as conn:
+                for sentencia in _POSTGRES_TRGM_SETUP:
+                    conn.execute(text(sentencia))
+            return BACKEND_TRIGRAM
+    except Exception as e:
+        logger.warning("No se pudo crear el índice de búsqueda (%s); se usará ILIKE: %s", dialect, e)
+    return BACKEND_LIKE
+
+
+def fts5_query(texto):
+    """
+    Convierte el texto del usuario en una consulta FTS5 segura: una frase entre comillas,
+    que con el tokenizador `trigram` coincide con cualquier nombre que contenga el texto.
+    """
+    return '"' + texto.replace('"', '""') + '"'
+
+
+def apply_name_search(query, model, texto, backend):
+    """Filtra `query` por los nombres que contienen `texto`, con el backend de búsqueda disponible."""
+    texto = (texto or '').strip()
+    if not texto:
+        return query
+    if backend == BACKEND_FTS5 and len(texto) >= FTS5_MIN_CHARS:
+        coincidencias = text("SELECT rowid FROM persona_fts WHERE persona_fts MATCH :q").bindparams(
+            q=fts5_query(texto))
+        return query.filter(model.id.in_(coincidencias.columns(column('rowid', Integer))))
+    # Con pg_trgm el índice GIN atiende directamente este ILIKE
+    return query.filter(model.nombre.ilike(f'%{texto}%'))
@@ -0,0 +1,71 @@
+"""
+Caché de segmentos de video por imagen (render incremental).
+
+Cada foto del memorial se codifica como un segmento MP4 independiente de
+`duration_per_image` segundos. La clave del segmento es el hash del contenido de
+la imagen de origen más los parámetros de render (resolución, ajuste, duración,
+fps y versión del formato), así que:
+
+- al volver a generar un memorial solo se codifican las fotos nuevas o cambiadas;
+- el video final se obtiene concatenando los segmentos sin recodificar
+  (ver `video_engine.concat_segments`), que tarda segundos;
+- dos memoriales con la misma foto comparten el segmento.
+
+Los segmentos se guardan en `cache_dir/<clave[:2]>/<clave>.mp4`. Al usarlos se
+actualiza su fecha de modificación para que una limpieza por antigüedad conserve
+los que siguen en uso.
+"""
+import hashlib
+import json
+import os
+
+import storage
+
+# Cambiar este número invalida todos los segmentos (p. ej. si cambian los ajustes del codificador)
+SEGMENT_FORMAT_VERSION = 1
+
+
+def render_params(resolution, fit_mode, duration_per_image, fps):
+    """Parámetros de render que afectan al contenido de un segmento."""
+    width, height = resolution
+    return {
+        'width': width,
+        'height': height,
+        'fit': fit_mode,
+        'duration': duration_per_image,
+        'fps': fps,
+        'version': SEGMENT_FORMAT_VERSION,
+    }
+
+
+def segment_key(source_digest, params):
+    """Clave de un segmento: hash de la imagen de origen y de los parámetros de render."""
+    material = json.dumps({'source': source_digest, **params}, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:40]
+
+
+class SegmentCache:
+    """Segmentos codificados en disco, direccionados por contenido."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.mp4')
+
+    def get(self, key):
+        """Ruta del segmento si está en caché (y lo marca como usado), o None."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def writing(self, key):
+        """
+        Contexto con la ruta temporal (única por proceso e hilo, con extensión .mp4 para que
+        FFmpeg elija el formato) donde codificar un segmento. Si el bloque termina bien, el
+        segmento se publica con un renombrado atómico; si no, el temporal se borra.
+        """
+        return storage.atomic_path(self.path(key))
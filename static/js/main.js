@@ -1,4 +1,74 @@
 document.addEventListener('DOMContentLoaded', function() {
+    // Reproducción adaptativa (HLS) si el video tiene rendiciones
+    const memorialVideo = document.getElementById('memorial-video');
+    if (memorialVideo && memorialVideo.dataset.hlsSrc) {
+        const hlsSrc = memorialVideo.dataset.hlsSrc;
+        if (memorialVideo.canPlayType('application/vnd.apple.mpegurl')) {
+            // Safari / iOS reproducen HLS de forma nativa
+            memorialVideo.src = hlsSrc;
+        } else if (window.Hls && Hls.isSupported()) {
+            const hls = new Hls({ capLevelToPlayerSize: true });
+            hls.loadSource(hlsSrc);
+            hls.attachMedia(memorialVideo);
+        }
+        // Si no hay soporte HLS, se queda el <source> MP4
+    }
+
+    // Progreso en vivo del video en generación (SSE, o consultas periódicas si no hay soporte)
+    const jobProgress = document.getElementById('job-progress');
+    if (jobProgress) {
+        const progressBar = jobProgress.querySelector('.progress-bar');
+        const stageLabel = jobProgress.querySelector('.job-etiqueta');
+        const waitLabel = jobProgress.querySelector('.job-espera');
+        let source = null;
+        let pollTimer = null;
+
+        const showStatus = function(status) {
+            progressBar.style.width = Math.max(status.progreso, 5) + '%';
+            progressBar.setAttribute('aria-valuenow', status.progreso);
+            progressBar.textContent = status.progreso + '%';
+            let label = status.etiqueta;
+            if (status.estado === 'queued' && status.intento > 0) {
+                label = 'Reintentando (intento ' + (status.intento + 1) + ' de ' + status.max_intentos + ')';
+            }
+            stageLabel.textContent = label;
+            let wait = status.espera ? 'Tiempo estimado: ' + status.espera : '';
+            if (wait && status.posicion) {
+                wait += ' · Posición en la cola: ' + status.posicion;
+            }
+            waitLabel.textContent = wait;
+            if (status.estado !== 'queued' && status.estado !== 'running') {
+                // Terminado (o fallido): recargar una vez para mostrar el video o el formulario
+                if (source) source.close();
+                if (pollTimer) clearInterval(pollTimer);
+                window.location.reload();
+            }
+        };
+
+        const startPolling = function() {
+            pollTimer = setInterval(function() {
+                fetch(jobProgress.dataset.statusUrl, { cache: 'no-store' })
+                    .then(function(response) { return response.json(); })
+                    .then(showStatus)
+                    .catch(function() {});  // Error de red puntual: se reintenta en la siguiente vuelta
+            }, 5000);
+        };
+
+        if (window.EventSource && jobProgress.dataset.eventsUrl) {
+            source = new EventSource(jobProgress.dataset.eventsUrl);
+            source.onmessage = function(event) { showStatus(JSON.parse(event.data)); };
+            source.onerror = function() {
+                // Cierre normal del flujo: el navegador se reconecta solo. Rechazo (503): consultas periódicas
+                if (source.readyState === EventSource.CLOSED && !pollTimer) {
+                    source = null;
+                    startPolling();
+                }
+            };
+        } else {
+            startPolling();
+        }
+    }
+
     // Busca el botón para compartir en la página
     const shareButton = document.getElementById('share-button');
     // Busca la barra de carga
@@ -0,0 +1,370 @@
+"""
+Ciclo de vida del almacenamiento: escrituras atómicas, barrido de huérfanos y cuotas.
+
+Todo vive en un único disco (el de Render), compartido por gunicorn y el trabajador, y
+hasta ahora solo crecía: un render interrumpido dejaba un `memorial_*.mp4` a medias, un
+borrado que fallaba a mitad dejaba la carpeta de subidas o los QR de una persona que ya
+no existe, y las cachés no tenían tope.
+
+- Escrituras atómicas: `atomic_path` y `atomic_dir` dan una ruta temporal junto al
+  destino y la renombran al terminar bien (o la borran si algo falla). Un archivo con su
+  nombre definitivo siempre está completo. Los temporales empiezan por TEMP_PREFIX, que
+  `secure_filename` nunca produce, así que `is_temp` no puede confundirlos con una foto subida.
+- Barrido: `stale_temp_entries` encuentra los temporales abandonados y `orphans` lo que
+  ya no referencia la base de datos (la reconciliación con la tabla `persona` está en
+  `sweep_storage`, en app.py). Los temporales con nombres de la versión anterior solo se
+  reconocen en el área donde se escribían (`Area.legacy_temp`). Nada se borra antes de
+  `grace_seconds`, para no tocar lo que otro proceso está escribiendo en ese momento.
+- Cuotas: `usage` mide cada área y `evict_lru` reduce una caché hasta su cuota borrando
+  primero lo usado hace más tiempo (las cachés actualizan la fecha de modificación al
+  usar una entrada). Las áreas de datos (videos, subidas) no se recortan: al pasar su
+  cuota, la aplicación deja de aceptar trabajo nuevo que escriba en ellas.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+# Nombre de los temporales: '.~<destino>.<pid>.<hilo>[.<extensión>]'. secure_filename quita
+# los puntos iniciales, así que ningún archivo subido puede empezar por este prefijo.
+TEMP_PREFIX = '.~'
+# Temporales de la versión anterior al gestor de almacenamiento, que aún pueden quedar en
+# disco. Solo se reconocen en el área donde se escribían (ver las funciones legacy_*_temp):
+# - video sin audio de MoviePy en la carpeta de videos ('temp_video_no_audio_<id>.mp4')
+LEGACY_VIDEO_TEMP_PREFIX = 'temp_video_no_audio_'
+# - carpeta de imágenes redimensionadas dentro de la carpeta de subidas de cada persona
+LEGACY_RESIZE_DIR = 'resized_temp'
+
+KIND_DATA = 'data'    # Contenido que referencia la base de datos: nunca se recorta por cuota
+KIND_CACHE = 'cache'  # Se puede regenerar: se recorta por antigüedad al pasar la cuota
+
+
+def is_temp(name):
+    """True si `name` es un archivo o carpeta temporal de una escritura atómica de esta versión."""
+    return name.startswith(TEMP_PREFIX)
+
+
+def legacy_video_temp(name, is_dir):
+    """En los videos, el antiguo video sin audio del motor MoviePy."""
+    return not is_dir and name.startswith(LEGACY_VIDEO_TEMP_PREFIX)
+
+
+def legacy_upload_temp(name, is_dir):
+    """En las subidas solo la antigua carpeta de redimensionado: los archivos son fotos de los usuarios."""
+    return is_dir and name == LEGACY_RESIZE_DIR
+
+
+def _temp_name(path):
+    carpeta, nombre = os.path.split(path)
+    return os.path.join(carpeta, f'{TEMP_PREFIX}{nombre}.{os.getpid()}.{threading.get_ident()}')
+
+
+def temp_path(path):
+    """Ruta temporal única junto a `path`, con su misma extensión (FFmpeg elige el formato por ella)."""
+    base, ext = os.path.splitext(path)
+    return _temp_name(base) + ext
+
+
+def is_being_written(path):
+    """True si existe el temporal de una escritura atómica de `path` (ver `atomic_path`)."""
+    carpeta, nombre = os.path.split(path)
+    base, ext = os.path.splitext(nombre)
+    try:
+        return any(entrada.startswith(f'{TEMP_PREFIX}{base}.') and entrada.endswith(ext)
+                   for entrada in os.listdir(carpeta))
+    except FileNotFoundError:
+        return False
+
+
+def remove_path(path):
+    """Elimina un archivo o una carpeta. Devuelve los bytes liberados (0 si no existía)."""
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            liberados = tree_usage(path)[0]
+            shutil.rmtree(path)
+        else:
+            liberados = os.path.getsize(path)
+            os.remove(path)
+    except FileNotFoundError:
+        return 0
+    return liberados
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Escritura atómica de un archivo: se escribe en la ruta que devuelve el contexto y,
+    si el bloque termina bien, se publica en `path` con un renombrado.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporal = temp_path(path)
+    try:
+        yield temporal
+        os.replace(temporal, path)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+
+@contextmanager
+def atomic_dir(path):
+    """Como `atomic_path`, para una carpeta completa (p. ej. las rendiciones HLS). `path` no debe existir."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporal = _temp_name(path)
+    os.makedirs(temporal)
+    try:
+        yield temporal
+        os.rename(temporal, path)
+    finally:
+        if os.path.exists(temporal):
+            shutil.rmtree(temporal, ignore_errors=True)
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Hash SHA-256 del contenido de un archivo (clave de las cachés direccionadas por contenido)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(chunk_size), b''):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def write_atomic(path, data):
+    """Escribe `data` en `path` mediante un archivo temporal y un renombrado."""
+    with atomic_path(path) as temporal:
+        with open(temporal, 'wb') as f:
+            f.write(data)
+
+
+# --- USO Y CUOTAS ---
+
+def tree_usage(path):
+    """(bytes, archivos) de una carpeta y sus subcarpetas (0, 0 si no existe)."""
+    total = archivos = 0
+    pendientes = [path]
+    while pendientes:
+        try:
+            entradas = list(os.scandir(pendientes.pop()))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entrada in entradas:
+            try:
+                if entrada.is_dir(follow_symlinks=False):
+                    pendientes.append(entrada.path)
+                elif entrada.is_file(follow_symlinks=False):
+                    total += entrada.stat(follow_symlinks=False).st_size
+                    archivos += 1
+            except FileNotFoundError:
+                continue  # Borrado mientras se recorría
+    return total, archivos
+
+
+class Area:
+    """
+    Carpeta con nombre, tipo (KIND_DATA o KIND_CACHE) y cuota en bytes (0 = sin límite).
+    `legacy_temp(nombre, es_carpeta)` reconoce, además de `is_temp`, los temporales con los
+    nombres que usaba la versión anterior en esta área (None = ninguno).
+    """
+
+    def __init__(self, name, path, kind, quota_bytes=0, legacy_temp=None):
+        self.name = name
+        self.path = path
+        self.kind = kind
+        self.quota_bytes = quota_bytes
+        self.legacy_temp = legacy_temp
+
+    def __repr__(self):
+        return f'<Area {self.name} {self.path}>'
+
+
+def usage(areas):
+    """Uso de cada área: lista de dicts con area, tipo, bytes, archivos, cuota y fracción usada."""
+    informe = []
+    for area in areas:
+        total, archivos = tree_usage(area.path)
+        informe.append({
+            'area': area.name,
+            'tipo': area.kind,
+            'bytes': total,
+            'archivos': archivos,
+            'cuota': area.quota_bytes,
+            'fraccion': total / area.quota_bytes if area.quota_bytes else None,
+        })
+    return informe
+
+
+def disk_free(path):
+    """Bytes libres en el disco que contiene `path`."""
+    return shutil.disk_usage(path).free
+
+
+class UsageSnapshot:
+    """
+    Uso de cada área calculado como mucho cada `max_age` segundos por proceso: recorrer
+    el disco en cada subida o en cada consulta de /metrics costaría más que la subida.
+    Cada área se mide la primera vez que se pide, no todas a la vez.
+    """
+
+    def __init__(self, areas_fn, max_age=300):
+        self.areas_fn = areas_fn
+        self.max_age = max_age
+        self._filas = {}  # nombre -> (instante, fila de `usage`)
+        self._lock = threading.Lock()
+
+    def get(self, name=None):
+        """Uso de un área (dict de `usage`, None si no existe) o, sin `name`, {nombre: uso} de todas."""
+        areas = [area for area in self.areas_fn() if name is None or area.name == name]
+        with self._lock:
+            ahora = time.monotonic()
+            for area in areas:
+                instante, _ = self._filas.get(area.name, (None, None))
+                if instante is None or ahora - instante >= self.max_age:
+                    self._filas[area.name] = (ahora, usage([area])[0])
+            resultado = {area.name: self._filas[area.name][1] for area in areas}
+        return resultado.get(name) if name else resultado
+
+    def invalidate(self):
+        with self._lock:
+            self._filas.clear()
+
+
+def _cache_files(path):
+    """(mtime, bytes, ruta) de cada archivo definitivo de una caché."""
+    archivos = []
+    pendientes = [path]
+    while pendientes:
+        try:
+            entradas = list(os.scandir(pendientes.pop()))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entrada in entradas:
+            try:
+                if entrada.is_dir(follow_symlinks=False):
+                    pendientes.append(entrada.path)
+                elif entrada.is_file(follow_symlinks=False) and not is_temp(entrada.name):
+                    info = entrada.stat(follow_symlinks=False)
+                    archivos.append((info.st_mtime, info.st_size, entrada.path))
+            except FileNotFoundError:
+                continue
+    return archivos
+
+
+def evict_lru(path, target_bytes, grace_seconds=0, dry_run=False, now=None):
+    """
+    Borra los archivos de una caché usados hace más tiempo hasta que ocupe `target_bytes`
+    o menos. Los usados en los últimos `grace_seconds` se conservan aunque no baje.
+    Devuelve (archivos, bytes) liberados.
+    """
+    now = now or time.time()
+    archivos = sorted(_cache_files(path))
+    total = sum(tamano for _, tamano, _ in archivos)
+    borrados = liberados = 0
+    for mtime, tamano, ruta in archivos:
+        if total - liberados <= target_bytes or now - mtime < grace_seconds:
+            break
+        if not dry_run:
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                continue
+        borrados += 1
+        liberados += tamano
+    return borrados, liberados
+
+
+# --- BARRIDO DE HUÉRFANOS ---
+
+def _age(path, now):
+    try:
+        return now - os.stat(path, follow_symlinks=False).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def stale_temp_entries(path, grace_seconds, now=None, legacy_temp=None):
+    """
+    Temporales (archivos o carpetas) bajo `path` sin tocar desde hace más de `grace_seconds`:
+    los de `is_temp` y los que reconozca `legacy_temp(nombre, es_carpeta)` (ver Area).
+    """
+    now = now or time.time()
+    encontrados = []
+    pendientes = [path]
+    while pendientes:
+        try:
+            entradas = list(os.scandir(pendientes.pop()))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entrada in entradas:
+            es_carpeta = entrada.is_dir(follow_symlinks=False)
+            if is_temp(entrada.name) or (legacy_temp and legacy_temp(entrada.name, es_carpeta)):
+                edad = _age(entrada.path, now)
+                if edad is not None and edad >= grace_seconds:
+                    encontrados.append(entrada.path)
+            elif es_carpeta:
+                pendientes.append(entrada.path)
+    return encontrados
+
+
+def orphans(folder, is_referenced, grace_seconds, now=None):
+    """
+    Entradas directas de `folder` (no temporales) que `is_referenced(nombre)` no reconoce
+    y que no se han modificado en los últimos `grace_seconds`.
+    """
+    now = now or time.time()
+    try:
+        nombres = sorted(os.listdir(folder))
+    except FileNotFoundError:
+        return []
+    encontrados = []
+    for nombre in nombres:
+        if is_temp(nombre) or is_referenced(nombre):
+            continue
+        ruta = os.path.join(folder, nombre)
+        edad = _age(ruta, now)
+        if edad is not None and edad >= grace_seconds:
+            encontrados.append(ruta)
+    return encontrados
+
+
+def unreferenced_files(folder, is_referenced, grace_seconds, now=None):
+    """
+    Archivos (no temporales) bajo `folder`, a cualquier profundidad, cuya ruta relativa
+    ('a/b.jpg') `is_referenced` no reconoce y que llevan más de `grace_seconds` sin cambios.
+    """
+    now = now or time.time()
+    encontrados = []
+    for raiz, _, archivos in os.walk(folder):
+        for nombre in archivos:
+            if is_temp(nombre):
+                continue
+            ruta = os.path.join(raiz, nombre)
+            if is_referenced(os.path.relpath(ruta, folder).replace(os.sep, '/')):
+                continue
+            edad = _age(ruta, now)
+            if edad is not None and edad >= grace_seconds:
+                encontrados.append(ruta)
+    return encontrados
+
+
+def reclaim(paths, dry_run=False):
+    """Elimina (o solo mide, con `dry_run`) las rutas dadas. Devuelve (entradas, bytes)."""
+    liberados = 0
+    for ruta in paths:
+        if not dry_run:
+            liberados += remove_path(ruta)
+        elif os.path.isdir(ruta):
+            liberados += tree_usage(ruta)[0]
+        elif os.path.exists(ruta):
+            liberados += os.path.getsize(ruta)
+    return len(paths), liberados
+
+
+def format_bytes(valor):
+    """Tamaño legible (1.5 GB, 320 MB...)."""
+    for unidad in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if abs(valor) < 1024 or unidad == 'TB':
+            break
+        valor /= 1024
+    return f'{valor:.0f} {unidad}' if unidad == 'B' else f'{valor:.1f} {unidad}'
@@ -0,0 +1,99 @@
+"""
+Configuración común de las pruebas.
+
+La aplicación se importa con una base de datos SQLite y carpetas de trabajo temporales,
+así que las pruebas nunca tocan `instance/` ni `static/`. Cada prueba empieza con las
+tablas y las carpetas de trabajo vacías.
+
+Uso (desde la raíz del repositorio):
+
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+"""
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+_DATOS = tempfile.mkdtemp(prefix='memorial_tests_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_DATOS, 'test.db')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import app as app_module  # noqa: E402  (después de fijar DATABASE_URL)
+
+_STATIC = os.path.join(_DATOS, 'static')
+_CARPETAS = {
+    'UPLOAD_FOLDER': os.path.join(_STATIC, 'uploads'),
+    'VIDEO_FOLDER': os.path.join(_STATIC, 'videos'),
+    'MUSIC_FOLDER': os.path.join(_STATIC, 'music'),
+    'LEGACY_QR_FOLDER': os.path.join(_STATIC, 'qrcodes'),
+    'QR_CACHE_FOLDER': os.path.join(_DATOS, 'qr_cache'),
+    'EXPORT_FOLDER': os.path.join(_DATOS, 'exports'),
+    'MUSIC_CACHE_FOLDER': os.path.join(_DATOS, 'music_cache'),
+    'VIDEO_SEGMENT_CACHE_FOLDER': os.path.join(_DATOS, 'segment_cache'),
+}
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app = app_module.app
+    flask_app.config.update(TESTING=True, **_CARPETAS)
+    flask_app.static_folder = _STATIC
+    app_module.qr_cache.cache_dir = _CARPETAS['QR_CACHE_FOLDER']
+    app_module.music.music_dir = _CARPETAS['MUSIC_FOLDER']
+    app_module.music.cache_dir = _CARPETAS['MUSIC_CACHE_FOLDER']
+    app_module.create_app(role=app_module.ROLE_WEB)
+    return flask_app
+
+
+@pytest.fixture(autouse=True)
+def _tablas_vacias(app):
+    """Cada prueba empieza con la base de datos vacía y con un contexto de aplicación propio."""
+    with app.app_context():
+        db = app_module.db
+        for tabla in reversed(db.metadata.sorted_tables):
+            db.session.execute(tabla.delete())
+        db.session.commit()
+        yield
+        db.session.rollback()
+        db.session.remove()
+
+
+@pytest.fixture(autouse=True)
+def _carpetas_vacias(app):
+    """Y con las carpetas de trabajo vacías (los ids de SQLite se reutilizan entre pruebas)."""
+    for carpeta in _CARPETAS.values():
+        shutil.rmtree(carpeta, ignore_errors=True)
+        os.makedirs(carpeta)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as sesion:
+        sesion['logged_in'] = True
+    return client
+
+
+@pytest.fixture
+def crear_persona():
+    """Crea y guarda una persona; devuelve su id."""
+    def _crear(nombre='Persona de prueba', **campos):
+        persona = app_module.Persona(nombre=nombre, fecha_nacimiento=date(1940, 5, 1),
+                                     fecha_muerte=date(2020, 3, 1), **campos)
+        app_module.db.session.add(persona)
+        app_module.db.session.commit()
+        return persona.id
+    return _crear
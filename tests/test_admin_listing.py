@@ -0,0 +1,50 @@
+"""Panel de administración: paginación por clave (keyset) y filtros de estado."""
+import re
+
+
+def _nombres(respuesta):
+    # Cada nombre aparece varias veces en la fila (texto y confirmación de borrado)
+    return list(dict.fromkeys(re.findall(r'Persona (\d\d)', respuesta.get_data(as_text=True))))
+
+
+def _enlace(respuesta, parametro):
+    encontrado = re.search(rf'[?&]{parametro}=(\d+)', respuesta.get_data(as_text=True))
+    return int(encontrado.group(1)) if encontrado else None
+
+
+def test_paginas_siguiente_y_anterior(app, admin_client, crear_persona, monkeypatch):
+    monkeypatch.setitem(app.config, 'ADMIN_PAGE_SIZE', 3)
+    ids = [crear_persona(f'Persona {i:02d}') for i in range(1, 8)]
+
+    primera = admin_client.get('/admin')
+    assert _nombres(primera) == ['07', '06', '05']
+    assert _enlace(primera, 'before') is None
+    assert _enlace(primera, 'after') == ids[4]
+
+    segunda = admin_client.get(f'/admin?after={ids[4]}')
+    assert _nombres(segunda) == ['04', '03', '02']
+    assert _enlace(segunda, 'after') == ids[1]
+    assert _enlace(segunda, 'before') == ids[3]
+
+    ultima = admin_client.get(f'/admin?after={ids[1]}')
+    assert _nombres(ultima) == ['01']
+    assert _enlace(ultima, 'after') is None
+
+    # Volver atrás desde la segunda página devuelve exactamente la primera
+    anterior = admin_client.get(f'/admin?before={ids[3]}')
+    assert _nombres(anterior) == ['07', '06', '05']
+    assert _enlace(anterior, 'before') is None
+
+
+def test_filtro_de_estado(admin_client, crear_persona):
+    crear_persona('Persona 01')
+    crear_persona('Persona 02', images_uploaded=True, video_generated=True, video_path='videos/x.mp4')
+    crear_persona('Persona 03', images_uploaded=True)
+
+    assert _nombres(admin_client.get('/admin?estado=generado')) == ['02']
+    assert _nombres(admin_client.get('/admin?estado=imagenes')) == ['03']
+    assert _nombres(admin_client.get('/admin?estado=sin_imagenes')) == ['01']
+
+
+def test_requiere_sesion(client):
+    assert client.get('/admin').status_code == 302
@@ -0,0 +1,55 @@
+"""Admisión de solicitudes de video: límite exacto de la cola y huella anónima del cliente."""
+import os
+import subprocess
+import sys
+import threading
+
+import admission
+from app import Persona, VideoJob, admit_video_job, db
+from conftest import RAIZ
+
+
+def test_limite_de_cola_con_solicitudes_simultaneas(app, crear_persona, monkeypatch):
+    for clave, valor in (('VIDEO_QUEUE_MAX_DEPTH', 3), ('VIDEO_RATE_CLIENT_MAX', 0), ('VIDEO_RATE_PERSONA_MAX', 0),
+                         ('STORAGE_MIN_FREE_MB', 0)):
+        monkeypatch.setitem(app.config, clave, valor)
+    ids = [crear_persona(images_uploaded=True) for _ in range(10)]
+    salida = threading.Barrier(len(ids))
+    resultados = []
+
+    def solicitar(persona_id):
+        with app.app_context():
+            persona = db.session.get(Persona, persona_id)
+            salida.wait()
+            try:
+                job = admit_video_job(persona, admission.LANE_PUBLIC, client_key=f'cliente-{persona_id}')
+                db.session.commit()
+                resultados.append('admitida' if job else 'repetida')
+            except admission.AdmissionRejected as e:
+                db.session.rollback()
+                resultados.append(e.reason)
+            finally:
+                db.session.remove()
+
+    hilos = [threading.Thread(target=solicitar, args=(persona_id,)) for persona_id in ids]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert sorted(resultados) == ['admitida'] * 3 + [admission.REASON_QUEUE_FULL] * 7
+    assert db.session.query(VideoJob).count() == 3
+    # Las rechazadas no quedan marcadas como procesando
+    assert db.session.query(Persona).filter(Persona.video_processing.is_(True)).count() == 3
+
+
+def test_clave_de_cliente_firmada_con_la_secret_key_del_entorno(tmp_path):
+    sonda = 'import app; print(app.app.config["SECRET_KEY"])'
+    entorno = {**os.environ, 'DATABASE_URL': f'sqlite:///{tmp_path}/clave.db', 'SECRET_KEY': 'clave-de-produccion'}
+    resultado = subprocess.run([sys.executable, '-c', sonda], cwd=RAIZ, env=entorno,
+                               capture_output=True, text=True, timeout=120)
+    assert resultado.stdout.strip() == 'clave-de-produccion', resultado.stderr
+
+    # Sin la clave no se puede relacionar la huella con la IP
+    assert admission.client_key('203.0.113.7', 'a') != admission.client_key('203.0.113.7', 'b')
+    assert admission.client_key('203.0.113.7', 'a') == admission.client_key('203.0.113.7', 'a')
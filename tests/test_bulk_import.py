@@ -0,0 +1,43 @@
+"""Importación masiva: validación por fila y pools de procesos compartidos."""
+import io
+import json
+
+import bulk_import
+import pools
+
+
+def test_nombre_que_no_es_texto_es_un_error_de_fila():
+    datos, error = bulk_import.validate_record({'nombre': 12345, 'fecha_nacimiento': '1940-05-01',
+                                                'fecha_muerte': '2020-03-01'})
+    assert datos is None
+    assert 'texto' in error
+
+
+def test_importacion_json_informa_cada_fila(app, admin_client):
+    app.config['IMPORT_QR_WORKERS'] = 1
+    registros = [
+        {'nombre': 'Ana', 'fecha_nacimiento': '1940-05-01', 'fecha_muerte': '2020-03-01'},
+        {'nombre': ['no', 'es', 'texto'], 'fecha_nacimiento': '1940-05-01', 'fecha_muerte': '2020-03-01'},
+        {'nombre': 'Luis', 'fecha_nacimiento': '1941-06-02', 'fecha_muerte': '2021-04-02'},
+    ]
+    archivo = (io.BytesIO(json.dumps(registros).encode()), 'personas.json')
+    respuesta = admin_client.post('/import_personas', data={'archivo': archivo},
+                                  headers={'Accept': 'application/json'},
+                                  content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    informe = respuesta.get_json()
+    assert [r['estado'] for r in informe] == ['ok', 'error', 'ok']
+    assert informe[1]['fila'] == 2
+
+
+def test_pool_compartido_se_reutiliza():
+    try:
+        primero = pools.get_pool(pools.QR, 2)
+        assert primero is not None
+        assert pools.get_pool(pools.QR, 2) is primero
+        assert pools.get_pool(pools.IMAGES, 2) is not primero
+        assert pools.get_pool(pools.QR, 1) is None
+        assert pools.get_pool(pools.QR, 3) is not primero  # Otro tamaño: se sustituye
+    finally:
+        pools.shutdown()
+    assert pools.get_pool(pools.QR, 1) is None and not pools._pools
@@ -0,0 +1,66 @@
+"""Motor de base de datos: DATABASE_URL, opciones del pool, PRAGMA de SQLite y migraciones."""
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import database
+
+
+@pytest.mark.parametrize('url, esperada', [
+    (None, 'sqlite:////datos/database.db'),
+    ('', 'sqlite:////datos/database.db'),
+    ('postgres://u:p@host/db', 'postgresql+psycopg2://u:p@host/db'),
+    ('postgresql://u:p@host/db', 'postgresql+psycopg2://u:p@host/db'),
+    ('postgresql+psycopg://u:p@host/db', 'postgresql+psycopg://u:p@host/db'),  # Driver explícito: se respeta
+    ('sqlite:////otra.db', 'sqlite:////otra.db'),
+])
+def test_database_url(url, esperada):
+    assert database.database_url(url, '/datos/database.db') == esperada
+
+
+def test_opciones_del_pool_segun_el_motor():
+    postgres = database.engine_options('postgresql+psycopg2://u:p@host/db', pool_size=3)
+    assert postgres['pool_pre_ping'] and postgres['pool_size'] == 3
+    assert postgres['connect_args'] == {'connect_timeout': 10}
+
+    sqlite = database.engine_options('sqlite:////datos/database.db', busy_timeout_ms=2500)
+    assert sqlite == {'connect_args': {'timeout': 2.5}}  # SQLite no usa QueuePool
+
+
+def test_pragmas_de_sqlite(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/wal.db')
+    database.configure_sqlite(engine, busy_timeout_ms=1234)
+    with engine.connect() as conn:
+        assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+        assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 1234
+    engine.dispose()
+
+
+def test_migraciones_una_sola_vez_con_varios_procesos(tmp_path):
+    url = f'sqlite:///{tmp_path}/migraciones.db'
+    aplicadas = []
+
+    def crear_tabla(conn):
+        conn.execute(text('CREATE TABLE ejemplo (id INTEGER PRIMARY KEY)'))
+
+    migraciones = [(2, 'segunda', lambda conn: conn.execute(text('ALTER TABLE ejemplo ADD COLUMN nombre TEXT'))),
+                   (1, 'primera', crear_tabla)]
+
+    def arrancar():
+        engine = create_engine(url, **database.engine_options(url))
+        database.configure_sqlite(engine)
+        aplicadas.extend(database.run_migrations(engine, migraciones))
+        engine.dispose()
+
+    hilos = [threading.Thread(target=arrancar) for _ in range(3)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert sorted(aplicadas) == ['primera', 'segunda']
+    engine = create_engine(url)
+    assert database.applied_versions(engine) == {1, 2}
+    engine.dispose()
@@ -0,0 +1,78 @@
+"""Exportación del registro: CSV por partes y PDF en segundo plano con escritura atómica."""
+import csv
+import io
+import os
+from collections import namedtuple
+from datetime import date
+
+import pytest
+
+import exports
+import storage
+from app import Persona, db, qr_view_url
+
+
+def test_csv_con_bom_y_las_columnas_del_pdf(admin_client, crear_persona):
+    ids = [crear_persona(f'Persona {n}', images_uploaded=n == 2) for n in range(1, 4)]
+
+    respuesta = admin_client.get('/export_csv')
+    assert respuesta.status_code == 200 and respuesta.mimetype == 'text/csv'
+    assert respuesta.is_streamed
+    texto = respuesta.get_data().decode('utf-8')
+    assert texto.startswith('\ufeff')
+
+    filas = list(csv.reader(io.StringIO(texto[1:])))
+    assert filas[0] == exports.EXPORT_COLUMNS
+    assert [fila[0] for fila in filas[1:]] == [str(i) for i in ids]
+    assert filas[2] == [str(ids[1]), 'Persona 2', '01/05/1940', '01/03/2020', 'Imágenes Subidas', qr_view_url(ids[1])]
+
+
+def test_csv_por_trozos():
+    Fila = namedtuple('Fila', 'id nombre fecha_nacimiento fecha_muerte images_uploaded video_generated')
+    filas = [Fila(n, f'P{n}', date(2000, 1, 1), date(2001, 1, 1), False, False) for n in range(5)]
+    trozos = list(exports.iter_csv(filas, lambda row: f'url/{row.id}', chunk_rows=2))
+    assert len(trozos) == 3
+    assert ''.join(trozos).count('\n') == 6
+
+
+def test_csv_requiere_sesion(client):
+    assert client.get('/export_csv').status_code == 302
+
+
+def test_pdf_atomico(app, crear_persona, tmp_path):
+    crear_persona('Persona 1')
+    destino = str(tmp_path / 'registro.pdf')
+
+    def qr_roto(row):
+        raise RuntimeError('sin QR')
+
+    total = exports.write_pdf_file(destino, exports.iter_personas(db.session, Persona), qr_roto)
+    assert total == 1
+    with open(destino, 'rb') as f:
+        assert f.read(5) == b'%PDF-'
+    assert os.listdir(tmp_path) == ['registro.pdf']
+
+    def filas_rotas():
+        yield from exports.iter_personas(db.session, Persona)
+        raise RuntimeError('fallo de la base de datos')
+
+    with pytest.raises(RuntimeError):
+        exports.write_pdf_file(str(tmp_path / 'otro.pdf'), filas_rotas(), qr_roto)
+    assert os.listdir(tmp_path) == ['registro.pdf']
+
+
+def test_descarga_de_una_exportacion_en_curso(app, admin_client):
+    ruta = os.path.join(app.config['EXPORT_FOLDER'], 'registros_personas_20260101_120000.pdf')
+    url = '/exports/registros_personas_20260101_120000.pdf'
+    with storage.atomic_path(ruta) as temporal:
+        open(temporal, 'wb').close()
+        assert storage.is_being_written(ruta)
+        admin_client.get(url)
+        with admin_client.session_transaction() as sesion:
+            assert 'todavía se está generando' in sesion['_flashes'][-1][1]
+        with open(temporal, 'wb') as f:
+            f.write(b'%PDF-1.4')
+
+    assert not storage.is_being_written(ruta)
+    respuesta = admin_client.get(url)
+    assert respuesta.status_code == 200 and respuesta.data == b'%PDF-1.4'
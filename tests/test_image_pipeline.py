@@ -0,0 +1,73 @@
+"""Preprocesamiento de fotos: ajuste sin deformar, orientación EXIF y orden de los cuadros."""
+import pytest
+from PIL import Image
+
+import image_pipeline
+import pools
+
+RESOLUCION = (160, 90)
+
+
+def _foto(ruta, tamano, color=(255, 255, 255), orientacion=None):
+    img = Image.new('RGB', tamano, color)
+    exif = Image.Exif()
+    if orientacion:
+        exif[0x0112] = orientacion
+    img.save(ruta, 'JPEG', exif=exif)
+    return str(ruta)
+
+
+def _pixel(frame, x, y, resolution=RESOLUCION):
+    inicio = (y * resolution[0] + x) * 3
+    return tuple(frame[inicio:inicio + 3])
+
+
+def test_letterbox_centra_sin_deformar(tmp_path):
+    # Una foto vertical 1:2 ocupa todo el alto y queda centrada entre bandas negras
+    frame = image_pipeline.prepare_frame(_foto(tmp_path / 'v.jpg', (100, 200)), RESOLUCION)
+    assert len(frame) == RESOLUCION[0] * RESOLUCION[1] * 3
+    assert _pixel(frame, 5, 45) == (0, 0, 0)
+    assert min(_pixel(frame, 80, 45)) > 240
+    assert min(_pixel(frame, 80, 2)) > 240
+
+
+def test_crop_llena_el_cuadro(tmp_path):
+    frame = image_pipeline.prepare_frame(_foto(tmp_path / 'v.jpg', (100, 200)), RESOLUCION,
+                                         mode=image_pipeline.FIT_CROP)
+    assert min(_pixel(frame, 0, 0)) > 240 and min(_pixel(frame, 159, 89)) > 240
+
+
+def test_aplica_la_orientacion_exif(tmp_path):
+    # Guardada apaisada con orientación 6 (girar 90°): se muestra vertical, con bandas
+    frame = image_pipeline.prepare_frame(_foto(tmp_path / 'r.jpg', (200, 100), orientacion=6), RESOLUCION)
+    assert _pixel(frame, 5, 45) == (0, 0, 0)
+
+
+def test_modo_desconocido():
+    with pytest.raises(ValueError):
+        image_pipeline.fit_image(Image.new('RGB', (10, 10)), RESOLUCION, mode='estirar')
+
+
+def test_conserva_el_orden_y_omite_las_fallidas(tmp_path):
+    rojo = _foto(tmp_path / 'rojo.jpg', (160, 90), (255, 0, 0))
+    azul = _foto(tmp_path / 'azul.jpg', (160, 90), (0, 0, 255))
+    rota = tmp_path / 'rota.jpg'
+    rota.write_bytes(b'no es una imagen')
+    rutas = [rojo, str(rota), azul]
+
+    tiempos = []
+    frames = image_pipeline.prepare_frames(rutas, RESOLUCION, workers=1, timings=tiempos)
+    assert [_pixel(f, 80, 45)[0] > 200 for f in frames] == [True, False]
+    assert len(tiempos) == 2
+
+    con_huecos = image_pipeline.prepare_frames(rutas, RESOLUCION, workers=1, keep_failed=True)
+    assert con_huecos[1] is None and len(con_huecos) == 3
+
+
+def test_pool_de_procesos_da_los_mismos_cuadros(tmp_path):
+    rutas = [_foto(tmp_path / f'{n}.jpg', (100 + n * 40, 90), (n * 60, 0, 0)) for n in range(4)]
+    try:
+        paralelo = image_pipeline.prepare_frames(rutas, RESOLUCION, workers=2)
+    finally:
+        pools.shutdown(pools.IMAGES)
+    assert paralelo == image_pipeline.prepare_frames(rutas, RESOLUCION, workers=1)
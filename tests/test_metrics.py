@@ -0,0 +1,79 @@
+"""Métricas de /metrics: contadores e histogramas acumulados que no bajan."""
+from datetime import timedelta
+
+import metrics
+from app import (SPAN_QUEUE_WAIT, SPAN_RENDER, VideoJob, VideoJobSpan, VideoMetric, _utcnow, _video_metric_inicial,
+                 claim_next_video_job, complete_video_job, db, enqueue_video_job, fail_video_job, prune_video_history,
+                 save_job_spans)
+
+
+def _linea(texto, prefijo):
+    return next(linea for linea in texto.splitlines() if linea.startswith(prefijo))
+
+
+def _render_completo(persona_id, worker_id='w1'):
+    enqueue_video_job(persona_id)
+    db.session.commit()
+    job = claim_next_video_job(worker_id)
+    save_job_spans(job.id, job.attempts, [(SPAN_QUEUE_WAIT, 3.0), (SPAN_RENDER, 40.0)])
+    assert complete_video_job(job, worker_id, output_bytes=5 * 2**20)
+    return job.id
+
+
+def test_histograma_acumula_buckets():
+    muestras = metrics.merge_samples(metrics.histogram_samples('h', 0.3, (0.5, 1))
+                                     + metrics.histogram_samples('h', 0.7, (0.5, 1))
+                                     + metrics.histogram_samples('h', 9, (0.5, 1)))
+    agrupadas = metrics.collect_samples((m['name'], m['labels'], m['sample'], m['value']) for m in muestras)
+    [(etiquetas, conteos, suma, total)] = metrics.histogram_series(agrupadas['h'], (0.5, 1))
+    assert etiquetas == {} and conteos == [1, 2] and suma == 10 and total == 3
+
+
+def test_contadores_no_bajan_al_borrar_una_persona(app, admin_client, crear_persona):
+    persona_id = crear_persona()
+    _render_completo(persona_id)
+    enqueue_video_job(persona_id)
+    db.session.commit()
+    fail_video_job(claim_next_video_job('w1'), 'error de prueba', 'w1')
+
+    antes = app.test_client().get('/metrics').get_data(as_text=True)
+    assert _linea(antes, 'memorial_video_jobs_completed_total ') == 'memorial_video_jobs_completed_total 1'
+    assert _linea(antes, 'memorial_video_job_failures_total ') == 'memorial_video_job_failures_total 1'
+
+    admin_client.post(f'/delete_person/{persona_id}')
+    assert db.session.query(VideoJob).count() == 0
+
+    despues = app.test_client().get('/metrics').get_data(as_text=True)
+    for prefijo in ('memorial_video_jobs_completed_total ', 'memorial_video_job_failures_total ',
+                    'memorial_video_queue_wait_seconds_count ', 'memorial_video_stage_seconds_count{stage="render"}',
+                    'memorial_video_output_bytes_count '):
+        assert _linea(despues, prefijo) == _linea(antes, prefijo)
+    assert _linea(despues, 'memorial_video_stage_seconds_count{stage="render"}').endswith(' 1')
+
+
+def test_recorte_del_historial(app, crear_persona, monkeypatch):
+    monkeypatch.setitem(app.config, 'VIDEO_HISTORY_RETENTION_DAYS', 30)
+    viejo = _render_completo(crear_persona())
+    reciente = _render_completo(crear_persona())
+    hace_tiempo = _utcnow() - timedelta(days=31)
+    db.session.get(VideoJob, viejo).finished_at = hace_tiempo
+    db.session.query(VideoJobSpan).filter_by(job_id=viejo).update({'created_at': hace_tiempo})
+    db.session.commit()
+
+    assert prune_video_history() == (2, 1)
+    assert db.session.get(VideoJob, viejo) is None
+    assert db.session.get(VideoJob, reciente) is not None
+    texto = app.test_client().get('/metrics').get_data(as_text=True)
+    assert _linea(texto, 'memorial_video_jobs_completed_total ') == 'memorial_video_jobs_completed_total 2'
+
+
+def test_migracion_inicial_parte_de_las_filas_existentes(app, crear_persona):
+    _render_completo(crear_persona())
+    db.session.query(VideoMetric).delete()
+    db.session.commit()
+
+    with db.engine.begin() as conn:
+        _video_metric_inicial(conn)
+    texto = app.test_client().get('/metrics').get_data(as_text=True)
+    assert _linea(texto, 'memorial_video_jobs_completed_total ') == 'memorial_video_jobs_completed_total 1'
+    assert _linea(texto, 'memorial_video_queue_wait_seconds_count ') == 'memorial_video_queue_wait_seconds_count 1'
@@ -0,0 +1,28 @@
+"""Biblioteca de música: hash de las pistas y stems publicados de forma atómica."""
+import os
+import subprocess
+
+import pytest
+
+import music_library
+import storage
+
+
+def _biblioteca(tmp_path, ffmpeg_bin='ffmpeg'):
+    (tmp_path / 'music').mkdir()
+    (tmp_path / 'music' / 'pista.mp3').write_bytes(b'audio de prueba')
+    return music_library.MusicLibrary(str(tmp_path / 'music'), str(tmp_path / 'stems'), ffmpeg_bin=ffmpeg_bin)
+
+
+def test_hash_de_la_pista_es_el_compartido(tmp_path):
+    biblioteca = _biblioteca(tmp_path)
+    pista = str(tmp_path / 'music' / 'pista.mp3')
+    assert biblioteca._digest(pista) == storage.file_digest(pista)
+
+
+def test_stem_fallido_no_deja_temporales(tmp_path):
+    biblioteca = _biblioteca(tmp_path, ffmpeg_bin='false')  # Un "FFmpeg" que siempre falla
+    with pytest.raises(subprocess.CalledProcessError):
+        biblioteca.stem_for(str(tmp_path / 'music' / 'pista.mp3'), 30)
+    restos = [nombre for _, _, nombres in os.walk(tmp_path / 'stems') for nombre in nombres]
+    assert restos == []
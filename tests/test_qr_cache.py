@@ -0,0 +1,69 @@
+"""QR bajo demanda: caché por contenido en memoria y disco, tamaños PNG, SVG y ETag."""
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import qr_service
+from app import qr_cache, qr_view_url
+
+
+def test_png_al_tamano_pedido_y_nitido():
+    data = qr_service.render_qr('https://ejemplo.org/view/1', qr_service.FORMAT_PNG, 256)
+    with Image.open(BytesIO(data)) as img:
+        assert img.size == (256, 256) and img.mode == '1'
+    assert qr_service.nearest_png_size(300) == 256 and qr_service.nearest_png_size(5000) == 1024
+
+
+def test_svg_es_vectorial():
+    data = qr_service.render_qr('https://ejemplo.org/view/1', qr_service.FORMAT_SVG)
+    assert b'<svg' in data
+    # Un único SVG sirve para cualquier tamaño
+    assert (qr_service.qr_key('x', qr_service.FORMAT_SVG, 128)
+            == qr_service.qr_key('x', qr_service.FORMAT_SVG, 1024))
+    with pytest.raises(ValueError):
+        qr_service.render_qr('x', 'gif')
+
+
+def test_cache_genera_una_sola_vez(tmp_path, monkeypatch):
+    cache = qr_service.QrCache(str(tmp_path), memory_items=1)
+    generados = []
+    original = qr_service.render_qr
+    monkeypatch.setattr(qr_service, 'render_qr', lambda *args: generados.append(args) or original(*args))
+
+    clave, data = cache.get('a', qr_service.FORMAT_PNG, 128)
+    assert os.path.isfile(cache.disk_path('a', qr_service.FORMAT_PNG, 128))
+    assert cache.get('a', qr_service.FORMAT_PNG, 128) == (clave, data)  # Memoria
+    cache.get('b', qr_service.FORMAT_PNG, 128)                          # Expulsa 'a' de la memoria
+    assert cache.get('a', qr_service.FORMAT_PNG, 128) == (clave, data)  # Disco
+    assert len(generados) == 2
+
+    cache.discard('a')
+    assert not os.path.exists(cache.disk_path('a', qr_service.FORMAT_PNG, 128))
+    cache.get('a', qr_service.FORMAT_PNG, 128)
+    assert len(generados) == 3
+
+
+def test_ruta_qr_con_etag(app, client, crear_persona):
+    persona_id = crear_persona()
+    qr_cache.discard(qr_view_url(persona_id))  # Los ids de SQLite se reutilizan entre pruebas
+    respuesta = client.get(f'/qr/{persona_id}.png?size=512')
+    assert respuesta.status_code == 200 and respuesta.mimetype == 'image/png'
+    with Image.open(BytesIO(respuesta.data)) as img:
+        assert img.size == (512, 512)
+    etag = respuesta.headers['ETag']
+    assert etag.strip('"') == qr_service.qr_key(qr_view_url(persona_id), qr_service.FORMAT_PNG, 512)
+    assert respuesta.cache_control.public and respuesta.cache_control.max_age
+
+    assert client.get(f'/qr/{persona_id}.png?size=512', headers={'If-None-Match': etag}).status_code == 304
+    svg = client.get(f'/qr/{persona_id}.svg?download=1')
+    assert svg.mimetype == 'image/svg+xml'
+    assert svg.headers['Content-Disposition'] == f'attachment; filename=qr_{persona_id}.svg'
+    assert os.path.isfile(qr_cache.disk_path(qr_view_url(persona_id), qr_service.FORMAT_SVG, 0))
+
+
+def test_ruta_qr_rechaza_formatos_y_personas_desconocidas(client, crear_persona):
+    persona_id = crear_persona()
+    assert client.get(f'/qr/{persona_id}.gif').status_code == 404
+    assert client.get(f'/qr/{persona_id + 1}.png').status_code == 404
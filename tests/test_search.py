@@ -0,0 +1,70 @@
+"""Búsqueda por nombre: subcadena sin distinguir mayúsculas, en SQLite y en PostgreSQL."""
+import re
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+
+import search
+from app import Persona
+
+
+def _buscar(admin_client, texto):
+    html = admin_client.get('/admin', query_string={'search': texto}).get_data(as_text=True)
+    return sorted(set(re.findall(r'(María González|Pedro Gonzalez|Marco Polo|Ana Gómez)', html)))
+
+
+@pytest.fixture
+def personas(app, crear_persona):
+    for nombre in ('María González', 'Pedro Gonzalez', 'Marco Polo', 'Ana Gómez'):
+        crear_persona(nombre)
+
+
+@pytest.mark.parametrize('texto, esperados', [
+    ('alez', ['Pedro Gonzalez']),        # Subcadena en medio de una palabra; las tildes cuentan
+    ('zál', ['María González']),
+    ('GONZ', ['María González', 'Pedro Gonzalez']),
+    ('ía Gon', ['María González']),      # El espacio forma parte del texto buscado
+    ('mar gon', []),                     # No busca por palabras sueltas
+    ('Ma', ['Marco Polo', 'María González']),  # Menos de un trigrama: LIKE sin índice
+    ('go"', []),
+])
+def test_busqueda_por_subcadena(admin_client, personas, texto, esperados):
+    assert search.setup_search_index(Persona.query.session.get_bind()) == search.BACKEND_FTS5
+    assert _buscar(admin_client, texto) == esperados
+
+
+def test_renombrar_actualiza_el_indice(app, admin_client, crear_persona):
+    persona_id = crear_persona('Ana Gómez')
+    persona = Persona.query.session.get(Persona, persona_id)
+    persona.nombre = 'Marco Polo'
+    Persona.query.session.commit()
+    assert _buscar(admin_client, 'ómez') == []
+    assert _buscar(admin_client, 'arco') == ['Marco Polo']
+
+
+def test_postgres_usa_ilike_con_subcadena():
+    consulta = search.apply_name_search(Persona.query, Persona, ' alez ', search.BACKEND_TRIGRAM)
+    compilada = consulta.statement.compile(dialect=postgresql.dialect())
+    assert 'persona.nombre ILIKE %(nombre_1)s' in str(compilada)
+    assert compilada.params['nombre_1'] == '%alez%'
+
+
+def test_recrea_el_indice_por_palabras(tmp_path):
+    engine = create_engine('sqlite:///' + str(tmp_path / 'antigua.db'))
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE persona (id INTEGER PRIMARY KEY, nombre TEXT)'))
+        conn.execute(text("INSERT INTO persona (nombre) VALUES ('Pedro Gonzalez')"))
+        conn.execute(text("""CREATE VIRTUAL TABLE persona_fts USING fts5(
+                                 nombre, content='persona', content_rowid='id',
+                                 tokenize='unicode61 remove_diacritics 2')"""))
+
+    assert search.setup_search_index(engine) == search.BACKEND_FTS5
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO persona (nombre) VALUES ('Ana Gómez')"))
+        filas = conn.execute(text("SELECT rowid FROM persona_fts WHERE persona_fts MATCH :q"),
+                             {'q': search.fts5_query('alez')}).all()
+        assert filas == [(1,)]
+        assert conn.execute(text("SELECT count(*) FROM persona_fts WHERE persona_fts MATCH :q"),
+                            {'q': search.fts5_query('ómez')}).scalar() == 1
+    engine.dispose()
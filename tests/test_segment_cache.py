@@ -0,0 +1,53 @@
+"""Caché de segmentos: escritura atómica con temporales únicos por hilo."""
+import os
+import threading
+
+import pytest
+
+import segment_cache
+import storage
+
+
+def test_temporales_distintos_por_hilo(tmp_path):
+    cache = segment_cache.SegmentCache(str(tmp_path))
+    clave = 'ab' * 20
+    rutas = []
+    listos = threading.Barrier(2)
+
+    def escribir(contenido):
+        with cache.writing(clave) as temporal:
+            rutas.append(temporal)
+            listos.wait()  # Los dos hilos escriben a la vez el mismo segmento
+            with open(temporal, 'wb') as f:
+                f.write(contenido)
+
+    hilos = [threading.Thread(target=escribir, args=(bytes([n]) * 10,)) for n in (1, 2)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert len(set(rutas)) == 2 and all(ruta.endswith('.mp4') for ruta in rutas)
+    with open(cache.get(clave), 'rb') as f:
+        assert f.read() in (b'\x01' * 10, b'\x02' * 10)
+    assert os.listdir(os.path.dirname(cache.path(clave))) == [f'{clave}.mp4']
+
+
+def test_fallo_no_publica_ni_deja_temporales(tmp_path):
+    cache = segment_cache.SegmentCache(str(tmp_path))
+    clave = 'cd' * 20
+    with pytest.raises(RuntimeError):
+        with cache.writing(clave) as temporal:
+            open(temporal, 'wb').close()
+            raise RuntimeError('codificación fallida')
+    assert cache.get(clave) is None
+    assert os.listdir(os.path.dirname(cache.path(clave))) == []
+
+
+def test_clave_depende_del_contenido(tmp_path):
+    a, b = tmp_path / 'a.jpg', tmp_path / 'b.jpg'
+    a.write_bytes(b'foto')
+    b.write_bytes(b'foto')
+    params = segment_cache.render_params((1280, 720), 'contain', 10, 24)
+    assert (segment_cache.segment_key(storage.file_digest(str(a)), params)
+            == segment_cache.segment_key(storage.file_digest(str(b)), params))
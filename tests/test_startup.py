@@ -0,0 +1,29 @@
+"""Arranque: importar la aplicación no crea carpetas ni abre la base de datos."""
+import os
+import subprocess
+import sys
+
+from conftest import RAIZ
+
+_SONDA = '''
+import os
+creadas = []
+_makedirs = os.makedirs
+os.makedirs = lambda *args, **kwargs: (creadas.append(args[0]), _makedirs(*args, **kwargs))
+import app
+assert creadas == [], creadas
+with app.app.app_context():
+    oyentes = len(app.db.engine.pool.dispatch.connect)  # Los del propio dialecto
+app.prepare_database()
+app.prepare_database()  # Idempotente: los PRAGMA se registran una sola vez
+with app.app.app_context():
+    assert len(app.db.engine.pool.dispatch.connect) == oyentes + 1
+print('ok')
+'''
+
+
+def test_importar_no_tiene_efectos(tmp_path):
+    entorno = {**os.environ, 'DATABASE_URL': f'sqlite:///{tmp_path}/arranque.db', 'LOG_LEVEL': 'WARNING'}
+    resultado = subprocess.run([sys.executable, '-c', _SONDA], cwd=RAIZ, env=entorno,
+                               capture_output=True, text=True, timeout=120)
+    assert resultado.stdout.strip() == 'ok', resultado.stderr
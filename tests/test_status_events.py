@@ -0,0 +1,55 @@
+"""Progreso en vivo por SSE: eventos al cambiar el estado y límite de conexiones por proceso."""
+import json
+
+import pytest
+
+import app as app_module
+from app import db, enqueue_video_job
+
+
+@pytest.fixture
+def en_cola(app, crear_persona, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_STATUS_POLL_SECONDS', 0.01)
+    monkeypatch.setitem(app.config, 'JOB_STATUS_STREAM_SECONDS', 1)
+    persona_id = crear_persona(images_uploaded=True, video_processing=True)
+    enqueue_video_job(persona_id)
+    db.session.commit()
+    return persona_id
+
+
+def _eventos(respuesta):
+    texto = respuesta.get_data(as_text=True)
+    return [json.loads(linea[len('data: '):]) for linea in texto.splitlines() if linea.startswith('data: ')]
+
+
+def test_flujo_envia_el_estado_y_cierra_al_vencer(client, en_cola):
+    respuesta = client.get(f'/status/{en_cola}/events')
+    assert respuesta.status_code == 200 and respuesta.mimetype == 'text/event-stream'
+    assert respuesta.headers['Cache-Control'] == 'no-cache'
+    eventos = _eventos(respuesta)
+    assert len(eventos) == 1 and eventos[0]['estado'] == 'queued'  # Sin cambios: un solo evento
+    assert respuesta.get_data(as_text=True).startswith('retry: ')
+    respuesta.close()
+    assert app_module._status_streams == 0
+
+
+def test_limite_de_conexiones_por_proceso(app, client, en_cola, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_STATUS_MAX_STREAMS', 1)
+    abierta = client.get(f'/status/{en_cola}/events')
+    assert abierta.status_code == 200 and app_module._status_streams == 1
+
+    rechazada = client.get(f'/status/{en_cola}/events')
+    assert rechazada.status_code == 503
+    assert rechazada.headers['Retry-After'] == '1'
+
+    abierta.close()  # El navegador corta la conexión: el hilo queda libre
+    assert app_module._status_streams == 0
+    otra = client.get(f'/status/{en_cola}/events')
+    assert otra.status_code == 200
+    otra.close()
+    assert app_module._status_streams == 0
+
+
+def test_persona_desconocida(client, en_cola):
+    assert client.get(f'/status/{en_cola + 1}/events').status_code == 404
+    assert app_module._status_streams == 0
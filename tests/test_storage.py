@@ -0,0 +1,70 @@
+"""Almacenamiento: qué cuenta como temporal en cada área y qué protege el barrido."""
+import os
+
+import pytest
+from werkzeug.utils import secure_filename
+
+import storage
+from app import Imagen, _manifest_guard, db, sweep_storage
+
+SUBIDAS_VALIDAS = ('resized_temp_abuela.jpg', 'abuela.jpg.part', 'foto.2024.tmp.jpg', 'foto.123.tmp.jpg')
+
+
+@pytest.mark.parametrize('nombre', SUBIDAS_VALIDAS)
+def test_fotos_subidas_no_son_temporales(nombre):
+    assert not storage.is_temp(nombre)
+    assert not storage.legacy_upload_temp(nombre, False)
+
+
+def test_prefijo_de_temporales_no_lo_produce_secure_filename(tmp_path):
+    temporal = os.path.basename(storage.temp_path(str(tmp_path / 'foto.jpg')))
+    assert storage.is_temp(temporal) and temporal.endswith('.jpg')
+    assert not secure_filename(temporal).startswith(storage.TEMP_PREFIX)
+
+
+def test_temporales_antiguos_solo_en_su_area():
+    assert storage.legacy_upload_temp('resized_temp', True)
+    assert storage.legacy_video_temp('temp_video_no_audio_3.mp4', False)
+    # Solo los nombres de la versión anterior: los videos definitivos nunca cuentan
+    assert not storage.legacy_video_temp('memorial_3_1700000000.mp4', False)
+    assert not storage.legacy_video_temp('memorial_3_1700000000.812.140.tmp.mp4', False)
+
+
+def test_cache_solo_barre_sus_temporales(tmp_path):
+    temporal = storage.temp_path(str(tmp_path / 'ab' / 'ab12.png'))
+    for ruta in (temporal, str(tmp_path / 'ab' / 'ab12.812.tmp.png')):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        open(ruta, 'wb').close()
+        _antiguo(ruta)
+    assert storage.stale_temp_entries(str(tmp_path), grace_seconds=60) == [temporal]
+
+
+def _antiguo(ruta):
+    os.utime(ruta, (1, 1))
+    return ruta
+
+
+def test_barrido_respeta_el_registro_de_imagenes(app, crear_persona):
+    persona_id = crear_persona(images_uploaded=True, images_indexed=True)
+    carpeta = os.path.join(app.config['UPLOAD_FOLDER'], str(persona_id))
+    os.makedirs(os.path.join(carpeta, 'resized_temp'))
+    for nombre in SUBIDAS_VALIDAS:
+        open(os.path.join(carpeta, nombre), 'wb').close()
+        db.session.add(Imagen(persona_id=persona_id, filename=nombre, original_path=f'uploads/{persona_id}/{nombre}'))
+    db.session.commit()
+    temporal = storage.temp_path(os.path.join(carpeta, 'nueva.jpg'))
+    open(temporal, 'wb').close()
+    for nombre in os.listdir(carpeta):
+        _antiguo(os.path.join(carpeta, nombre))
+
+    sweep_storage(grace_seconds=0)
+    assert sorted(os.listdir(carpeta)) == sorted(SUBIDAS_VALIDAS)
+
+
+def test_barrido_no_toca_rutas_registradas_aunque_parezcan_temporales(app, crear_persona):
+    persona_id = crear_persona(images_uploaded=True, images_indexed=True)
+    carpeta = os.path.join(app.config['UPLOAD_FOLDER'], str(persona_id))
+    registrada = os.path.join(carpeta, 'resized_temp')  # Una carpeta con el nombre antiguo, pero registrada
+    db.session.add(Imagen(persona_id=persona_id, filename='a.jpg', original_path=f'uploads/{persona_id}/resized_temp/a.jpg'))
+    db.session.commit()
+    assert _manifest_guard([registrada, os.path.join(carpeta, 'otra.jpg')]) == [os.path.join(carpeta, 'otra.jpg')]
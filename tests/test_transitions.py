@@ -0,0 +1,87 @@
+"""Estilos con efectos: duración del video, grafo de filtros y tarjeta de título."""
+import shutil
+from datetime import date
+
+import pytest
+
+import transitions
+import video_engine
+
+RESOLUCION = (64, 36)
+
+
+def _grafo(estilo, fotos=3, duracion=10, still_fps=None):
+    spec = transitions.effect_spec(estilo, duracion)
+    durations = transitions.clip_durations(spec, fotos, duracion)
+    titulo = 0 if spec['title_seconds'] else None
+    return spec, durations, transitions.build_filtergraph(durations, spec, RESOLUCION, title_index=titulo,
+                                                          still_fps=still_fps)
+
+
+def test_duracion_con_titulo_y_fundidos():
+    # Tarjeta de 4 s + 3 fotos de 10 s, con 3 fundidos cruzados de 1 s
+    spec, durations, _ = _grafo(transitions.STYLE_SOFT)
+    assert durations == [4, 10, 10, 10]
+    assert transitions.total_duration(spec, durations) == 31.0
+
+    clasico = transitions.effect_spec(transitions.STYLE_CLASSIC, 10)
+    assert not transitions.has_effects(clasico)
+    assert transitions.total_duration(clasico, transitions.clip_durations(clasico, 3, 10)) == 30
+
+
+def test_fundidos_nunca_ocupan_mas_de_media_foto():
+    spec = transitions.effect_spec(transitions.STYLE_MOTION, 1)
+    assert spec['crossfade'] == spec['fade'] == 0.5
+    assert transitions.effect_spec('desconocido', 10) == transitions.effect_spec(transitions.STYLE_CLASSIC, 10)
+
+
+def test_grafo_suave():
+    _, _, grafo = _grafo(transitions.STYLE_SOFT, still_fps=video_engine.FFMPEG_FPS)
+    assert grafo.count('xfade=') == 3
+    assert 'fade=t=in' in grafo and 'fade=t=out' in grafo
+    assert 'zoompan' not in grafo
+    assert grafo.endswith('format=yuv420p[vout]')
+    # Los tramos quietos bajan a la cadencia de una foto fija; los fundidos no
+    assert "select='not(mod(n\\,5))" in grafo and 'between(n\\,' in grafo
+
+
+def test_grafo_con_movimiento_sin_zoom_en_el_titulo():
+    _, _, grafo = _grafo(transitions.STYLE_MOTION, still_fps=video_engine.FFMPEG_FPS)
+    clips = [cadena for cadena in grafo.split(';') if cadena.startswith(tuple(f'[{i}:v]' for i in range(4)))]
+    assert len(clips) == 4
+    assert 'zoompan' not in clips[0] and all('zoompan' in clip for clip in clips[1:])
+    assert 'select=' not in grafo  # Con zoom todos los cuadros cambian
+
+
+def test_comando_con_efectos():
+    spec, durations, _ = _grafo(transitions.STYLE_SOFT)
+    comando = video_engine.build_effects_command([f'{i}.rgb' for i in range(4)], 'v.mp4', durations, spec,
+                                                 resolution=RESOLUCION, audio_path='stem.m4a', copy_audio=True,
+                                                 title_index=0)
+    assert comando[comando.index('-t') + 1] == '31.000'
+    assert comando[comando.index('-tune') + 1] == 'stillimage'
+    assert comando[comando.index('-map', comando.index('[vout]') + 1) + 1] == '4:a:0'  # Audio tras los clips
+
+    movimiento = transitions.effect_spec(transitions.STYLE_MOTION, 10)
+    comando = video_engine.build_effects_command(['0.rgb', '1.rgb'], 'v.mp4', [10, 10], movimiento,
+                                                 resolution=RESOLUCION)
+    assert '-tune' not in comando
+
+
+def test_tarjeta_de_titulo():
+    fechas = transitions.format_life_dates(date(1940, 5, 1), date(2020, 3, 1))
+    assert fechas == '1 de mayo de 1940 – 1 de marzo de 2020'  # Sin depender del locale
+    frame = transitions.render_title_card('María González', fechas, (320, 180))
+    assert len(frame) == 320 * 180 * 3 and any(frame)
+
+
+@pytest.mark.skipif(not shutil.which('ffmpeg'), reason='FFmpeg no está instalado')
+def test_codifica_con_efectos(tmp_path):
+    spec = transitions.effect_spec(transitions.STYLE_SOFT, 2)
+    cuadro = bytes(RESOLUCION[0] * RESOLUCION[1] * 3)
+    titulo = transitions.render_title_card('Ana', None, RESOLUCION)
+    total = video_engine.encode_slideshow_effects([cuadro, cuadro], str(tmp_path / 'v.mp4'), spec,
+                                                  duration_per_image=2, resolution=RESOLUCION, title_frame=titulo)
+    assert total == 4 + 2 + 2 - 2 * 1
+    assert (tmp_path / 'v.mp4').stat().st_size > 0
+    assert [p.name for p in tmp_path.iterdir()] == ['v.mp4']  # Sin carpetas temporales
@@ -0,0 +1,56 @@
+"""Subida de fotos: validación y derivados (miniaturas y masters) generados al subir."""
+import os
+from io import BytesIO
+
+from PIL import Image
+
+import image_pipeline
+from app import Imagen, Persona, db
+
+
+def _jpeg(tamano=(400, 300), color=(120, 90, 60)):
+    salida = BytesIO()
+    Image.new('RGB', tamano, color).save(salida, 'JPEG')
+    return salida.getvalue()
+
+
+def test_derivados_de_una_foto(tmp_path):
+    original = tmp_path / 'foto.jpg'
+    original.write_bytes(_jpeg((800, 600)))
+    rutas = [str(tmp_path / nombre) for nombre in ('t.webp', 't.jpg', 'm.jpg')]
+
+    info = image_pipeline.create_derivatives(str(original), *rutas, resolution=(320, 180), thumb_size=(100, 100))
+    assert info == {'width': 800, 'height': 600, 'thumb_width': 100, 'thumb_height': 75}
+    with Image.open(rutas[0]) as webp, Image.open(rutas[2]) as master:
+        assert webp.format == 'WEBP' and webp.size == (100, 75)
+        assert master.format == 'JPEG' and master.size == (320, 180)
+    assert sorted(os.listdir(tmp_path)) == ['foto.jpg', 'm.jpg', 't.jpg', 't.webp']
+
+
+def test_subida_registra_las_validas_y_descarta_las_demas(app, client, crear_persona):
+    persona_id = crear_persona()
+    archivos = [(BytesIO(_jpeg()), f'{n}.jpg') for n in 'abc'] + [(BytesIO(b'texto'), 'notas.jpg')]
+
+    respuesta = client.post(f'/upload_images/{persona_id}', data={'images': archivos},
+                            content_type='multipart/form-data')
+    assert respuesta.status_code == 302
+
+    persona = db.session.get(Persona, persona_id)
+    assert persona.images_uploaded and persona.images_indexed
+    imagenes = db.session.query(Imagen).filter_by(persona_id=persona_id).order_by(Imagen.posicion).all()
+    assert [imagen.filename for imagen in imagenes] == ['a.jpg', 'b.jpg', 'c.jpg']
+    for imagen in imagenes:
+        for ruta in (imagen.thumb_webp_path, imagen.thumb_jpeg_path, imagen.master_path):
+            assert os.path.isfile(os.path.join(app.static_folder, ruta))
+    carpeta = os.path.join(app.config['UPLOAD_FOLDER'], str(persona_id))
+    assert not os.path.exists(os.path.join(carpeta, 'notas.jpg'))
+
+
+def test_subida_sin_tres_validas_no_deja_nada(app, client, crear_persona):
+    persona_id = crear_persona()
+    archivos = [(BytesIO(_jpeg()), 'a.jpg'), (BytesIO(_jpeg()), 'b.jpg'), (BytesIO(b'texto'), 'c.jpg')]
+
+    client.post(f'/upload_images/{persona_id}', data={'images': archivos}, content_type='multipart/form-data')
+    assert not db.session.get(Persona, persona_id).images_uploaded
+    assert db.session.query(Imagen).count() == 0
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], str(persona_id)))
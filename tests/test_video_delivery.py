@@ -0,0 +1,54 @@
+"""Entrega de videos: rangos (206), ETag fuerte, revalidación (304) y caché inmutable."""
+import os
+
+import pytest
+
+CONTENIDO = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def video(app):
+    nombre = 'memorial_1_1700000000.mp4'
+    with open(os.path.join(app.config['VIDEO_FOLDER'], nombre), 'wb') as f:
+        f.write(CONTENIDO)
+    return f'/media/videos/{nombre}'
+
+
+def test_video_completo_cacheable_como_inmutable(client, video):
+    respuesta = client.get(video)
+    assert respuesta.status_code == 200 and respuesta.data == CONTENIDO
+    assert respuesta.mimetype == 'video/mp4'
+    assert respuesta.headers['Accept-Ranges'] == 'bytes'
+    assert respuesta.cache_control.public and respuesta.cache_control.immutable
+    assert respuesta.cache_control.max_age > 0
+    etag, debil = respuesta.get_etag()
+    assert etag and not debil
+
+
+def test_rango_parcial(client, video):
+    respuesta = client.get(video, headers={'Range': 'bytes=100-199'})
+    assert respuesta.status_code == 206
+    assert respuesta.data == CONTENIDO[100:200]
+    assert respuesta.headers['Content-Range'] == f'bytes 100-199/{len(CONTENIDO)}'
+
+    final = client.get(video, headers={'Range': 'bytes=-10'})
+    assert final.status_code == 206 and final.data == CONTENIDO[-10:]
+
+    fuera = client.get(video, headers={'Range': f'bytes={len(CONTENIDO)}-'})
+    assert fuera.status_code == 416
+
+
+def test_revalidacion_con_etag(client, video):
+    etag = client.get(video).headers['ETag']
+    assert client.get(video, headers={'If-None-Match': etag}).status_code == 304
+    # If-Range con un ETag que ya no coincide: se envía el video entero
+    otro = client.get(video, headers={'Range': 'bytes=0-9', 'If-Range': '"otro"'})
+    assert otro.status_code == 200 and otro.data == CONTENIDO
+
+
+def test_solo_sirve_videos_memoriales(client, app):
+    with open(os.path.join(app.config['VIDEO_FOLDER'], 'notas.txt'), 'w') as f:
+        f.write('privado')
+    assert client.get('/media/videos/notas.txt').status_code == 404
+    assert client.get('/media/videos/memorial_9_1.mp4').status_code == 404
+    assert client.get('/media/videos/../memorial_1_1.mp4').status_code == 404
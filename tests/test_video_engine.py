@@ -0,0 +1,80 @@
+"""Motor FFmpeg del slideshow: comandos de codificación y concatenación."""
+import shutil
+
+import pytest
+
+import video_engine
+
+RESOLUCION = (64, 36)
+CUADRO = bytes(64 * 36 * 3)
+
+
+def _valor(comando, opcion):
+    return comando[comando.index(opcion) + 1]
+
+
+def test_slideshow_un_cuadro_por_foto_con_stillimage():
+    comando = video_engine.build_ffmpeg_slideshow_command('salida.mp4', total_duration=30,
+                                                          resolution=RESOLUCION, duration_per_image=10)
+    assert _valor(comando, '-framerate') == '1/10'
+    assert _valor(comando, '-s') == '64x36'
+    assert _valor(comando, '-tune') == 'stillimage'
+    assert _valor(comando, '-g') == str(video_engine.FFMPEG_FPS * 10)
+    assert _valor(comando, '-force_key_frames') == 'expr:gte(t,n_forced*10)'
+    assert f'fps={video_engine.FFMPEG_FPS}' in _valor(comando, '-vf')
+    assert _valor(comando, '-t') == '30'
+    assert '-an' in comando and comando[-1] == 'salida.mp4'
+
+
+def test_slideshow_mezcla_el_audio_en_la_misma_pasada():
+    comando = video_engine.build_ffmpeg_slideshow_command('salida.mp4', total_duration=30,
+                                                          audio_path='musica.mp3')
+    # La música se repite hasta cubrir el video y se codifica a AAC
+    assert comando[comando.index('musica.mp3') - 3:comando.index('musica.mp3')] == ['-stream_loop', '-1', '-i']
+    assert _valor(comando, '-c:a') == 'aac' and '-an' not in comando
+
+    copia = video_engine.build_ffmpeg_slideshow_command('salida.mp4', total_duration=30,
+                                                        audio_path='stem.m4a', copy_audio=True)
+    assert '-stream_loop' not in copia and _valor(copia, '-c:a') == 'copy'
+
+
+def test_concat_copia_el_video_sin_recodificar():
+    comando = video_engine.build_concat_command('lista.txt', 'salida.mp4', 20, audio_path='stem.m4a',
+                                                copy_audio=True)
+    assert comando[comando.index('-f'):comando.index('-f') + 6] == ['-f', 'concat', '-safe', '0', '-i', 'lista.txt']
+    assert _valor(comando, '-c:v') == 'copy' and _valor(comando, '-c:a') == 'copy'
+    assert 'libx264' not in comando and _valor(comando, '-t') == '20'
+
+
+def test_cuadros_con_tamano_incorrecto(tmp_path):
+    with pytest.raises(ValueError):
+        video_engine.encode_slideshow('ffmpeg', [CUADRO[:-3]], str(tmp_path / 'v.mp4'), resolution=RESOLUCION)
+    with pytest.raises(ValueError):
+        video_engine.encode_slideshow('gpu', [CUADRO], str(tmp_path / 'v.mp4'), resolution=RESOLUCION)
+
+
+@pytest.mark.skipif(not shutil.which('ffmpeg'), reason='FFmpeg no está instalado')
+def test_codifica_con_ffmpeg(tmp_path):
+    salida = tmp_path / 'video.mp4'
+    avance = []
+    video_engine.encode_slideshow('ffmpeg', [CUADRO, CUADRO], str(salida), resolution=RESOLUCION,
+                                  duration_per_image=1, on_progress=avance.append)
+    assert salida.stat().st_size > 0
+    assert avance[-1] == 1.0
+
+
+def test_hls_stillimage_solo_para_el_slideshow_clasico():
+    clasico = video_engine.build_hls_command('v.mp4', 'hls', fps=video_engine.FFMPEG_FPS)
+    assert _valor(clasico, '-tune') == 'stillimage' and _valor(clasico, '-r') == str(video_engine.FFMPEG_FPS)
+
+    efectos = video_engine.build_hls_command('v.mp4', 'hls', fps=None, with_audio=False)
+    assert '-tune' not in efectos and _valor(efectos, '-fps_mode') == 'passthrough'
+    assert _valor(efectos, '-var_stream_map') == 'v:0 v:1 v:2'
+
+
+def test_hls_fotogramas_clave_alineados_en_todas_las_rendiciones():
+    comando = video_engine.build_hls_command('v.mp4', 'hls', segment_seconds=4)
+    assert _valor(comando, '-force_key_frames') == 'expr:gte(t,n_forced*4)'
+    assert _valor(comando, '-sc_threshold') == '0'
+    assert _valor(comando, '-var_stream_map') == 'v:0,a:0 v:1,a:1 v:2,a:2'
+    assert [_valor(comando, f'-maxrate:v:{i}') for i in range(3)] == [r for _, _, r in video_engine.HLS_LADDER]
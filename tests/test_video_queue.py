@@ -0,0 +1,103 @@
+"""Cola persistente de trabajos de video: orden de reclamo, reintentos y reencolado."""
+from datetime import timedelta
+
+import admission
+from app import (JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, Persona, VideoJob, _utcnow, claim_next_video_job,
+                 complete_video_job, db, enqueue_video_job, fail_video_job, requeue_stale_video_jobs)
+
+
+def _encolar(persona_id, lane=admission.LANE_PUBLIC):
+    job = enqueue_video_job(persona_id, lane=lane)
+    db.session.commit()
+    return job.id
+
+
+def test_reclamo_por_prioridad_y_llegada(crear_persona):
+    publica_1 = _encolar(crear_persona())
+    publica_2 = _encolar(crear_persona())
+    admin = _encolar(crear_persona(), lane=admission.LANE_ADMIN)
+
+    reclamados = [claim_next_video_job('w1').id for _ in range(3)]
+    assert reclamados == [admin, publica_1, publica_2]
+    assert claim_next_video_job('w1') is None
+
+
+def test_un_trabajo_solo_se_reclama_una_vez(crear_persona):
+    job_id = _encolar(crear_persona())
+    job = claim_next_video_job('w1')
+    assert job.id == job_id and job.status == JOB_RUNNING and job.worker_id == 'w1' and job.attempts == 1
+    assert claim_next_video_job('w2') is None
+
+
+def test_fallo_reprograma_y_luego_agota_intentos(app, crear_persona, monkeypatch):
+    monkeypatch.setitem(app.config, 'VIDEO_JOB_MAX_ATTEMPTS', 2)
+    persona_id = crear_persona(images_uploaded=True, video_processing=True)
+    job_id = _encolar(persona_id)
+
+    job = claim_next_video_job('w1')
+    fail_video_job(job, 'error de prueba', 'w1')
+    job = db.session.get(VideoJob, job_id)
+    assert job.status == JOB_QUEUED and job.available_at > _utcnow()
+
+    job.available_at = _utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    job = claim_next_video_job('w1')
+    fail_video_job(job, 'error de prueba', 'w1')
+    job = db.session.get(VideoJob, job_id)
+    assert job.status == JOB_FAILED and job.attempts == 2
+    assert db.session.get(Persona, persona_id).video_processing is False
+
+
+def test_reencola_trabajos_sin_latido(app, crear_persona):
+    job_id = _encolar(crear_persona(video_processing=True))
+    job = claim_next_video_job('w1')
+    job.heartbeat_at = _utcnow() - timedelta(seconds=app.config['VIDEO_JOB_STALE_SECONDS'] + 1)
+    db.session.commit()
+
+    assert requeue_stale_video_jobs() == 1
+    job = db.session.get(VideoJob, job_id)
+    assert job.status == JOB_QUEUED and job.worker_id is None
+
+
+def _reencolar_por_latido(app, job_id):
+    job = db.session.get(VideoJob, job_id)
+    job.heartbeat_at = _utcnow() - timedelta(seconds=app.config['VIDEO_JOB_STALE_SECONDS'] + 1)
+    db.session.commit()
+    requeue_stale_video_jobs()
+
+
+def test_trabajador_lento_no_completa_un_trabajo_reencolado(app, crear_persona):
+    persona_id = crear_persona(images_uploaded=True, video_processing=True)
+    job_id = _encolar(persona_id)
+    lento = claim_next_video_job('lento')
+    _reencolar_por_latido(app, job_id)
+    db.session.get(VideoJob, job_id).available_at = _utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert claim_next_video_job('rapido').id == job_id
+
+    # El trabajador lento termina su render: ni el trabajo ni la persona cambian
+    persona = db.session.get(Persona, persona_id)
+    persona.video_path = 'videos/memorial_lento.mp4'
+    persona.video_processing = False
+    assert complete_video_job(lento, 'lento') is False
+    job = db.session.get(VideoJob, job_id)
+    assert job.status == JOB_RUNNING and job.worker_id == 'rapido'
+    persona = db.session.get(Persona, persona_id)
+    assert persona.video_path is None and persona.video_processing is True
+
+    assert fail_video_job(lento, 'error tardío', 'lento') is False
+    assert db.session.get(VideoJob, job_id).status == JOB_RUNNING
+
+    assert complete_video_job(db.session.get(VideoJob, job_id), 'rapido', output_bytes=123) is True
+    job = db.session.get(VideoJob, job_id)
+    assert job.status == JOB_DONE and job.output_bytes == 123 and job.progress == 100
+
+
+def test_reencolado_respeta_un_latido_reciente(app, crear_persona):
+    """Si el trabajador envía un latido entre la lectura y el reencolado, el trabajo sigue siendo suyo."""
+    job_id = _encolar(crear_persona(video_processing=True))
+    job = claim_next_video_job('w1')
+    db.session.execute(VideoJob.__table__.update().where(VideoJob.id == job_id).values(worker_id='w2'))
+    db.session.commit()
+    assert fail_video_job(job, 'sin latido', 'w1') is False
+    assert db.session.get(VideoJob, job_id).status == JOB_RUNNING
@@ -0,0 +1,59 @@
+"""Página pública: las fotos antiguas se listan sin registrarlas durante la visita."""
+import os
+
+import pytest
+
+import app as app_module
+from app import Imagen, Persona, backfill_image_manifests, db
+
+
+@pytest.fixture
+def persona_antigua(app, crear_persona):
+    """Persona anterior a la tabla Imagen: fotos en su carpeta de subidas y sin registrar."""
+    def _crear(fotos):
+        persona_id = crear_persona(images_uploaded=True)
+        carpeta = os.path.join(app.config['UPLOAD_FOLDER'], str(persona_id))
+        os.makedirs(carpeta, exist_ok=True)
+        for nombre, contenido in fotos.items():
+            with open(os.path.join(carpeta, nombre), 'wb') as f:
+                f.write(contenido)
+        return persona_id
+    return _crear
+
+
+def _jpeg():
+    from io import BytesIO
+    from PIL import Image
+    salida = BytesIO()
+    Image.new('RGB', (64, 48), (120, 90, 60)).save(salida, 'JPEG')
+    return salida.getvalue()
+
+
+def test_la_visita_lista_la_carpeta_sin_registrar(client, persona_antigua, monkeypatch):
+    persona_id = persona_antigua({'b.jpg': _jpeg(), 'a.jpg': _jpeg()})
+    monkeypatch.setattr(app_module, 'ingest_person_images',
+                        lambda *args: pytest.fail('la página pública no debe generar derivados'))
+
+    html = client.get(f'/view/{persona_id}').get_data(as_text=True)
+    assert html.index(f'uploads/{persona_id}/a.jpg') < html.index(f'uploads/{persona_id}/b.jpg')
+    assert db.session.query(Imagen).count() == 0
+
+
+def test_registro_de_fotos_antiguas(client, persona_antigua):
+    persona_id = persona_antigua({'a.jpg': _jpeg(), 'b.jpg': _jpeg(), 'c.jpg': _jpeg()})
+
+    assert backfill_image_manifests() == 1
+    assert db.session.query(Imagen).filter_by(persona_id=persona_id).count() == 3
+    assert db.session.get(Persona, persona_id).images_indexed is True
+    html = client.get(f'/view/{persona_id}').get_data(as_text=True)
+    assert f'uploads/{persona_id}/thumbs/00.webp' in html
+    assert backfill_image_manifests() == 0
+
+
+def test_carpeta_sin_fotos_validas_se_marca_una_vez(persona_antigua):
+    persona_id = persona_antigua({'notas.txt': b'no es una imagen'})
+
+    assert backfill_image_manifests() == 1
+    persona = db.session.get(Persona, persona_id)
+    assert persona.images_indexed is True and persona.imagenes == []
+    assert backfill_image_manifests() == 0
@@ -0,0 +1,215 @@
+"""
+Transiciones y movimiento del video memorial en un único grafo de filtros de FFmpeg.
+
+Cada memorial tiene un estilo (columna `Persona.video_style`) que se traduce a una
+especificación de efectos:
+
+- 'clasico': cortes directos entre fotos, el render de siempre (con caché de segmentos);
+- 'suave': fundido encadenado entre fotos, entrada y salida desde negro y una tarjeta de
+  título con el nombre y las fechas de la persona;
+- 'movimiento': lo mismo con un zoom lento sobre cada foto (efecto Ken Burns).
+
+`build_filtergraph` compila la especificación a un `-filter_complex`: cada foto entra
+como un único cuadro, se repite (`loop`) o se anima (`zoompan`) durante su duración y
+los fundidos (`xfade`, `fade`) se aplican solo a los tramos de un segundo donde ocurren.
+Todo lo hace FFmpeg en una sola pasada por CPU, sin generar cuadros en Python.
+
+Los fundidos cruzan los límites entre fotos, así que un video con efectos no se puede
+montar a partir de segmentos por foto: se codifica entero en cada render.
+"""
+import os
+
+STYLE_CLASSIC = 'clasico'
+STYLE_SOFT = 'suave'
+STYLE_MOTION = 'movimiento'
+
+# Efectos de cada estilo (segundos; 'zoom' es el aumento máximo, 0.1 = 10 %)
+STYLES = {
+    STYLE_CLASSIC: {'titulo': 'Clásico (cortes directos)',
+                    'crossfade': 0, 'fade': 0, 'zoom': 0, 'title_seconds': 0},
+    STYLE_SOFT: {'titulo': 'Suave (fundidos y título)',
+                 'crossfade': 1.0, 'fade': 1.0, 'zoom': 0, 'title_seconds': 4},
+    STYLE_MOTION: {'titulo': 'Movimiento (fundidos, título y zoom lento)',
+                   'crossfade': 1.0, 'fade': 1.0, 'zoom': 0.1, 'title_seconds': 4},
+}
+EFFECTS_FPS = 25  # El movimiento y los fundidos necesitan más cuadros que una foto fija
+
+MESES = ('enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio',
+         'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre')
+
+# Fuentes para la tarjeta de título: DejaVu Serif donde la instalan los paquetes de Debian
+# (Render) y de otras distribuciones. VIDEO_TITLE_FONT tiene prioridad; sin ninguna, la de Pillow.
+TITLE_FONTS = (
+    '/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSerif.ttf',
+)
+
+
+def effect_spec(style, duration_per_image):
+    """
+    Especificación de efectos de un estilo, ajustada a la duración de cada foto
+    (un fundido nunca ocupa más de la mitad de una foto). Estilo desconocido = clásico.
+    """
+    spec = dict(STYLES.get(style) or STYLES[STYLE_CLASSIC])
+    spec.pop('titulo')
+    limite = duration_per_image / 2
+    spec['crossfade'] = min(spec['crossfade'], limite)
+    spec['fade'] = min(spec['fade'], limite)
+    return spec
+
+
+def has_effects(spec):
+    return any(spec[clave] for clave in ('crossfade', 'fade', 'zoom', 'title_seconds'))
+
+
+def clip_durations(spec, image_count, duration_per_image):
+    """Duración de cada clip del video: la tarjeta de título (si hay) y una por foto."""
+    durations = [duration_per_image] * image_count
+    if spec['title_seconds'] and image_count:
+        durations.insert(0, spec['title_seconds'])
+    return durations
+
+
+def total_duration(spec, durations):
+    """Duración del video: los fundidos cruzados solapan cada par de clips consecutivos."""
+    return sum(durations) - spec['crossfade'] * max(len(durations) - 1, 0)
+
+
+def _clip_filter(indice, cuadros, resolution, fps, zoom):
+    """Cadena de filtros de un clip: un cuadro de entrada convertido en `cuadros` cuadros."""
+    width, height = resolution
+    if zoom:
+        # Alternar acercar y alejar; el cuadro se amplía antes para que el encuadre no tiemble
+        avance = f'{zoom}*on/{cuadros}'
+        z = f'1+{avance}' if indice % 2 == 0 else f'{1 + zoom}-{avance}'
+        cadena = (f'scale={width * 2}:{height * 2},'
+                  f"zoompan=z='{z}':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)'"
+                  f':d={cuadros}:s={width}x{height}:fps={fps}')
+    else:
+        # Los cuadros repetidos son referencias al mismo: repetir no cuesta nada
+        cadena = f'loop=loop={cuadros - 1}:size=1:start=0,setpts=N/{fps}/TB'
+    # Convertir a YUV una sola vez, antes de repetir el cuadro
+    return f'[{indice}:v]format=yuv420p,{cadena},setsar=1,fps={fps}'
+
+
+def _trim(origen, inicio, fin, fps, destino):
+    # `setpts` olvida la cadencia y `xfade` la exige constante: `fps` la vuelve a declarar
+    return f'{origen}trim=start_frame={inicio}:end_frame={fin},setpts=PTS-STARTPTS,fps={fps}{destino}'
+
+
+def build_filtergraph(durations, spec, resolution, fps=EFFECTS_FPS, title_index=None, still_fps=None):
+    """
+    Grafo de filtros (`-filter_complex`) que monta el video a partir de una entrada de un
+    solo cuadro por clip. `title_index` es el clip de la tarjeta de título (sin zoom).
+    La salida es la etiqueta [vout].
+
+    `xfade` y `fade` procesan (y copian) cada cuadro que les pasa, así que no se aplican
+    al video entero: cada clip se parte en cabeza, cuerpo y cola, los fundidos se hacen
+    solo sobre las cabezas y colas de un segundo y todo se une con `concat`. Si no hay
+    zoom, con `still_fps` los tramos quietos se quedan en esa cadencia (salida de
+    cadencia variable): el codificador solo recibe a `fps` los cuadros que cambian.
+    """
+    n = len(durations)
+    cuadros = [max(1, round(duracion * fps)) for duracion in durations]
+    xfade = round(spec['crossfade'] * fps) if n > 1 else 0
+    fade = round(spec['fade'] * fps)
+
+    filtros, piezas, movimiento = [], [], []
+    inicio_salida = 0
+    for i in range(n):
+        cabeza = fade if i == 0 else xfade
+        cola = fade if i == n - 1 else xfade
+        cuerpo = cuadros[i] - cabeza - cola
+        partes = [nombre for nombre, largo in (('h', cabeza), ('b', cuerpo), ('t', cola)) if largo > 0]
+        zoom = 0 if i == title_index else spec['zoom']
+        clip = _clip_filter(i, cuadros[i], resolution, fps, zoom)
+        if len(partes) > 1:
+            filtros.append(f'{clip},split={len(partes)}' + ''.join(f'[{p}{i}]' for p in partes))
+        else:
+            filtros.append(f'{clip}[{partes[0]}{i}]')
+        if cabeza:
+            filtros.append(_trim(f'[h{i}]', 0, cabeza, fps, f'[hc{i}]'))
+        if cuerpo > 0:
+            filtros.append(_trim(f'[b{i}]', cabeza, cabeza + cuerpo, fps, f'[bc{i}]'))
+        if cola:
+            filtros.append(_trim(f'[t{i}]', cuadros[i] - cola, cuadros[i], fps, f'[tc{i}]'))
+
+        if i == 0 and fade:
+            filtros.append(f'[hc0]fade=t=in:s=0:n={fade}[p0h]')
+            piezas.append('[p0h]')
+            movimiento.append((0, fade))
+        elif i > 0 and xfade:
+            filtros.append(f'[tc{i - 1}][hc{i}]xfade=transition=fade:duration={xfade / fps}:offset=0[p{i}x]')
+            piezas.append(f'[p{i}x]')
+            movimiento.append((inicio_salida, inicio_salida + xfade))
+        inicio_salida += cabeza
+        if cuerpo > 0:
+            piezas.append(f'[bc{i}]')
+            inicio_salida += cuerpo
+        if i == n - 1 and fade:
+            filtros.append(f'[tc{i}]fade=t=out:s=0:n={fade}[p{i}f]')
+            piezas.append(f'[p{i}f]')
+            movimiento.append((inicio_salida, inicio_salida + fade))
+            inicio_salida += fade
+
+    final = [f'concat=n={len(piezas)}:v=1:a=0'] if len(piezas) > 1 else ['null']
+    if still_fps and not spec['zoom'] and fps > still_fps:
+        # Cuadros quietos: uno de cada `paso`; fundidos y último cuadro: todos
+        paso = max(1, round(fps / still_fps))
+        condiciones = [f'not(mod(n\\,{paso}))', f'gte(n\\,{inicio_salida - 1})']
+        condiciones += [f'between(n\\,{a}\\,{b})' for a, b in movimiento]
+        final.append(f"select='{'+'.join(condiciones)}'")
+    final.append('format=yuv420p')
+    filtros.append(''.join(piezas) + ','.join(final) + '[vout]')
+    return ';'.join(filtros)
+
+
+def format_life_dates(nacimiento, muerte):
+    """Fechas de nacimiento y fallecimiento en español, sin depender del locale del sistema."""
+    def _fecha(fecha):
+        return f'{fecha.day} de {MESES[fecha.month - 1]} de {fecha.year}'
+    return f'{_fecha(nacimiento)} – {_fecha(muerte)}'
+
+
+def _title_font(size, font_path=None):
+    from PIL import ImageFont
+    for candidata in (font_path,) + TITLE_FONTS:
+        if candidata and os.path.exists(candidata):
+            return ImageFont.truetype(candidata, size)
+    return ImageFont.load_default(size)
+
+
+def _wrap(draw, texto, font, max_width):
+    """Parte `texto` en líneas que quepan en `max_width` píxeles."""
+    lineas, actual = [], ''
+    for palabra in texto.split():
+        prueba = f'{actual} {palabra}'.strip()
+        if actual and draw.textlength(prueba, font=font) > max_width:
+            lineas.append(actual)
+            actual = palabra
+        else:
+            actual = prueba
+    if actual:
+        lineas.append(actual)
+    return lineas
+
+
+def render_title_card(nombre, subtitulo, resolution, font_path=None):
+    """Tarjeta de título (nombre y fechas centrados sobre fondo oscuro) como cuadro RGB24."""
+    from PIL import Image, ImageDraw
+    width, height = resolution
+    img = Image.new('RGB', resolution, (12, 12, 16))
+    draw = ImageDraw.Draw(img)
+    fuente_nombre = _title_font(max(12, height // 12), font_path)
+    fuente_fechas = _title_font(max(10, height // 28), font_path)
+
+    lineas = [(linea, fuente_nombre, (245, 245, 245)) for linea in _wrap(draw, nombre, fuente_nombre, width * 0.85)]
+    if subtitulo:
+        lineas.append((subtitulo, fuente_fechas, (190, 190, 190)))
+    separacion = height // 40
+    altos = [draw.textbbox((0, 0), texto, font=fuente)[3] for texto, fuente, _ in lineas]
+    y = (height - sum(altos) - separacion * (len(lineas) - 1)) / 2
+    for (texto, fuente, color), alto in zip(lineas, altos):
+        draw.text((width / 2, y), texto, font=fuente, fill=color, anchor='ma')
+        y += alto + separacion
+    return img.tobytes()
@@ -0,0 +1,441 @@
+"""
+Motores de codificación del video memorial.
+
+Ambos motores reciben los cuadros ya preprocesados (RGB24 en memoria, ver
+`image_pipeline`). El motor por defecto ('ffmpeg') construye el slideshow en una
+sola invocación de FFmpeg: los cuadros entran por stdin como video crudo a un
+cuadro por foto, se codifican con `-tune stillimage` a una tasa de cuadros baja
+y el audio se mezcla en la misma pasada. El motor 'moviepy' se conserva como
+alternativa seleccionable con VIDEO_BACKEND=moviepy.
+
+Con `copy_audio=True`, `audio_path` es un stem AAC ya preparado con la duración
+exacta del video (ver `music_library`) y se copia sin recodificar.
+
+Los estilos con transiciones y movimiento (ver `transitions`) solo existen en el motor
+'ffmpeg': `encode_slideshow_effects` monta el video con un único grafo de filtros.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import storage
+import transitions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESOLUTION = (1280, 720)
+DEFAULT_DURATION_PER_IMAGE = 10  # segundos por imagen
+FFMPEG_FPS = 5                   # una foto fija no necesita 24 fps
+MOVIEPY_FPS = 24
+
+
+def _check_frames(frames, resolution):
+    """Verifica que todos los cuadros tengan el tamaño RGB24 esperado."""
+    width, height = resolution
+    esperado = width * height * 3
+    for i, frame in enumerate(frames):
+        if len(frame) != esperado:
+            raise ValueError(f"El cuadro {i} no mide {width}x{height} RGB24 ({len(frame)} bytes).")
+
+
+def _read_progress(stream, total_duration, on_progress):
+    """
+    Lee la salida de `-progress` de FFmpeg (líneas clave=valor) y llama a
+    `on_progress(fracción)` con el tiempo codificado respecto a la duración total.
+    """
+    for linea in stream:
+        clave, _, valor = linea.decode('ascii', 'ignore').strip().partition('=')
+        # out_time_ms también va en microsegundos (nombre histórico de FFmpeg)
+        if clave in ('out_time_us', 'out_time_ms') and valor.isdigit() and total_duration:
+            on_progress(min(int(valor) / 1_000_000 / total_duration, 1.0))
+
+
+def run_ffmpeg(comando, total_duration=None, on_progress=None, frames=None):
+    """
+    Ejecuta un comando FFmpeg. Si se pasa `on_progress`, informa del avance (0 a 1)
+    leyendo `-progress` por stdout; si se pasan `frames`, los escribe por stdin.
+    """
+    if on_progress:
+        comando = [comando[0], '-progress', 'pipe:1', '-nostats'] + comando[1:]
+    proceso = subprocess.Popen(comando,
+                               stdin=subprocess.PIPE if frames is not None else subprocess.DEVNULL,
+                               stdout=subprocess.PIPE if on_progress else None)
+    lector = None
+    if on_progress:
+        lector = threading.Thread(target=_read_progress, args=(proceso.stdout, total_duration, on_progress),
+                                  daemon=True)
+        lector.start()
+    try:
+        if frames is not None:
+            try:
+                for frame in frames:
+                    proceso.stdin.write(frame)
+                proceso.stdin.close()
+            except BrokenPipeError:
+                pass  # FFmpeg terminó antes de tiempo; el código de salida indica el error
+    finally:
+        returncode = proceso.wait()
+        if lector:
+            lector.join()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, comando)
+    if on_progress:
+        on_progress(1.0)
+
+
+def _audio_input(audio_path, copy_audio):
+    """Argumentos de entrada del audio (segunda entrada del comando)."""
+    if not audio_path:
+        return []
+    if copy_audio:
+        return ['-i', audio_path]  # El stem ya dura lo mismo que el video
+    # Repetir la música si es más corta que el video; -t recorta al final
+    return ['-stream_loop', '-1', '-i', audio_path]
+
+
+def _audio_output(audio_path, copy_audio, input_index=1):
+    """Argumentos de salida del audio: copia del stem, codificación a AAC o sin audio."""
+    if not audio_path:
+        return ['-an']
+    if copy_audio:
+        return ['-map', f'{input_index}:a:0', '-c:a', 'copy']
+    return ['-map', f'{input_index}:a:0', '-c:a', 'aac', '-b:a', '128k']
+
+
+def build_ffmpeg_slideshow_command(output_path, total_duration,
+                                   resolution=DEFAULT_RESOLUTION, fps=FFMPEG_FPS,
+                                   duration_per_image=DEFAULT_DURATION_PER_IMAGE,
+                                   audio_path=None, ffmpeg_bin='ffmpeg', copy_audio=False):
+    """Construye el comando FFmpeg que genera el slideshow (y mezcla el audio) en una pasada."""
+    width, height = resolution
+    comando = [
+        ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-y',
+        # Video crudo por stdin: un cuadro por foto, cada uno dura duration_per_image segundos
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+        '-framerate', f'1/{duration_per_image}', '-i', 'pipe:0',
+    ]
+    comando += _audio_input(audio_path, copy_audio)
+
+    comando += [
+        '-vf', f'setsar=1,fps={fps},format=yuv420p',
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-tune', 'stillimage',     # Optimizado para imágenes fijas
+        '-crf', '23',
+        # Un fotograma clave al inicio de cada foto: buscar cae justo en una imagen
+        # y el resto de la foto son cuadros P casi vacíos.
+        '-g', str(fps * duration_per_image),
+        '-force_key_frames', f'expr:gte(t,n_forced*{duration_per_image})',
+        '-map', '0:v:0',
+    ]
+    comando += _audio_output(audio_path, copy_audio)
+
+    comando += [
+        '-t', str(total_duration),
+        '-movflags', '+faststart',  # El índice al inicio: el navegador reproduce sin esperar la descarga completa
+        output_path,
+    ]
+    return comando
+
+
+def encode_slideshow_ffmpeg(frames, output_path, duration_per_image=DEFAULT_DURATION_PER_IMAGE,
+                            resolution=DEFAULT_RESOLUTION, audio_path=None, ffmpeg_bin='ffmpeg',
+                            on_progress=None, copy_audio=False):
+    """Genera el video con una sola invocación de FFmpeg, enviando los cuadros por stdin."""
+    total_duration = duration_per_image * len(frames)
+    comando = build_ffmpeg_slideshow_command(
+        output_path,
+        total_duration=total_duration,
+        resolution=resolution, duration_per_image=duration_per_image,
+        audio_path=audio_path, ffmpeg_bin=ffmpeg_bin, copy_audio=copy_audio,
+    )
+    logger.info("⚙️ Codificando slideshow con FFmpeg (%d imágenes)...", len(frames))
+    run_ffmpeg(comando, total_duration, on_progress, frames=frames)
+
+
+def encode_slideshow_moviepy(frames, output_path, duration_per_image=DEFAULT_DURATION_PER_IMAGE,
+                             resolution=DEFAULT_RESOLUTION, audio_path=None, ffmpeg_bin='ffmpeg',
+                             on_progress=None, copy_audio=False):
+    """
+    Motor alternativo: genera los fotogramas con MoviePy y añade el audio con un
+    segundo proceso de FFmpeg. Es más lento y usa más memoria que el motor nativo.
+    Solo informa del avance al terminar cada paso.
+    """
+    import numpy as np
+    from moviepy import ImageSequenceClip  # Importación diferida: solo se usa en este motor
+
+    video_sin_audio_path = None
+    try:
+        destino_clip = output_path
+        if audio_path:
+            # Nombre temporal reconocible: si el proceso muere, el barrido de almacenamiento lo recoge
+            video_sin_audio_path = storage.temp_path(output_path)
+            destino_clip = video_sin_audio_path
+
+        logger.info("⚙️ Creando clip de video con MoviePy...")
+        width, height = resolution
+        arrays = [np.frombuffer(frame, dtype=np.uint8).reshape(height, width, 3) for frame in frames]
+        clip_imagenes = ImageSequenceClip(arrays, durations=[duration_per_image] * len(arrays))
+        try:
+            clip_imagenes.write_videofile(destino_clip, fps=MOVIEPY_FPS, audio=False, logger=None)
+        finally:
+            clip_imagenes.close()  # Liberar recursos del clip
+        if on_progress:
+            on_progress(0.9)
+
+        if audio_path:
+            logger.info("🔊 Añadiendo audio con FFmpeg...")
+            comando_combinar = [
+                ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-y',
+                '-i', video_sin_audio_path,
+                '-i', audio_path,
+                '-c:v', 'copy',          # Copiar video sin recodificar
+                # Copiar el stem AAC o, con una pista sin preparar, codificarla a AAC
+                '-c:a', 'copy' if copy_audio else 'aac',
+                '-map', '0:v:0',
+                '-map', '1:a:0',
+                '-shortest',
+                '-movflags', '+faststart',
+                output_path,
+            ]
+            subprocess.run(comando_combinar, check=True)
+        if on_progress:
+            on_progress(1.0)
+    finally:
+        if video_sin_audio_path and os.path.exists(video_sin_audio_path):
+            os.remove(video_sin_audio_path)
+
+
+BACKENDS = {
+    'ffmpeg': encode_slideshow_ffmpeg,
+    'moviepy': encode_slideshow_moviepy,
+}
+
+
+def encode_slideshow(backend, frames, output_path, resolution=DEFAULT_RESOLUTION, **kwargs):
+    """Codifica los cuadros RGB24 con el motor indicado ('ffmpeg' o 'moviepy')."""
+    try:
+        encoder = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Motor de video desconocido: {backend!r}. Opciones: {', '.join(BACKENDS)}")
+    if not frames:
+        raise ValueError("No hay imágenes para codificar.")
+    _check_frames(frames, resolution)
+    encoder(frames, output_path, resolution=resolution, **kwargs)
+
+
+# --- TRANSICIONES Y MOVIMIENTO (UN SOLO GRAFO DE FILTROS) ---
+
+def build_effects_command(input_paths, output_path, durations, spec, resolution=DEFAULT_RESOLUTION,
+                          fps=None, audio_path=None, ffmpeg_bin='ffmpeg', copy_audio=False, title_index=None):
+    """
+    Comando FFmpeg que monta el video con efectos (ver `transitions`) en una pasada.
+    Cada entrada de `input_paths` es un archivo con un único cuadro RGB24.
+    """
+    fps = fps or transitions.EFFECTS_FPS
+    width, height = resolution
+    comando = [ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-y']
+    for path in input_paths:
+        comando += ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+                    '-framerate', str(fps), '-i', path]
+    comando += _audio_input(audio_path, copy_audio)  # Última entrada, detrás de los clips
+    comando += [
+        '-filter_complex', transitions.build_filtergraph(durations, spec, resolution, fps=fps,
+                                                         title_index=title_index, still_fps=FFMPEG_FPS),
+        '-map', '[vout]',
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-crf', '23',
+        # Un cuadro clave cada 5 s de video, sea cual sea la cadencia del tramo
+        '-force_key_frames', 'expr:gte(t,n_forced*5)',
+    ]
+    if not spec['zoom']:
+        # Entre fundidos la imagen está quieta: esos tramos salen a FFMPEG_FPS (cadencia variable)
+        comando += ['-tune', 'stillimage', '-fps_mode', 'vfr']
+    comando += _audio_output(audio_path, copy_audio, input_index=len(input_paths))
+    comando += [
+        '-t', f'{transitions.total_duration(spec, durations):.3f}',
+        '-movflags', '+faststart',
+        output_path,
+    ]
+    return comando
+
+
+def encode_slideshow_effects(frames, output_path, spec, duration_per_image=DEFAULT_DURATION_PER_IMAGE,
+                             resolution=DEFAULT_RESOLUTION, title_frame=None, audio_path=None,
+                             ffmpeg_bin='ffmpeg', on_progress=None, copy_audio=False):
+    """
+    Genera el video con transiciones, movimiento y tarjeta de título (si `title_frame`).
+    Cada cuadro se escribe en un archivo temporal para que FFmpeg lo lea como entrada
+    propia y solo cargue en memoria los clips que está mezclando.
+    Devuelve la duración del video en segundos.
+    """
+    _check_frames(frames + ([title_frame] if title_frame else []), resolution)
+    if not spec['title_seconds']:
+        title_frame = None
+    clips = ([title_frame] if title_frame else []) + list(frames)
+    durations = ([spec['title_seconds']] if title_frame else []) + [duration_per_image] * len(frames)
+    total = transitions.total_duration(spec, durations)
+
+    carpeta = tempfile.mkdtemp(prefix=f'{storage.TEMP_PREFIX}memorial_clips_{os.getpid()}_',
+                               dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        rutas = []
+        for i, frame in enumerate(clips):
+            ruta = os.path.join(carpeta, f'{i:04d}.rgb')
+            with open(ruta, 'wb') as f:
+                f.write(frame)
+            rutas.append(ruta)
+        comando = build_effects_command(rutas, output_path, durations, spec, resolution=resolution,
+                                        audio_path=audio_path, ffmpeg_bin=ffmpeg_bin, copy_audio=copy_audio,
+                                        title_index=0 if title_frame else None)
+        logger.info("✨ Codificando slideshow con efectos (%d clips, %.1fs)...", len(clips), total)
+        run_ffmpeg(comando, total, on_progress)
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+    return total
+
+
+# --- SEGMENTOS POR IMAGEN (RENDER INCREMENTAL) ---
+
+def encode_segment(frame, output_path, duration=DEFAULT_DURATION_PER_IMAGE,
+                   resolution=DEFAULT_RESOLUTION, ffmpeg_bin='ffmpeg'):
+    """
+    Codifica una sola foto como segmento sin audio. Usa exactamente los mismos ajustes
+    que el slideshow completo, así que los segmentos se pueden concatenar sin recodificar.
+    """
+    _check_frames([frame], resolution)
+    comando = build_ffmpeg_slideshow_command(output_path, total_duration=duration, resolution=resolution,
+                                             duration_per_image=duration, ffmpeg_bin=ffmpeg_bin)
+    run_ffmpeg(comando, frames=[frame])
+
+
+def build_concat_command(list_path, output_path, total_duration, audio_path=None, ffmpeg_bin='ffmpeg',
+                         copy_audio=False):
+    """Comando que une los segmentos de `list_path` copiando el video y mezcla el audio."""
+    comando = [
+        ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'concat', '-safe', '0', '-i', list_path,
+    ]
+    comando += _audio_input(audio_path, copy_audio)
+    comando += ['-map', '0:v:0', '-c:v', 'copy']  # Sin recodificar: solo se reescriben los contenedores
+    comando += _audio_output(audio_path, copy_audio)
+    comando += [
+        '-t', str(total_duration),
+        '-movflags', '+faststart',
+        output_path,
+    ]
+    return comando
+
+
+def concat_segments(segment_paths, output_path, duration_per_image=DEFAULT_DURATION_PER_IMAGE,
+                    audio_path=None, ffmpeg_bin='ffmpeg', on_progress=None, copy_audio=False):
+    """Genera el video final concatenando segmentos ya codificados (y mezclando el audio)."""
+    list_path = f'{output_path}.segments.txt'
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            # Sintaxis del demuxer concat: comillas simples, escapando las que haya en la ruta
+            escapada = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escapada}'\n")
+    try:
+        total_duration = duration_per_image * len(segment_paths)
+        comando = build_concat_command(list_path, output_path, total_duration,
+                                       audio_path=audio_path, ffmpeg_bin=ffmpeg_bin, copy_audio=copy_audio)
+        logger.info("🔗 Concatenando %d segmentos en %s...", len(segment_paths), output_path)
+        run_ffmpeg(comando, total_duration, on_progress)
+    finally:
+        os.remove(list_path)
+
+
+# --- RENDICIONES HLS (BITRATE ADAPTATIVO) ---
+
+# (ancho, alto, bitrate máximo de video). Con fotos fijas el bitrate real suele quedar muy por debajo.
+HLS_LADDER = (
+    (640, 360, '600k'),
+    (960, 540, '1200k'),
+    (1280, 720, '2400k'),
+)
+HLS_SEGMENT_SECONDS = 6
+HLS_MASTER_PLAYLIST = 'master.m3u8'
+
+
+def build_hls_command(input_path, output_dir, ladder=HLS_LADDER, segment_seconds=HLS_SEGMENT_SECONDS,
+                      fps=FFMPEG_FPS, with_audio=True, ffmpeg_bin='ffmpeg'):
+    """
+    Construye el comando FFmpeg que empaqueta un MP4 en varias rendiciones HLS
+    con una lista maestra. Los fotogramas clave se fuerzan en los mismos
+    instantes en todas las rendiciones para que el reproductor pueda cambiar
+    de calidad en cualquier segmento. Con `fps=None` se conserva la cadencia
+    (variable) del origen, como la de los videos con efectos, y no se usa
+    `-tune stillimage`.
+    """
+    n = len(ladder)
+    salidas = ''.join(f'[v{i}]' for i in range(n))
+    filtros = [f'[0:v]split={n}{salidas}']
+    for i, (width, height, _) in enumerate(ladder):
+        filtros.append(f'[v{i}]scale={width}:{height},setsar=1[v{i}out]')
+
+    comando = [
+        ffmpeg_bin, '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', input_path,
+        '-filter_complex', ';'.join(filtros),
+    ]
+    for i, (width, height, maxrate) in enumerate(ladder):
+        comando += [
+            '-map', f'[v{i}out]',
+            f'-c:v:{i}', 'libx264',
+            f'-crf:v:{i}', '23',
+            f'-maxrate:v:{i}', maxrate,
+            f'-bufsize:v:{i}', maxrate,
+        ]
+        if with_audio:
+            comando += ['-map', '0:a:0']
+    comando += [
+        '-preset', 'veryfast',
+        '-pix_fmt', 'yuv420p',
+    ]
+    if fps:
+        # Slideshow clásico: solo fotos fijas. Los fundidos y el zoom no van con stillimage
+        comando += ['-tune', 'stillimage', '-r', str(fps), '-g', str(fps * segment_seconds)]
+    else:
+        comando += ['-fps_mode', 'passthrough', '-g', str(transitions.EFFECTS_FPS * segment_seconds)]
+    comando += [
+        '-sc_threshold', '0',
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})',
+    ]
+    if with_audio:
+        comando += ['-c:a', 'copy']  # El MP4 de origen ya lleva AAC: todas las rendiciones lo comparten
+        var_stream_map = ' '.join(f'v:{i},a:{i}' for i in range(n))
+    else:
+        var_stream_map = ' '.join(f'v:{i}' for i in range(n))
+
+    comando += [
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_playlist_type', 'vod',
+        '-hls_flags', 'independent_segments',
+        '-hls_segment_filename', os.path.join(output_dir, 'v%v', 'seg_%03d.ts'),
+        '-master_pl_name', HLS_MASTER_PLAYLIST,
+        '-var_stream_map', var_stream_map,
+        os.path.join(output_dir, 'v%v', 'index.m3u8'),
+    ]
+    return comando
+
+
+def package_hls(input_path, output_dir, with_audio=True, ladder=HLS_LADDER, ffmpeg_bin='ffmpeg',
+                duration=None, on_progress=None, fps=FFMPEG_FPS):
+    """
+    Genera la escalera de rendiciones HLS de un video ya codificado.
+    Con `duration` (segundos) y `on_progress` informa del avance.
+    Devuelve la ruta de la lista maestra.
+    """
+    for i in range(len(ladder)):
+        os.makedirs(os.path.join(output_dir, f'v{i}'), exist_ok=True)
+    comando = build_hls_command(input_path, output_dir, ladder=ladder, fps=fps,
+                                with_audio=with_audio, ffmpeg_bin=ffmpeg_bin)
+    logger.info("📦 Empaquetando %d rendiciones HLS en %s...", len(ladder), output_dir)
+    run_ffmpeg(comando, duration, on_progress)
+    return os.path.join(output_dir, HLS_MASTER_PLAYLIST)
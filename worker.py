@@ -0,0 +1,137 @@
+"""
+Punto de entrada del trabajador de video.
+
+Lanza N procesos codificadores que reclaman trabajos de la tabla `video_job`.
+Cada proceso tiene su propio intérprete (sin competir por el GIL con gunicorn)
+y el proceso supervisor reencola los trabajos abandonados, reinicia los
+procesos que mueran, cada STORAGE_SWEEP_INTERVAL_SECONDS barre el disco
+(archivos huérfanos, temporales abandonados y cachés por encima de su cuota) y cada
+hora recorta el historial de trabajos (VIDEO_HISTORY_RETENTION_DAYS). Al arrancar
+registra, por tandas, las fotos de las personas anteriores a la tabla Imagen.
+
+Uso:
+    python worker.py                 # tantos procesos como VIDEO_WORKER_PROCESSES
+    python worker.py --processes 2
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from app import (ROLE_WORKER, app, backfill_image_manifests, create_app, db, prune_video_history,
+                 requeue_stale_video_jobs, sweep_storage, video_worker)
+
+# Cada cuánto se recorta el historial de trabajos y tiempos por etapa
+PRUNE_INTERVAL_SECONDS = 3600
+# Personas cuyas fotos antiguas se registran en cada vuelta del supervisor
+BACKFILL_BATCH = 20
+
+
+def _run_encoder(worker_id, stop_event):
+    """Cuerpo de cada proceso codificador."""
+    # El supervisor gestiona las señales; los hijos terminan a través de stop_event.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    video_worker(worker_id=worker_id, stop_event=stop_event)
+
+
+def _en_supervisor(tarea, descripcion):
+    """
+    Ejecuta `tarea` de mantenimiento desde el supervisor y devuelve su resultado.
+    Un fallo no detiene al trabajador (devuelve None).
+    """
+    with app.app_context():
+        try:
+            return tarea()
+        except Exception as e:
+            app.logger.error(f"Error {descripcion}: {e}", exc_info=True)
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trabajador de generación de videos memoriales.')
+    parser.add_argument('--processes', type=int, default=app.config['VIDEO_WORKER_PROCESSES'],
+                        help='Número de procesos codificadores a lanzar.')
+    args = parser.parse_args()
+    num_processes = max(1, args.processes)
+
+    create_app(role=ROLE_WORKER)  # Carpetas y esquema; los codificadores se lanzan aquí abajo
+    with app.app_context():
+        reencolados = requeue_stale_video_jobs()
+        app.logger.info(f"Trabajos reencolados al iniciar: {reencolados}")
+        db.session.remove()
+
+    # 'spawn' evita heredar conexiones abiertas de la base de datos en los hijos
+    ctx = multiprocessing.get_context('spawn')
+    stop_event = ctx.Event()
+    host = socket.gethostname()
+
+    def _lanzar(indice):
+        worker_id = f'{host}:{os.getpid()}:{indice}'
+        proceso = ctx.Process(target=_run_encoder, args=(worker_id, stop_event),
+                              name=f'video-encoder-{indice}', daemon=False)
+        proceso.start()
+        return proceso
+
+    procesos = {i: _lanzar(i) for i in range(num_processes)}
+    app.logger.info(f"Trabajador de video iniciado con {num_processes} procesos codificadores.")
+
+    # El manejador solo anota la señal: llamar a stop_event.set() desde él bloquea el
+    # proceso si la señal llega mientras el hilo principal espera en ese mismo Event.
+    senales = []
+
+    def _detener(signum, frame):
+        senales.append(signum)
+
+    signal.signal(signal.SIGTERM, _detener)
+    signal.signal(signal.SIGINT, _detener)
+
+    intervalo = app.config['VIDEO_JOB_HEARTBEAT_SECONDS']
+    intervalo_barrido = app.config['STORAGE_SWEEP_INTERVAL_SECONDS']  # 0 = sin barrido automático
+    proximo_barrido = proximo_recorte = time.monotonic()  # Los primeros, en la primera vuelta del bucle
+    registrar_imagenes = True
+    while True:
+        limite = time.monotonic() + intervalo
+        while not senales and time.monotonic() < limite:
+            time.sleep(min(1, intervalo))
+        if senales:
+            break
+
+        # Reiniciar procesos que hayan muerto inesperadamente
+        for indice, proceso in list(procesos.items()):
+            if not proceso.is_alive():
+                app.logger.warning(f"El proceso {proceso.name} terminó con código {proceso.exitcode}. Reiniciando.")
+                procesos[indice] = _lanzar(indice)
+
+        # Reencolar trabajos cuyo trabajador dejó de enviar latidos
+        _en_supervisor(requeue_stale_video_jobs, 'al reencolar trabajos abandonados')
+
+        if intervalo_barrido and time.monotonic() >= proximo_barrido:
+            _en_supervisor(sweep_storage, 'en el barrido de almacenamiento')
+            proximo_barrido = time.monotonic() + intervalo_barrido
+
+        if time.monotonic() >= proximo_recorte:
+            _en_supervisor(prune_video_history, 'al recortar el historial de trabajos')
+            proximo_recorte = time.monotonic() + PRUNE_INTERVAL_SECONDS
+
+        # Por tandas, para no retrasar el reencolado; las subidas nuevas ya se registran al subirlas
+        if registrar_imagenes:
+            procesadas = _en_supervisor(lambda: backfill_image_manifests(BACKFILL_BATCH),
+                                        'al registrar las imágenes antiguas')
+            registrar_imagenes = procesadas == BACKFILL_BATCH
+
+    app.logger.info(f"Señal {senales[0]} recibida. Deteniendo los procesos codificadores...")
+    stop_event.set()
+    for proceso in procesos.values():
+        proceso.join(timeout=60)
+        if proceso.is_alive():
+            proceso.terminate()
+    app.logger.info("Trabajador de video detenido.")
+
+
+if __name__ == '__main__':
+    main()